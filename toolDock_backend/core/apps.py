@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self) -> None:
+        from django.db.backends.signals import connection_created
+        from .query_inspector import install_recorder
+        connection_created.connect(install_recorder)
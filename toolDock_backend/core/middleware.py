@@ -0,0 +1,52 @@
+import logging
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from .query_inspector import QueryBudgetExceeded, query_budget, record_queries
+
+logger = logging.getLogger(__name__)
+
+
+@sync_and_async_middleware
+def query_inspector_middleware(get_response):
+    """
+    Debug/CI guard: records the SQL query count and time of each request, reports repeated
+    statement shapes (N+1) and requests over their QUERY_BUDGETS entry.
+
+    Findings are logged and the counts returned as X-Query-Count / X-Query-Duration-Ms headers;
+    with QUERY_BUDGET_STRICT they raise QueryBudgetExceeded instead, so a test hitting the
+    endpoint fails. Enabled by QUERY_INSPECTOR_ENABLED (default: DEBUG). Works under WSGI and ASGI;
+    queries an async view runs while streaming its response (events) are not covered.
+    """
+    if not settings.QUERY_INSPECTOR_ENABLED:
+        raise MiddlewareNotUsed
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            # Queries of sync views and ORM calls run in worker threads are recorded too (see record_queries())
+            with record_queries() as log:
+                response = await get_response(request)
+            return _inspect(request, response, log)
+    else:
+        def middleware(request):
+            with record_queries() as log:
+                response = get_response(request)
+            return _inspect(request, response, log)
+
+    return middleware
+
+
+def _inspect(request, response, log):
+    problems = log.problems(query_budget(request.method, request.path))
+    if problems:
+        message = f'{request.method} {request.path}: ' + '; '.join(problems)
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+    response['X-Query-Count'] = str(log.count)
+    response['X-Query-Duration-Ms'] = f'{log.duration_ms:.1f}'
+    return response
@@ -0,0 +1,135 @@
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_shape(sql: str) -> str:
+    """SQL with parameters, literals and IN-list lengths erased: the same statement for another row has the same shape."""
+    shape = sql.replace('%s', '?')
+    shape = _STRING_LITERAL.sub('?', shape)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _PLACEHOLDER_LIST.sub('?...', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class QueryLog:
+    """SQL statements run on the ``using`` connection while recording, with their duration (see record_queries())."""
+
+    def __init__(self, using: str = 'default'):
+        self.using = using
+        self.queries: List[Tuple[str, float]] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.queries)
+
+    @property
+    def duration_ms(self) -> float:
+        return sum(seconds for _, seconds in self.queries) * 1000
+
+    def repeated_shapes(self, threshold: Optional[int] = None) -> List[Tuple[str, int]]:
+        """Statement shapes run at least ``threshold`` times: the signature of an N+1."""
+        threshold = threshold or settings.QUERY_REPEAT_THRESHOLD
+        shapes = Counter(query_shape(sql) for sql, _ in self.queries)
+        return [(shape, count) for shape, count in shapes.most_common() if count >= threshold]
+
+    def problems(self, budget: Optional[int] = None, threshold: Optional[int] = None) -> List[str]:
+        problems = []
+        if budget is not None and self.count > budget:
+            problems.append(f'{self.count} queries, budget is {budget}')
+        for shape, count in self.repeated_shapes(threshold):
+            problems.append(f'{count}x (likely N+1): {shape[:300]}')
+        return problems
+
+
+# Logs recording in the current context. sync_to_async runs its function in a copy of the caller's
+# context, so the queries a sync view (under ASGI) or an async view's ORM calls run in worker
+# threads still reach the request's logs
+_recording: ContextVar[Tuple[QueryLog, ...]] = ContextVar('query_logs', default=())
+
+
+def _record(execute, sql, params, many, context):
+    logs = _recording.get()
+    if not logs:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        for log in logs:
+            if log.using == context['connection'].alias:
+                log.queries.append((sql, elapsed))
+
+
+def install_recorder(sender, connection, **kwargs):
+    """connection_created receiver (CoreConfig.ready): every connection, in every thread, reports to the recording logs."""
+    if _record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record)
+
+
+@contextmanager
+def record_queries(using: str = 'default') -> Iterator[QueryLog]:
+    """
+    Record every statement run on the ``using`` connection in this context, including the threads it
+    hands work to through sync_to_async; works with DEBUG off and around async code.
+    """
+    log = QueryLog(using)
+    for connection in connections.all(initialized_only=True):
+        install_recorder(None, connection)  # Connected before the receiver was (e.g. in a shell)
+    token = _recording.set(_recording.get() + (log,))
+    try:
+        yield log
+    finally:
+        _recording.reset(token)
+
+
+def query_budget(method: str, path: str) -> Optional[int]:
+    """
+    The QUERY_BUDGETS entry for a request: the one with the longest matching path prefix; for two
+    keys with the same prefix, "METHOD /prefix/" wins over plain "/prefix/". None when no budget is declared.
+    """
+    best, best_rank = None, None
+    for key, budget in settings.QUERY_BUDGETS.items():
+        key_method, _, prefix = key.rpartition(' ')
+        if key_method and key_method.upper() != method.upper():
+            continue
+        if path.startswith(prefix):
+            rank = (len(prefix), bool(key_method))
+            if best_rank is None or rank > best_rank:
+                best, best_rank = budget, rank
+    return best
+
+
+@contextmanager
+def assert_max_queries(budget: Optional[int] = None, method: Optional[str] = None, path: Optional[str] = None,
+                       threshold: Optional[int] = None) -> Iterator[QueryLog]:
+    """
+    Test helper: fail with QueryBudgetExceeded if the block runs more than ``budget`` queries
+    (default: the QUERY_BUDGETS entry for ``method`` and ``path``) or repeats a statement shape.
+
+        with assert_max_queries(method='GET', path='/scans/histories/'):
+            client.get('/scans/histories/')
+    """
+    if budget is None and path is not None:
+        budget = query_budget(method or 'GET', path)
+    with record_queries() as log:
+        yield log
+    problems = log.problems(budget, threshold)
+    if problems:
+        raise QueryBudgetExceeded('\n'.join(problems))
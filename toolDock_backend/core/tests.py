@@ -1,3 +1,112 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+from .models import User
+from .query_inspector import QueryBudgetExceeded, assert_max_queries, query_budget, record_queries
+
+
+@override_settings(METRICS_ENABLED=False)
+class UserEndpointTests(TestCase):
+    @staticmethod
+    def register(client, **data):
+        data = {
+            'username': 'carol', 'email': 'carol@example.com', 'first_name': 'Carol', 'last_name': 'Jones',
+            'password': 'a-long-passphrase-42', 'confirm_password': 'a-long-passphrase-42', **data,
+        }
+        return client.post('/auth/users/', data, format='json')
+
+    def test_register_returns_a_usable_token(self):
+        client = APIClient()
+        response = self.register(client)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['user']['email'], 'carol@example.com')
+        self.assertTrue(User.objects.get(username='carol').profile)
+
+        client.credentials(HTTP_AUTHORIZATION=f"JWT {response.data['token']}")
+        me = client.get('/auth/users/me/')
+        self.assertEqual(me.status_code, 200)
+        self.assertEqual(me.data['name'], 'Carol Jones')
+        self.assertIn('profile', me.data)
+
+    def test_register_rejects_mismatched_passwords(self):
+        response = self.register(APIClient(), confirm_password='something-else-42')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('confirm_password', response.data)
+
+    def test_me_requires_authentication(self):
+        self.assertEqual(APIClient().get('/auth/users/me/').status_code, 401)
+
+
+class RecordQueriesTests(TestCase):
+    def test_counts_queries_with_debug_off(self):
+        with record_queries() as outer:
+            User.objects.count()
+            with record_queries() as inner:
+                User.objects.exists()
+        self.assertEqual((outer.count, inner.count), (2, 1))
+        self.assertIn('COUNT', outer.queries[0][0])
+
+    async def test_follows_the_context_into_sync_to_async_threads(self):
+        with record_queries() as log:
+            await sync_to_async(User.objects.count)()
+            await User.objects.acount()
+        self.assertEqual(log.count, 2)
+        # Nothing is recorded outside the block
+        await User.objects.acount()
+        self.assertEqual(log.count, 2)
+
+
+class QueryBudgetTests(TestCase):
+    @override_settings(QUERY_BUDGETS={'GET /a/': 1, '/a/': 2, '/a/b/': 3, 'POST /a/b/': 4})
+    def test_longest_prefix_wins_then_method(self):
+        self.assertEqual(query_budget('GET', '/a/x/'), 1)
+        self.assertEqual(query_budget('POST', '/a/x/'), 2)
+        self.assertEqual(query_budget('GET', '/a/b/c/'), 3)
+        self.assertEqual(query_budget('post', '/a/b/'), 4)
+        self.assertIsNone(query_budget('GET', '/z/'))
+
+    def test_assert_max_queries(self):
+        with assert_max_queries(2) as log:
+            User.objects.count()
+            User.objects.exists()
+        self.assertEqual(log.count, 2)
+        with self.assertRaisesMessage(QueryBudgetExceeded, '2 queries, budget is 1'), assert_max_queries(1):
+            User.objects.count()
+            User.objects.exists()
+
+    def test_assert_max_queries_reports_repeated_statements(self):
+        users = [User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com') for i in range(3)]
+        with self.assertRaisesMessage(QueryBudgetExceeded, '3x (likely N+1)'), assert_max_queries(threshold=3):
+            for user in users:
+                User.objects.get(pk=user.pk)
+
+
+@override_settings(METRICS_ENABLED=False, QUERY_INSPECTOR_ENABLED=True, QUERY_BUDGET_STRICT=True)
+class QueryInspectorMiddlewareTests(TestCase):
+    """Strict mode, as in CI: a request over its QUERY_BUDGETS entry fails."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='dave', email='dave@example.com', password='secret-pass-123')
+        self.auth = f'JWT {RefreshToken.for_user(self.user).access_token}'
+
+    def test_user_endpoints_stay_within_their_budgets(self):
+        response = UserEndpointTests.register(APIClient())
+        self.assertEqual(response.status_code, 201)
+        self.assertLessEqual(int(response['X-Query-Count']), query_budget('POST', '/auth/users/'))
+
+        response = APIClient().get('/auth/users/me/', HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response['X-Query-Count'], '2')
+
+    @override_settings(QUERY_BUDGETS={'/auth/users/me/': 1})
+    def test_request_over_budget_fails(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'GET /auth/users/me/: 2 queries, budget is 1'):
+            APIClient().get('/auth/users/me/', HTTP_AUTHORIZATION=self.auth)
+
+    async def test_requests_served_under_asgi_are_inspected(self):
+        response = await AsyncClient().get('/auth/users/me/', headers={'Authorization': self.auth})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Query-Count'], '2')
+        with override_settings(QUERY_BUDGETS={'/auth/users/me/': 1}), self.assertRaises(QueryBudgetExceeded):
+            await AsyncClient().get('/auth/users/me/', headers={'Authorization': self.auth})
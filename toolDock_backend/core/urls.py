@@ -0,0 +1,9 @@
+from rest_framework.routers import DefaultRouter
+
+from .views import UserViewSet
+
+# Same routes as djoser.urls, served by core's UserViewSet
+router = DefaultRouter()
+router.register("users", UserViewSet)
+
+urlpatterns = router.urls
@@ -1,3 +1,8 @@
-from django.shortcuts import render
+from djoser.views import UserViewSet as BaseUserViewSet
 
-# Create your views here.
+from .models import User
+
+
+class UserViewSet(BaseUserViewSet):
+    # UserSerializer embeds the profile: join it rather than one query per listed user
+    queryset = User.objects.select_related('profile')
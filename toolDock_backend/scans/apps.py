@@ -7,4 +7,9 @@ class ScansConfig(AppConfig):
 
     def ready(self)-> None:
         import scans.signales.handlers
+        from django.conf import settings
+        from .progress import load_progress_backend
+        from .utils import runner_registry
+        runner_registry.load(settings.TOOL_RUNNERS)
+        load_progress_backend(settings.SCAN_PROGRESS_BACKEND)
 
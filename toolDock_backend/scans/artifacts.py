@@ -0,0 +1,137 @@
+import gzip
+import hashlib
+import os
+from pathlib import Path
+from typing import IO, Iterator, Optional, Tuple
+
+from django.conf import settings
+
+PREVIEW_LENGTH = 500
+
+
+def artifact_path(job_id, part: Optional[str] = None) -> Path:
+    """
+    Location of a job's compressed raw output, fanned out by the first two hex chars of the id.
+
+    ``part`` names an intermediate artifact of the job, e.g. the output of one shard.
+    """
+    job_id = str(job_id)
+    name = f'{job_id}.{part}.xml.gz' if part else f'{job_id}.xml.gz'
+    return Path(settings.SCAN_ARTIFACTS_DIR) / job_id[:2] / name
+
+
+class ArtifactWriter:
+    """
+    Write a job's raw tool output to gzip-compressed artifact storage as it is produced.
+
+    Tracks the uncompressed size, a SHA-256 of the content and a short preview while
+    writing, so the ScanJob row only needs those three values. Data goes to a temporary
+    file that replaces the artifact on a clean exit and is removed otherwise.
+    """
+
+    def __init__(self, job_id, part: Optional[str] = None):
+        self.path = artifact_path(job_id, part)
+        self.size = 0
+        self.preview = ''
+        self._hash = hashlib.sha256()
+        self._tmp_path = self.path.with_name(self.path.name + '.part')
+        self._file: Optional[IO[bytes]] = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = gzip.open(self._tmp_path, 'wb', compresslevel=settings.SCAN_ARTIFACTS_COMPRESSLEVEL)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close() # type: ignore
+        if exc_type is None:
+            os.replace(self._tmp_path, self.path)
+        else:
+            self._tmp_path.unlink(missing_ok=True)
+        return False
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def write(self, chunk: str) -> None:
+        if len(self.preview) < PREVIEW_LENGTH:
+            self.preview += chunk[:PREVIEW_LENGTH - len(self.preview)]
+        data = chunk.encode('utf-8')
+        self._hash.update(data)
+        self.size += len(data)
+        self._file.write(data) # type: ignore
+
+    def tee(self, lines: Iterator[str]) -> Iterator[str]:
+        """Pass lines through unchanged while writing each one to the artifact."""
+        for line in lines:
+            self.write(line)
+            yield line
+
+    def save_to(self, job) -> None:
+        job.raw_output_size = self.size
+        job.raw_output_sha256 = self.sha256
+        job.raw_output_preview = self.preview
+
+
+def write_artifact(job_id, raw_output: str) -> ArtifactWriter:
+    with ArtifactWriter(job_id) as writer:
+        writer.write(raw_output)
+    return writer
+
+
+def open_artifact(job_id, part: Optional[str] = None) -> IO[bytes]:
+    """Open a job's artifact for reading uncompressed bytes. Raises FileNotFoundError if there is none."""
+    return gzip.open(artifact_path(job_id, part), 'rb')
+
+
+def read_artifact(job_id) -> str:
+    with open_artifact(job_id) as f:
+        return f.read().decode('utf-8')
+
+
+def iter_artifact_range(job_id, start: int, length: int, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Yield ``length`` uncompressed bytes of a job's artifact starting at ``start``.
+
+    gzip has no random access, so the seek decompresses up to ``start``; reads are chunked
+    so the whole artifact is never held in memory.
+    """
+    with open_artifact(job_id) as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def parse_range_header(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range ``Range: bytes=...`` header into an inclusive (start, end) pair.
+
+    Returns None when the header is missing or malformed (the range is then ignored) and
+    raises ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start_text, _, end_text = header[len('bytes='):].strip().partition('-')
+    try:
+        start = int(start_text) if start_text else None
+        end = int(end_text) if end_text else None
+    except ValueError:
+        return None
+
+    if start is None:
+        # Suffix range: the last N bytes
+        if not end:
+            raise ValueError(f'Unsatisfiable range: {header}')
+        start, end = max(size - end, 0), size - 1
+    elif end is None:
+        end = size - 1
+
+    if start >= size or end < start:
+        raise ValueError(f'Unsatisfiable range: {header}')
+    return start, min(end, size - 1)
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .artifacts import artifact_path
+from .models import Finding, FindingCve, ScanJob
+from .progress import publish_job_state
+
+# Options that change how a scan is executed but not what it finds
+NON_RESULT_OPTIONS = {'force_refresh', 'shards', 'timeout', 'idle_timeout'}
+
+
+def normalize_target(target: str) -> str:
+    parsed = urlparse(target)
+    if parsed.scheme in ('http', 'https'):
+        target = parsed.netloc
+    return ' '.join(sorted(set(target.lower().replace(',', ' ').split())))
+
+
+def scan_cache_key(tool_name: str, target: str, options: dict) -> str:
+    """Content address of a scan: same tool, same (normalized) target, same result-affecting options."""
+    relevant = {k: v for k, v in (options or {}).items() if k not in NON_RESULT_OPTIONS}
+    payload = json.dumps([tool_name.lower(), normalize_target(target), relevant], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def find_reusable_job(job: ScanJob) -> Optional[ScanJob]:
+    """
+    Latest execution of the same user with the same cache key that is still in flight, or completed
+    within SCAN_CACHE_TTL. Results are never shared across users.
+
+    Only jobs that actually ran (not ones that were themselves attached) qualify. Two identical
+    submissions racing each other can both miss and scan twice; that costs a scan, never correctness.
+    """
+    if not job.cache_key or settings.SCAN_CACHE_TTL <= 0:
+        return None
+    fresh_since = timezone.now() - timedelta(seconds=settings.SCAN_CACHE_TTL)
+    return (
+        ScanJob.objects
+        .filter(user_id=job.user_id, cache_key=job.cache_key, source_job__isnull=True)
+        .filter(Q(status__in=('queued', 'running')) | Q(status='completed', completed_at__gte=fresh_since))
+        .exclude(pk=job.pk)
+        .order_by('-created_at')
+        .first()
+    )
+
+
+def find_reusable_jobs(user, cache_keys: Iterable[str]) -> Dict[str, ScanJob]:
+    """find_reusable_job() for many of ``user``'s cache keys at once (batch submissions): latest reusable job per key."""
+    cache_keys = sorted(set(filter(None, cache_keys)))
+    if not cache_keys or settings.SCAN_CACHE_TTL <= 0:
+        return {}
+    fresh_since = timezone.now() - timedelta(seconds=settings.SCAN_CACHE_TTL)
+    found = {}
+    for start in range(0, len(cache_keys), 1000):
+        candidates = (
+            ScanJob.objects
+            .filter(user=user, cache_key__in=cache_keys[start:start + 1000], source_job__isnull=True)
+            .filter(Q(status__in=('queued', 'running')) | Q(status='completed', completed_at__gte=fresh_since))
+            .only('job_id', 'cache_key', 'status', 'created_at')
+            .order_by('created_at')
+        )
+        for candidate in candidates:
+            found[candidate.cache_key] = candidate  # Latest wins
+    return found
+
+
+def settle_attached(jobs: List[ScanJob]) -> None:
+    """
+    For jobs inserted already attached to a source (bulk_create sets ``source_job`` up front):
+    settle the ones whose source finished before they existed, as attach_to() does for one job.
+    """
+    source_ids = {job.source_job_id for job in jobs if job.source_job_id}
+    if not source_ids:
+        return
+    finished = ScanJob.objects.filter(pk__in=source_ids, status__in=('completed', 'failed', 'cancelled')).in_bulk()
+    for job in jobs:
+        if job.source_job_id in finished:
+            _settle(finished[job.source_job_id], job)
+
+
+def attach_to(job: ScanJob, source: ScanJob) -> None:
+    """Make ``job`` reuse ``source``'s execution instead of launching its own (single-flight)."""
+    job.source_job = source
+    job.current_step = f'Waiting for identical scan {source.job_id}'
+    job.save(update_fields=['source_job', 'current_step'])
+
+    # The source may have finished between the lookup and the attach; settle right away then
+    source.refresh_from_db(fields=['status'])
+    if source.status in ('completed', 'failed', 'cancelled'):
+        _settle(source, job)
+
+
+def clone_results(source: ScanJob, job: ScanJob) -> None:
+    """
+    Copy a completed job's findings, summary and raw output onto ``job`` and complete it.
+
+    Findings and their CVE links are copied with INSERT ... SELECT, so no rows travel through Python.
+    Only a still-queued ``job`` is cloned, so concurrent settles cannot copy twice.
+    """
+    if not ScanJob.objects.filter(pk=job.pk, status='queued').update(status='running'):
+        return
+
+    finding_table = connection.ops.quote_name(Finding._meta.db_table)
+    job_column = connection.ops.quote_name(Finding._meta.get_field('job').column)
+    columns = ', '.join(
+        connection.ops.quote_name(field.column)
+        for field in Finding._meta.concrete_fields
+        if not field.primary_key and field.name != 'job'
+    )
+    finding_pk = connection.ops.quote_name(Finding._meta.pk.column)
+    fingerprint_column = connection.ops.quote_name(Finding._meta.get_field('fingerprint').column)
+    link_table = connection.ops.quote_name(FindingCve._meta.db_table)
+    link_finding = connection.ops.quote_name(FindingCve._meta.get_field('finding').column)
+    link_cve = connection.ops.quote_name(FindingCve._meta.get_field('cve').column)
+    pk_field = ScanJob._meta.pk
+    job_pk = pk_field.get_db_prep_value(job.pk, connection)
+    source_pk = pk_field.get_db_prep_value(source.pk, connection)
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {finding_table} ({job_column}, {columns}) '
+                f'SELECT %s, {columns} FROM {finding_table} WHERE {job_column} = %s',
+                [job_pk, source_pk],
+            )
+            # Copies are matched to their originals by fingerprint, which covers the CVE set
+            cursor.execute(
+                f'INSERT INTO {link_table} ({link_finding}, {link_cve}) '
+                f'SELECT DISTINCT copied.{finding_pk}, link.{link_cve} FROM {finding_table} copied '
+                f'JOIN {finding_table} original ON original.{job_column} = %s AND original.{fingerprint_column} = copied.{fingerprint_column} '
+                f'JOIN {link_table} link ON link.{link_finding} = original.{finding_pk} '
+                f'WHERE copied.{job_column} = %s',
+                [source_pk, job_pk],
+            )
+
+        copied = ['total_findings', 'max_cvss', *ScanJob.SEVERITY_COUNTERS.values(),
+                  'raw_output_size', 'raw_output_sha256', 'raw_output_preview']
+        for field in copied:
+            setattr(job, field, getattr(source, field))
+        job.status = 'completed'
+        job.progress = 100
+        job.current_step = f'Reused results of scan {source.job_id}'
+        job.started_at = job.started_at or timezone.now()
+        job.completed_at = timezone.now()
+        job.save(update_fields=[*copied, 'status', 'progress', 'current_step', 'started_at', 'completed_at'])
+
+    _share_artifact(source, job)
+    publish_job_state(job)
+
+
+def _share_artifact(source: ScanJob, job: ScanJob) -> None:
+    source_path, path = artifact_path(source.job_id), artifact_path(job.job_id)
+    if not source_path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(source_path, path)  # Artifacts are immutable once written, so a hard link is enough
+    except OSError:
+        shutil.copyfile(source_path, path)
+
+
+def release_attached_jobs(source: ScanJob) -> None:
+    """
+    Settle the jobs waiting on ``source`` once it has finished.
+
+    Completed: each one gets a copy of the results. Failed or cancelled: each one is detached
+    and scheduled as a scan of its own.
+    """
+    for job in ScanJob.objects.filter(source_job=source, status='queued'):
+        _settle(source, job)
+
+
+def _settle(source: ScanJob, job: ScanJob) -> None:
+    from .scheduler import dispatch_pending # type: ignore
+
+    if source.status == 'completed':
+        clone_results(source, job)
+    elif ScanJob.objects.filter(pk=job.pk, status='queued', source_job=source).update(source_job=None, current_step=''):
+        # Back in the scheduler's pending set
+        dispatch_pending()
@@ -0,0 +1,130 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Set
+
+import redis
+from django.conf import settings
+
+from tools.engine import ProcessScope, get_engine
+
+from .progress import get_redis
+
+logger = logging.getLogger(__name__)
+
+CANCEL_CHANNEL = 'scans:cancel'
+
+
+def cancel_key(job_id) -> str:
+    return f'scans:cancel:{job_id}'
+
+
+def scan_timeouts(tool_name: str, options: dict) -> Dict[str, Optional[float]]:
+    """
+    Wall-clock and idle-output limits for a scan, in seconds.
+
+    Per-tool values come from SCAN_TOOL_TIMEOUTS (falling back to SCAN_DEFAULT_TIMEOUTS);
+    ``options['timeout']`` / ``options['idle_timeout']`` can only tighten them.
+    """
+    limits = {**settings.SCAN_DEFAULT_TIMEOUTS, **settings.SCAN_TOOL_TIMEOUTS.get(tool_name.lower(), {})}
+    for name in ('timeout', 'idle_timeout'):
+        try:
+            requested = float(options.get(name) or 0)
+        except (TypeError, ValueError):
+            requested = 0
+        if requested > 0:
+            limits[name] = min(limits[name], requested) if limits.get(name) else requested
+    return {'timeout': limits.get('timeout'), 'idle_timeout': limits.get('idle_timeout')}
+
+
+def request_cancel(job_id) -> None:
+    """
+    Ask whichever worker runs ``job_id`` to kill its tool processes.
+
+    The key covers a worker that has not started the scan yet; the message reaches one already running it.
+    """
+    try:
+        client = get_redis()
+        client.set(cancel_key(job_id), 1, ex=settings.SCAN_PROGRESS_TTL)
+        client.publish(CANCEL_CHANNEL, str(job_id))
+    except redis.RedisError:
+        # The job is still marked cancelled; its processes stop at their timeout
+        logger.warning('Could not deliver cancel request for job %s', job_id, exc_info=True)
+
+
+class CancelListener:
+    """
+    One background thread per worker process, subscribed to CANCEL_CHANNEL.
+
+    Scans register their ProcessScope under their job id while they run; a cancel message
+    for that id cancels every registered scope, which kills the tool processes at once.
+    """
+
+    def __init__(self):
+        self._scopes: Dict[str, Set[ProcessScope]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._subscribed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_running(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._subscribed.clear()
+                self._thread = threading.Thread(target=self._run, name='scan-cancel-listener', daemon=True)
+                self._thread.start()
+        self._subscribed.wait(timeout=5)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CANCEL_CHANNEL)
+                self._subscribed.set()
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        time.sleep(0.05)
+                        continue
+                    self._cancel(message['data'].decode() if isinstance(message['data'], bytes) else message['data'])
+            except redis.RedisError:
+                logger.warning('Cancel listener lost its Redis connection, reconnecting', exc_info=True)
+                self._subscribed.set()  # Don't hold up scans; cancel keys are still checked on start
+                time.sleep(1)
+
+    def _cancel(self, job_id: str) -> None:
+        with self._lock:
+            scopes = list(self._scopes.get(job_id, ()))
+        for scope in scopes:
+            scope.cancel()
+
+    @contextmanager
+    def watch(self, job_id, scope: ProcessScope) -> Iterator[None]:
+        self._ensure_running()
+        job_id = str(job_id)
+        with self._lock:
+            self._scopes[job_id].add(scope)
+        try:
+            # A cancel requested before the scan registered came as a message nobody received
+            if get_redis().exists(cancel_key(job_id)):
+                scope.cancel()
+        except redis.RedisError:
+            pass
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._scopes[job_id].discard(scope)
+                if not self._scopes[job_id]:
+                    del self._scopes[job_id]
+
+
+cancel_listener = CancelListener()
+
+
+@contextmanager
+def runner_scope(job_id, tool_name: str, options: dict) -> Iterator[ProcessScope]:
+    """Run a scan's tool processes under its timeouts, cancellable through request_cancel()."""
+    with get_engine().scope(**scan_timeouts(tool_name, options)) as scope, cancel_listener.watch(job_id, scope):
+        yield scope
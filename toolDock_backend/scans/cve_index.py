@@ -0,0 +1,195 @@
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# SQLite's default limit on bound parameters is 999
+LOOKUP_CHUNK = 900
+
+SCHEMA = '''
+CREATE TABLE cve (
+    id TEXT PRIMARY KEY,
+    cvss REAL NOT NULL,
+    vector TEXT NOT NULL,
+    cwe TEXT NOT NULL,
+    remediation TEXT NOT NULL
+) WITHOUT ROWID
+'''
+
+
+@dataclass(frozen=True)
+class CveRecord:
+    cve_id: str
+    cvss: float
+    vector: str
+    cwe_ids: Tuple[str, ...]
+    remediation: str
+
+
+class CveIndex:
+    """
+    Read-only, memory-mapped SQLite index of CVEs, built by the load_cve_index command.
+
+    Lookups are batched: one query per LOOKUP_CHUNK distinct ids against the primary key,
+    so enriching a whole batch of findings costs a few microseconds per CVE.
+    Connections are per thread, as SQLite connections cannot be shared across threads.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f'{self.path.as_uri()}?mode=ro', uri=True, check_same_thread=False)
+            conn.execute(f'PRAGMA mmap_size = {settings.CVE_INDEX_MMAP_SIZE}')
+            conn.execute('PRAGMA query_only = ON')
+            self._local.conn = conn
+        return conn
+
+    def lookup_many(self, cve_ids: Iterable[str]) -> Dict[str, CveRecord]:
+        ids = sorted({cve_id.upper() for cve_id in cve_ids if cve_id})
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(ids), LOOKUP_CHUNK):
+            chunk = ids[start:start + LOOKUP_CHUNK]
+            rows = conn.execute(
+                f'SELECT id, cvss, vector, cwe, remediation FROM cve WHERE id IN ({",".join("?" * len(chunk))})', chunk,
+            )
+            for cve_id, cvss, vector, cwe, remediation in rows:
+                found[cve_id] = CveRecord(cve_id, cvss, vector, tuple(filter(None, cwe.split(','))), remediation)
+        return found
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM cve').fetchone()[0]
+
+
+_index: Optional[CveIndex] = None
+_index_mtime: Optional[float] = None
+
+
+def get_cve_index() -> Optional[CveIndex]:
+    """The configured index, or None if none has been built; reopened when load_cve_index replaces the file."""
+    global _index, _index_mtime
+    path = Path(settings.CVE_INDEX_PATH)
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    if _index is None or mtime != _index_mtime:
+        _index, _index_mtime = CveIndex(path), mtime
+    return _index
+
+
+# --- Building the index from NVD JSON dumps ---------------------------------------------------------
+
+def _open_dump(path: Path):
+    return gzip.open(path, 'rt', encoding='utf-8') if path.suffix == '.gz' else open(path, encoding='utf-8')
+
+
+def _patch_remediation(references: List[Dict]) -> str:
+    patches = [ref['url'] for ref in references if {'Patch', 'Vendor Advisory', 'Mitigation'} & set(ref.get('tags') or [])]
+    if not patches:
+        return ''
+    return 'Apply the vendor fix or mitigation: ' + ' '.join(patches[:3])
+
+
+def _from_nvd_1_1(item: Dict) -> Tuple:
+    """An entry of a legacy NVD 1.1 data feed (``CVE_Items``)."""
+    cve = item['cve']
+    impact = item.get('impact', {})
+    metric = impact.get('baseMetricV3', {}).get('cvssV3') or impact.get('baseMetricV2', {}).get('cvssV2') or {}
+    cwes = [
+        desc['value']
+        for problem in cve.get('problemtype', {}).get('problemtype_data', [])
+        for desc in problem.get('description', [])
+        if desc.get('value', '').startswith('CWE-')
+    ]
+    return (
+        cve['CVE_data_meta']['ID'],
+        float(metric.get('baseScore') or 0.0),
+        metric.get('vectorString', ''),
+        ','.join(dict.fromkeys(cwes)),
+        _patch_remediation(cve.get('references', {}).get('reference_data', [])),
+    )
+
+
+def _from_nvd_2_0(entry: Dict) -> Tuple:
+    """An entry of an NVD API 2.0 response / dump (``vulnerabilities``)."""
+    cve = entry['cve']
+    metrics = cve.get('metrics', {})
+    metric = {}
+    for key in ('cvssMetricV40', 'cvssMetricV31', 'cvssMetricV30', 'cvssMetricV2'):
+        if metrics.get(key):
+            # Prefer NVD's own (Primary) assessment over CNA ones
+            candidates = sorted(metrics[key], key=lambda m: m.get('type') != 'Primary')
+            metric = candidates[0].get('cvssData', {})
+            break
+    cwes = [
+        desc['value']
+        for weakness in cve.get('weaknesses', [])
+        for desc in weakness.get('description', [])
+        if desc.get('value', '').startswith('CWE-')
+    ]
+    return (
+        cve['id'],
+        float(metric.get('baseScore') or 0.0),
+        metric.get('vectorString', ''),
+        ','.join(dict.fromkeys(cwes)),
+        _patch_remediation(cve.get('references', [])),
+    )
+
+
+def iter_nvd_records(path: Path) -> Iterator[Tuple]:
+    """Rows (id, cvss, vector, cwe, remediation) from one NVD JSON dump (.json or .json.gz, feed 1.1 or API 2.0)."""
+    with _open_dump(path) as f:
+        data = json.load(f)
+    if 'CVE_Items' in data:
+        yield from map(_from_nvd_1_1, data['CVE_Items'])
+    elif 'vulnerabilities' in data:
+        yield from map(_from_nvd_2_0, data['vulnerabilities'])
+    else:
+        raise ValueError(f'{path}: not an NVD JSON 1.1 feed or 2.0 dump')
+
+
+def build_cve_index(dumps: Iterable[Path], output: Path) -> int:
+    """
+    Build a fresh index from NVD dumps and atomically swap it in at ``output``.
+
+    Later dumps win for duplicate ids, so pass yearly feeds oldest first and "modified" feeds last.
+    :return: number of CVEs in the index
+    """
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_name(output.name + '.part')
+    tmp_path.unlink(missing_ok=True)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute(SCHEMA)
+        for dump in dumps:
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO cve VALUES (?, ?, ?, ?, ?)', iter_nvd_records(Path(dump)))
+            logger.info('Loaded %s', dump)
+        count = conn.execute('SELECT COUNT(*) FROM cve').fetchone()[0]
+        conn.execute('VACUUM')
+    except BaseException:
+        conn.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    conn.close()
+
+    os.replace(tmp_path, output)
+    return count
@@ -0,0 +1,31 @@
+from typing import Dict, Optional
+
+from django.db.models import Exists, OuterRef, QuerySet
+
+from .models import Finding, ScanJob
+
+
+def previous_scan(job: ScanJob) -> Optional[ScanJob]:
+    """The user's latest completed scan of the same target with the same tool and options, before ``job``."""
+    candidates = ScanJob.objects.filter(user_id=job.user_id, status='completed', created_at__lt=job.created_at).exclude(pk=job.pk)
+    if job.cache_key:
+        candidates = candidates.filter(cache_key=job.cache_key)
+    else:
+        candidates = candidates.filter(tool_id=job.tool_id, target=job.target)
+    return candidates.order_by('-created_at').first()
+
+
+def diff_scans(base: ScanJob, head: ScanJob) -> Dict[str, QuerySet]:
+    """
+    Split findings into new (only in ``head``), resolved (only in ``base``) and unchanged (in both, as ``head``'s rows).
+
+    Each set is one query: an (anti-)semi-join on fingerprint served by the (job, fingerprint)
+    index, so the database does the set arithmetic and no finding is compared in Python.
+    """
+    in_base = Exists(Finding.objects.filter(job=base, fingerprint=OuterRef('fingerprint')))
+    in_head = Exists(Finding.objects.filter(job=head, fingerprint=OuterRef('fingerprint')))
+    return {
+        'new': head.findings.filter(~in_base),
+        'resolved': base.findings.filter(~in_head),
+        'unchanged': head.findings.filter(in_base),
+    }
@@ -0,0 +1,66 @@
+import logging
+from typing import Dict, List
+
+from .cve_index import CveRecord, get_cve_index
+from .models import Cve, Finding
+from .parsers import cvss_severity
+
+logger = logging.getLogger(__name__)
+
+# Per-CVE remediation lines appended to one finding
+MAX_REMEDIATIONS = 5
+# Cve columns filled from the index
+CVE_INDEX_FIELDS = ['cvss_score', 'cvss_vector', 'cwe_ids']
+
+
+def enrich_findings(findings: List[Finding]) -> Dict[str, CveRecord]:
+    """
+    Attach CVSS vector, CWE ids and remediation from the local CVE index to unsaved findings, in place.
+
+    All CVE ids of the batch are resolved in one index pass. The score printed by vulners is
+    kept; the index only fills it in (and the severity) when vulners gave none.
+    :return: the index records found, by CVE id (empty when no index is installed)
+    """
+    cve_ids = {cve_id.upper() for finding in findings for cve_id in finding.cve_ids}
+    if not cve_ids:
+        return {}
+    index = get_cve_index()
+    if index is None:
+        return {}
+    records = index.lookup_many(cve_ids)
+
+    for finding in findings:
+        matched = [records[cve_id.upper()] for cve_id in finding.cve_ids if cve_id.upper() in records]
+        if not matched:
+            continue
+        worst = max(matched, key=lambda record: record.cvss)
+        finding.cvss_vector = worst.vector
+        finding.cwe_ids = list(dict.fromkeys(cwe for record in matched for cwe in record.cwe_ids))
+        if not finding.cvss_score and worst.cvss:
+            finding.cvss_score = worst.cvss
+            finding.severity = cvss_severity(worst.cvss) or finding.severity
+
+        remediations = [f'{record.cve_id}: {record.remediation}' for record in matched if record.remediation]
+        if remediations:
+            finding.remediation = '\n'.join([finding.remediation, *remediations[:MAX_REMEDIATIONS]]).strip()
+    return records
+
+
+def refresh_cves(batch_size: int = 1000) -> int:
+    """
+    Update the Cve rows the installed index has a record for, e.g. ones first seen before it was built.
+    :return: number of rows updated
+    """
+    index = get_cve_index()
+    if index is None:
+        return 0
+    updated = 0
+    cve_ids = Cve.objects.order_by('pk').values_list('pk', flat=True)
+    for start in range(0, cve_ids.count(), batch_size):
+        records = index.lookup_many(cve_ids[start:start + batch_size])
+        cves = [
+            Cve(cve_id=record.cve_id, cvss_score=record.cvss, cvss_vector=record.vector, cwe_ids=list(record.cwe_ids))
+            for record in records.values()
+        ]
+        updated += Cve.objects.bulk_update(cves, CVE_INDEX_FIELDS)
+    return updated
@@ -0,0 +1,95 @@
+import math
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ScanDurationStats
+from .sharding import count_addresses
+
+
+def duration_group(tool_id: int, target: str, options: Optional[dict]) -> Dict:
+    """The ScanDurationStats group of a scan: tool, scan type, port spec and target size (power of two)."""
+    options = options or {}
+    return {
+        'tool_id': tool_id,
+        'scan_type': (str(options.get('scan_type') or '') + ('+incremental' if options.get('incremental') else ''))[:32],
+        'port_spec': str(options.get('ports') or '')[:100],
+        'size_bucket': int(math.log2(max(count_addresses(target), 1))),
+    }
+
+
+class DurationModel:
+    """
+    Expected scan durations learned from ScanDurationStats.
+
+    The exact group is used once it has SCAN_DURATION_MIN_SAMPLES samples; otherwise the
+    nearest target size with the same tool, scan type and ports, then all sizes of the
+    tool and scan type, then the whole tool; Tool.estimated_duration when nothing matches.
+    """
+
+    def __init__(self, stats: Iterable[ScanDurationStats]):
+        self.min_samples = settings.SCAN_DURATION_MIN_SAMPLES
+        self.by_ports: Dict[Tuple, List[ScanDurationStats]] = defaultdict(list)
+        self.totals: Dict[Tuple, List[float]] = defaultdict(lambda: [0, 0.0])  # (samples, summed seconds)
+        for row in stats:
+            if row.count < self.min_samples:
+                continue
+            self.by_ports[(row.tool_id, row.scan_type, row.port_spec)].append(row)
+            for key in ((row.tool_id, row.scan_type), (row.tool_id,)):
+                self.totals[key][0] += row.count
+                self.totals[key][1] += row.count * row.mean
+
+    @classmethod
+    def for_tools(cls, tool_ids: Iterable[int]) -> 'DurationModel':
+        return cls(ScanDurationStats.objects.filter(tool_id__in=set(tool_ids)))
+
+    def estimate(self, tool, target: str, options: Optional[dict]) -> int:
+        """Expected duration in seconds of running ``tool`` against ``target`` with ``options``."""
+        group = duration_group(tool.pk, target, options)
+        candidates = self.by_ports.get((tool.pk, group['scan_type'], group['port_spec']))
+        if candidates:
+            nearest = min(candidates, key=lambda row: abs(row.size_bucket - group['size_bucket']))
+            return max(round(nearest.mean), 1)
+        for key in ((tool.pk, group['scan_type']), (tool.pk,)):
+            samples, seconds = self.totals.get(key, (0, 0.0))
+            if samples:
+                return max(round(seconds / samples), 1)
+        return tool.estimated_duration
+
+
+def estimate_duration(tool, target: str, options: Optional[dict]) -> int:
+    return DurationModel.for_tools([tool.pk]).estimate(tool, target, options)
+
+
+def record_duration(job) -> None:
+    """Add a completed job's wall-clock duration to its group; jobs served from another execution are skipped."""
+    if job.status != 'completed' or job.source_job_id or not (job.started_at and job.completed_at):
+        return
+    seconds = (job.completed_at - job.started_at).total_seconds()
+    with transaction.atomic():
+        stats, _ = ScanDurationStats.objects.select_for_update().get_or_create(**duration_group(job.tool_id, job.target, job.options))
+        stats.add(seconds)
+        stats.save(update_fields=['count', 'mean', 'm2', 'updated_at'])
+
+
+def remaining_seconds(job, now: Optional[datetime] = None) -> Optional[int]:
+    """
+    Live ETA of a running job: the time left by its expected duration, blended with the time left
+    at the rate its reported progress is moving. The further along the scan, the more its own
+    progress counts. None if neither is known.
+    """
+    if job.status != 'running' or not job.started_at:
+        return None
+    elapsed = ((now or timezone.now()) - job.started_at).total_seconds()
+    by_model = job.expected_duration - elapsed if job.expected_duration and job.expected_duration > elapsed else None
+    by_progress = elapsed * (100 - job.progress) / job.progress if 0 < job.progress < 100 else None
+    if by_progress is None:
+        return None if by_model is None else round(by_model)
+    if by_model is None:
+        return round(by_progress)
+    weight = job.progress / 100
+    return round(weight * by_progress + (1 - weight) * by_model)
@@ -0,0 +1,66 @@
+import xml.etree.ElementTree as ET
+from typing import Dict, Optional, Tuple
+
+from tools.nmap_adapter import HostReader
+
+from .artifacts import open_artifact
+from .models import ScanJob
+
+# Candidates looked at for a baseline, newest first
+BASELINE_CANDIDATES = 20
+
+# address -> {"tcp/22": (<port> element XML, epoch when its service was last probed)}
+Baseline = Dict[str, Dict[str, Tuple[str, float]]]
+
+
+def _scan_profile(options) -> Tuple[str, str]:
+    options = options if isinstance(options, dict) else {}
+    return (options.get('scan_type') or 'full'), str(options.get('ports') or '')
+
+
+def find_baseline(job: ScanJob) -> Optional[ScanJob]:
+    """
+    The scan an incremental rescan builds on: the user's latest completed scan of the same target
+    with the same tool, scan type and ports, that still has its raw output.
+    """
+    candidates = (
+        ScanJob.objects
+        .filter(user_id=job.user_id, status='completed', tool_id=job.tool_id, target=job.target, raw_output_size__gt=0)
+        .exclude(pk=job.pk)
+        .order_by('-created_at')
+        .only('job_id', 'options', 'started_at', 'created_at')
+        [:BASELINE_CANDIDATES]
+    )
+    profile = _scan_profile(job.options)
+    return next((candidate for candidate in candidates if _scan_profile(candidate.options) == profile), None)
+
+
+def load_baseline(baseline: ScanJob) -> Optional[Baseline]:
+    """
+    The open ports of a completed scan, read back from its raw Nmap XML artifact.
+
+    A port carried over from an earlier baseline keeps the time it was really probed (its
+    ``checked`` attribute); every other port was probed when the baseline scan ran.
+    None if the artifact is gone or unreadable.
+    """
+    probed_at = (baseline.started_at or baseline.created_at).timestamp()
+    ports: Baseline = {}
+    try:
+        with open_artifact(baseline.job_id) as f:
+            for host in HostReader.read(iter(lambda: f.read(64 * 1024), b'')):
+                address = next(
+                    (a.get('addr') for a in host.findall('address') if a.get('addrtype') in ('ipv4', 'ipv6')), None,
+                )
+                if address is None:
+                    continue
+                for port in host.iter('port'):
+                    state = port.find('state')
+                    if state is None or state.get('state') != 'open':
+                        continue
+                    key = f"{port.get('protocol', 'tcp')}/{port.get('portid')}"
+                    checked = float(port.get('checked') or probed_at)
+                    ports.setdefault(address, {})[key] = (ET.tostring(port, encoding='unicode').strip(), checked)
+                host.clear()
+    except (FileNotFoundError, ET.ParseError, OSError):
+        return None
+    return ports
@@ -0,0 +1,52 @@
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from scans.models import ScanJob, Tool, ToolCategory
+from tooldock.celery import app as celery_app
+
+
+@contextmanager
+def benchmark_environment() -> Iterator[None]:
+    """
+    Point the benchmark at a throwaway test database and test environment (set up and torn down like
+    the test runner's), a temporary artifacts directory and eager Celery, so scans it runs, and
+    whatever they dispatch, never touch the configured database, artifact store or workers.
+    """
+    old_name = connection.settings_dict['NAME']
+    eager = {name: celery_app.conf[name] for name in ('task_always_eager', 'task_eager_propagates')}
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with tempfile.TemporaryDirectory() as artifacts_dir, override_settings(SCAN_ARTIFACTS_DIR=artifacts_dir):
+            celery_app.conf.update(task_always_eager=True, task_eager_propagates=True)
+            try:
+                yield
+            finally:
+                celery_app.conf.update(eager)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def scratch_job(tool_name: str = '__bench__', **fields) -> ScanJob:
+    """A throwaway user, tool and finished job for benchmarks; remove with cleanup_scratch()."""
+    with transaction.atomic():
+        user, _ = get_user_model().objects.get_or_create(username='__bench__')
+        category, _ = ToolCategory.objects.get_or_create(id='__bench__', defaults={'name': 'Benchmark'})
+        tool, _ = Tool.objects.get_or_create(name=tool_name, defaults={'display_name': 'Benchmark', 'category': category})
+        # Created finished, so the scan scheduler never picks it up
+        fields = {'input_type': 'ip', 'target': '10.0.0.0/8', 'status': 'completed', **fields}
+        return ScanJob.objects.create(user=user, tool=tool, **fields)
+
+
+def cleanup_scratch(job: ScanJob) -> None:
+    """Delete everything scratch_job() created, including other jobs of the scratch user."""
+    job.user.delete()
+    # Cascades to the scratch tools; a pre-existing tool reused by name stays
+    ToolCategory.objects.filter(id='__bench__').delete()
@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from scans.management.bench import cleanup_scratch, scratch_job
+from scans.models import Finding
+from scans.persistence import FindingWriter, finding_fields
+
+
+def synthetic_findings(count):
+    """Findings shaped like parse_scan_output() results; every 4th one carries a CVE."""
+    for i in range(count):
+        port = 1 + i % 65535
+        finding = {
+            'severity': 'info',
+            'title': f'Open Port: {port}/tcp',
+            'description': f'Open port detected on 10.0.{i // 65535}.1. Service: http. Version: nginx 1.18.',
+            'category': 'Network Exposure',
+            'cvss_score': 0.0,
+            'cve_ids': [],
+            'port': port,
+            'protocol': 'tcp',
+            'service': 'http',
+            'version': 'nginx 1.18',
+            'remediation': 'Ensure this port is necessary and properly secured (e.g., firewall rules, updates).',
+            'references': [],
+            'affected_component': f'10.0.{i // 65535}.1',
+        }
+        if i % 4 == 0:
+            finding.update(severity='high', cvss_score=7.5, cve_ids=[f'CVE-2021-{i:05d}'],
+                           references=[f'https://vulners.com/cve/CVE-2021-{i:05d}'])
+        yield finding
+
+
+class Command(BaseCommand):
+    help = "Measure finding persistence rate: per-row create() versus batched FindingWriter."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--findings', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        count = options['findings']
+        findings = list(synthetic_findings(count))
+        job = scratch_job()
+
+        try:
+            # Before: one INSERT and one autocommit per finding
+            started = time.perf_counter()
+            for finding in findings:
+                Finding.objects.create(job=job, **finding_fields(finding))
+            per_row = time.perf_counter() - started
+            job.findings.all().delete()
+
+            # After: buffered bulk_create, one transaction per batch
+            started = time.perf_counter()
+            with FindingWriter(job, batch_size=options['batch_size'], flush_interval=0) as writer:
+                writer.extend(findings)
+            batched = time.perf_counter() - started
+        finally:
+            cleanup_scratch(job)
+
+        self.stdout.write(f'findings: {count}')
+        self.stdout.write(f'create() per row: {per_row:.2f}s ({count / per_row:,.0f} rows/sec)')
+        self.stdout.write(f'FindingWriter:    {batched:.2f}s ({count / batched:,.0f} rows/sec)')
+        self.stdout.write(self.style.SUCCESS(f'speedup: {per_row / batched:.1f}x'))
+
@@ -0,0 +1,187 @@
+import json
+import platform
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from scans.management.bench import benchmark_environment, cleanup_scratch, scratch_job
+from scans.models import ScanJob
+from scans.parsers import parse_scan_output, stream_scan_output
+from scans.persistence import FindingWriter
+from scans.utils import runner_registry
+from tools.fake_adapter import write_synthetic_nmap_xml
+
+FAKE_TOOL = 'fake_nmap'
+
+
+def parse_size(spec):
+    """'HOSTSxPORTSxVULNS', e.g. '1000x10x2' → (1000, 10, 2)."""
+    try:
+        hosts, ports, vulns = (int(part) for part in spec.lower().split('x'))
+    except ValueError:
+        raise CommandError(f"Invalid size '{spec}', expected HOSTSxPORTSxVULNS")
+    return hosts, ports, vulns
+
+
+def timed(func, repeat):
+    """Run ``func`` ``repeat`` times; latency percentiles in ms, plus the last result and its query count."""
+    samples, result, queries = [], None, 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            result = func()
+            samples.append((time.perf_counter() - started) * 1000)
+        queries = len(captured)
+    samples.sort()
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'max_ms': round(samples[-1], 3),
+        'queries': queries,
+    }, result
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the scan pipeline on synthetic Nmap XML fixtures: parse throughput, finding persistence "
+        "rate and results/histories endpoint latency at several data sizes. Prints JSON for regression tracking. "
+        "Runs on a throwaway test database, never the configured one."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100x5x1,1000x10x2,5000x10x2',
+                            help='Comma-separated HOSTSxPORTSxVULNS fixture sizes')
+        parser.add_argument('--history-sizes', default='100,1000,10000',
+                            help="Comma-separated numbers of jobs in the user's history")
+        parser.add_argument('--repeat', type=int, default=20, help='Requests per endpoint measurement')
+        parser.add_argument('--fixtures-dir', default=None,
+                            help='Where fixtures are written and reused (default: a temporary directory)')
+        parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        sizes = [parse_size(spec) for spec in options['sizes'].split(',') if spec]
+        history_sizes = [int(size) for size in options['history_sizes'].split(',') if size]
+        repeat = max(options['repeat'], 1)
+
+        with tempfile.TemporaryDirectory() as tmp, benchmark_environment():
+            fixtures_dir = Path(options['fixtures_dir'] or tmp)
+            report = {
+                'meta': {
+                    'timestamp': timezone.now().isoformat(),
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'database': connection.vendor,
+                    'sizes': options['sizes'],
+                    'history_sizes': options['history_sizes'],
+                    'repeat': repeat,
+                },
+                'pipeline': [self._bench_size(fixtures_dir, size, repeat) for size in sizes],
+                'histories': [self._bench_history(size, repeat) for size in history_sizes],
+            }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            Path(options['output']).write_text(output + '\n')
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    def _bench_size(self, fixtures_dir, size, repeat):
+        hosts, ports, vulns = size
+        fixture = write_synthetic_nmap_xml(fixtures_dir / f'nmap_{hosts}x{ports}x{vulns}.xml', hosts, ports, vulns)
+        raw = fixture.read_text(encoding='utf-8')
+        self.stderr.write(f'{hosts}x{ports}x{vulns}: {len(raw) / 1e6:.1f} MB fixture')
+
+        started = time.perf_counter()
+        findings = parse_scan_output(raw, 'nmap')
+        parse_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        with open(fixture, encoding='utf-8') as f:
+            streamed = sum(len(batch) for batch in stream_scan_output(f, 'nmap'))
+        stream_seconds = time.perf_counter() - started
+
+        job = scratch_job()
+        try:
+            started = time.perf_counter()
+            with FindingWriter(job, flush_interval=0) as writer:
+                writer.extend(findings)
+            persist_seconds = time.perf_counter() - started
+
+            client = APIClient()
+            client.force_authenticate(job.user)
+            url = reverse('result-detail', args=[job.pk])
+            results_latency, response = timed(lambda: client.get(url), repeat)
+            results_latency['bytes'] = len(response.content)
+
+            end_to_end = self._bench_end_to_end(fixture) if runner_registry.is_registered(FAKE_TOOL) else None
+        finally:
+            cleanup_scratch(job)
+
+        return {
+            'size': {'hosts': hosts, 'ports_per_host': ports, 'vulns_per_port': vulns, 'bytes': len(raw.encode('utf-8'))},
+            'findings': len(findings),
+            'parse': self._rate(len(raw), len(findings), parse_seconds),
+            'stream_parse': self._rate(len(raw), streamed, stream_seconds),
+            'persist': {'seconds': round(persist_seconds, 4), 'findings_per_sec': round(len(findings) / persist_seconds)},
+            'results_endpoint': results_latency,
+            # Whole scan task on the replayed fixture; only when the fake runner is registered (ENABLE_FAKE_TOOLS=True)
+            'end_to_end': end_to_end,
+        }
+
+    def _bench_end_to_end(self, fixture):
+        from scans.tasks import run_scan_task # type: ignore
+
+        scan = scratch_job(
+            tool_name=FAKE_TOOL, target='10.0.0.1', status='queued', dispatched_at=timezone.now(),
+            options={'fake_fixture': fixture.name},
+        )
+        started = time.perf_counter()
+        with override_settings(FAKE_TOOL_FIXTURES_DIR=fixture.parent):
+            run_scan_task.apply(args=[str(scan.pk)])
+        seconds = time.perf_counter() - started
+        scan.refresh_from_db()
+        return {'status': scan.status, 'seconds': round(seconds, 4), 'findings': scan.total_findings}
+
+    def _bench_history(self, size, repeat):
+        job = scratch_job()
+        try:
+            ScanJob.objects.bulk_create(
+                [ScanJob(user=job.user, tool=job.tool, input_type='ip', target=f'10.0.{i // 256 % 256}.{i % 256}',
+                         status='completed') for i in range(size - 1)],
+                batch_size=1000,
+            )
+            client = APIClient()
+            client.force_authenticate(job.user)
+            url = reverse('history-list')
+            first_page, response = timed(lambda: client.get(url), repeat)
+            first_page['bytes'] = len(response.content)
+            # A deep page (the last one, at most 50 pages in): keyset pagination should make it as cheap as the first
+            cursor_url = response.data.get('next')
+            for _ in range(48):
+                next_url = client.get(cursor_url).data.get('next') if cursor_url else None
+                if not next_url:
+                    break
+                cursor_url = next_url
+            deep_page = timed(lambda: client.get(cursor_url), repeat)[0] if cursor_url else None
+        finally:
+            cleanup_scratch(job)
+        return {'jobs': size, 'first_page': first_page, 'deep_page': deep_page}
+
+    @staticmethod
+    def _rate(size, findings, seconds):
+        return {
+            'seconds': round(seconds, 4),
+            'mb_per_sec': round(size / 1e6 / seconds, 2),
+            'findings_per_sec': round(findings / seconds),
+        }
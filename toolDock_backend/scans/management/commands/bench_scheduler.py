@@ -0,0 +1,88 @@
+import heapq
+import itertools
+import statistics
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from scans.scheduler import PendingScan, SchedulerLimits, SchedulerState, fair_order, job_cost, lane_for
+
+
+def p95(values):
+    return statistics.quantiles(values, n=20)[-1] if len(values) > 1 else (values[0] if values else 0.0)
+
+
+def workload(full_scans, full_duration, quick_users, quick_scans, quick_duration, quick_interval):
+    """(submit time, user id, tool name, duration): one user floods full scans at t=0, others submit quick scans steadily."""
+    jobs = [(0.0, 1, 'nmap_full', full_duration) for _ in range(full_scans)]
+    for i in range(quick_scans):
+        jobs.append((1.0 + i * quick_interval, 2 + i % quick_users, 'nmap_quick', quick_duration))
+    return sorted(jobs, key=lambda job: job[0])
+
+
+def simulate_fifo(jobs, workers):
+    """Before: every scan goes straight onto one Celery queue served by ``workers`` slots in order."""
+    free_at = [0.0] * workers
+    heapq.heapify(free_at)
+    waits = []
+    for submitted, user_id, tool_name, duration in jobs:
+        start = max(submitted, heapq.heappop(free_at))
+        heapq.heappush(free_at, start + duration)
+        waits.append((tool_name, start - submitted))
+    return waits
+
+
+def simulate_scheduler(jobs, limits):
+    """After: scans.scheduler's fair_order with limits, re-run on every submit and completion."""
+    epoch = datetime(2000, 1, 1)
+    counter = itertools.count()
+    events = [(job[0], next(counter), 'submit', job) for job in jobs]
+    heapq.heapify(events)
+
+    state = SchedulerState()
+    pending, waits = [], []
+    while events:
+        now, _, kind, payload = heapq.heappop(events)
+        if kind == 'submit':
+            submitted, user_id, tool_name, duration = payload
+            pending.append(PendingScan(
+                (submitted, user_id, tool_name, duration, next(counter)),  # Unique stand-in for a job id
+                user_id, tool_name, lane_for(duration), job_cost(duration), epoch + timedelta(seconds=submitted),
+            ))
+        else:
+            state.remove(payload.user_id, payload.tool_name, payload.lane, payload.cost)
+
+        for scan in list(fair_order(pending, state, limits)):
+            pending.remove(scan)
+            submitted, _, tool_name, duration, _ = scan.job_id
+            waits.append((tool_name, now - submitted))
+            heapq.heappush(events, (now + duration, next(counter), 'complete', scan))
+    return waits
+
+
+class Command(BaseCommand):
+    help = "Simulate queue latency of quick scans under a flood of full scans: single FIFO queue versus the scan scheduler."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full-scans', type=int, default=500)
+        parser.add_argument('--full-duration', type=float, default=900, help='Seconds per full scan')
+        parser.add_argument('--quick-users', type=int, default=10)
+        parser.add_argument('--quick-scans', type=int, default=300)
+        parser.add_argument('--quick-duration', type=float, default=20, help='Seconds per quick scan')
+        parser.add_argument('--quick-interval', type=float, default=5, help='Seconds between quick submissions')
+
+    def handle(self, *args, **options):
+        jobs = workload(options['full_scans'], options['full_duration'], options['quick_users'],
+                        options['quick_scans'], options['quick_duration'], options['quick_interval'])
+        limits = SchedulerLimits.from_settings()
+        # Same total worker slots for both runs
+        workers = sum(limits.per_lane.values())
+
+        self.stdout.write(f'{options["full_scans"]} full scans + {options["quick_scans"]} quick scans, {workers} worker slots')
+        for label, waits in (('single FIFO queue', simulate_fifo(jobs, workers)), ('scan scheduler', simulate_scheduler(jobs, limits))):
+            quick = [wait for tool_name, wait in waits if tool_name == 'nmap_quick']
+            full = [wait for tool_name, wait in waits if tool_name == 'nmap_full']
+            self.stdout.write(
+                f'{label:18} quick wait p50 {statistics.median(quick):9.1f}s  p95 {p95(quick):9.1f}s  max {max(quick):9.1f}s'
+                f'  | full wait p95 {p95(full):9.1f}s'
+            )
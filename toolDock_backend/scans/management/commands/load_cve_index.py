@@ -0,0 +1,41 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from scans.cve_index import build_cve_index
+from scans.enrichment import refresh_cves
+
+
+class Command(BaseCommand):
+    help = "Build the local CVE index used for finding enrichment from NVD JSON dumps (1.1 feeds or API 2.0, optionally gzipped)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Dump files, or directories holding *.json / *.json.gz dumps')
+        parser.add_argument('--output', default=None, help='Index file (default: settings.CVE_INDEX_PATH)')
+
+    def handle(self, *args, **options):
+        dumps = []
+        for path in map(Path, options['paths']):
+            if path.is_dir():
+                dumps += sorted([*path.glob('*.json'), *path.glob('*.json.gz')])
+            elif path.exists():
+                dumps.append(path)
+            else:
+                raise CommandError(f'{path} does not exist')
+        if not dumps:
+            raise CommandError('No NVD dumps found')
+
+        output = Path(options['output'] or settings.CVE_INDEX_PATH)
+        started = time.perf_counter()
+        try:
+            count = build_cve_index(dumps, output)
+        except (ValueError, KeyError) as e:
+            raise CommandError(f'Could not read NVD dump: {e}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count:,} CVEs from {len(dumps)} dump(s) into {output} in {time.perf_counter() - started:.1f}s'
+        ))
+        if output.resolve() == Path(settings.CVE_INDEX_PATH).resolve():
+            # CVEs already seen by scans get the new data, not only those reported from now on
+            self.stdout.write(f'Refreshed {refresh_cves():,} known CVEs')
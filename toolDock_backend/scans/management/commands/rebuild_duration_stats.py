@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from scans.estimates import duration_group
+from scans.models import ScanDurationStats, ScanJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the scan duration estimates (ScanDurationStats) from the started_at/completed_at of all "
+        "completed scans. Afterwards they are kept up to date incrementally as scans complete."
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        jobs = (
+            ScanJob.objects
+            .filter(status='completed', source_job__isnull=True, started_at__isnull=False, completed_at__isnull=False)
+            .order_by('completed_at')  # Oldest first, so the newest runs weigh most once a group is full
+            .only('tool_id', 'target', 'options', 'started_at', 'completed_at')
+        )
+
+        groups = {}
+        runs = 0
+        for job in jobs.iterator(chunk_size=2000):
+            group = duration_group(job.tool_id, job.target, job.options)
+            stats = groups.get(tuple(group.values()))
+            if stats is None:
+                stats = groups[tuple(group.values())] = ScanDurationStats(**group)
+            stats.add((job.completed_at - job.started_at).total_seconds())
+            runs += 1
+
+        with transaction.atomic():
+            ScanDurationStats.objects.all().delete()
+            ScanDurationStats.objects.bulk_create(groups.values(), batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Learned {len(groups):,} duration groups from {runs:,} completed scans in {time.perf_counter() - started:.1f}s'
+        ))
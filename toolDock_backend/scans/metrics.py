@@ -0,0 +1,244 @@
+import atexit
+import bisect
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import redis
+from django.conf import settings
+
+from .progress import get_redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'metrics:'
+
+# name → (type, help, buckets); histogram buckets are upper bounds, +Inf is implied
+METRICS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    'tooldock_scan_stage_seconds': (
+        'histogram', 'Time spent per scan pipeline stage',
+        (0.01, 0.05, 0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 1800, 3600, 4 * 3600),
+    ),
+    'tooldock_scan_output_bytes': (
+        'histogram', 'Raw tool output per scan',
+        (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9),
+    ),
+    'tooldock_scans_finished_total': ('counter', 'Scans that reached a final status', ()),
+    'tooldock_http_request_duration_seconds': (
+        'histogram', 'API request latency',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    ),
+    'tooldock_http_request_queries': (
+        'histogram', 'Database queries per API request',
+        (0, 1, 2, 5, 10, 20, 50, 100, 500),
+    ),
+}
+
+
+def _label_string(labels: Dict[str, str]) -> str:
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+
+def _increments(name: str, value: float, labels: Dict[str, str]) -> Iterator[Tuple[str, str, float]]:
+    """The (hash key, field, amount) increments of one observation."""
+    kind, _, buckets = METRICS[name]
+    key, label_string = KEY_PREFIX + name, _label_string(labels)
+    if kind == 'counter':
+        yield key, label_string, value
+        return
+    # One bucket field per observation; render() turns them into Prometheus' cumulative buckets
+    yield key, f'{label_string}\tbucket\t{bisect.bisect_left(buckets, value)}', 1
+    yield key, f'{label_string}\tsum', value
+    yield key, f'{label_string}\tcount', 1
+
+
+def _write(increments: Iterable[Tuple[str, str, float]]) -> None:
+    pipeline = get_redis().pipeline(transaction=False)
+    for key, field, amount in increments:
+        pipeline.hincrbyfloat(key, field, amount)
+    pipeline.execute()
+
+
+class MetricsBuffer:
+    """
+    Observations summed up in this process and written to Redis in one round trip every
+    METRICS_FLUSH_INTERVAL seconds by a daemon thread, so recording one does no I/O.
+    What is still buffered when a process is killed is lost.
+    """
+
+    def __init__(self):
+        self._reset()
+        # A forked worker starts empty: the parent's observations and flush thread are not its own
+        os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.flush)
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], float] = defaultdict(float)
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, observations: Iterable[Tuple[str, float, Dict[str, str]]]) -> None:
+        with self._lock:
+            for name, value, labels in observations:
+                for key, field, amount in _increments(name, value, labels):
+                    self._pending[key, field] += amount
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+                self._thread.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+        if not pending:
+            return
+        try:
+            _write((key, field, amount) for (key, field), amount in pending.items())
+        except redis.RedisError:
+            logger.debug('Could not flush %d metric values', len(pending), exc_info=True)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+
+_buffer = MetricsBuffer()
+
+
+def record_many(observations: Iterable[Tuple[str, float, Dict[str, str]]], defer: bool = False) -> None:
+    """
+    Add (metric name, value, labels) observations in one Redis round trip.
+
+    Counters are incremented by ``value``, histograms observe it. Values live in Redis,
+    so every web and worker process feeds the same series. Metrics are best effort:
+    a Redis error is logged, never raised. With ``defer`` the observations go to this
+    process's MetricsBuffer instead, for callers that must not wait on Redis (requests).
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    if defer:
+        _buffer.add(observations)
+        return
+    try:
+        _write(increment for observation in observations for increment in _increments(*observation))
+    except redis.RedisError:
+        logger.debug('Could not record metrics', exc_info=True)
+
+
+def record(name: str, value: float, **labels) -> None:
+    record_many([(name, value, labels)])
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    client = get_redis()
+    pipeline = client.pipeline(transaction=False)
+    for name in METRICS:
+        pipeline.hgetall(KEY_PREFIX + name)
+    values = pipeline.execute()
+
+    lines = []
+    for (name, (kind, help_text, buckets)), fields in zip(METRICS.items(), values):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        fields = {field.decode(): float(value) for field, value in fields.items()}
+        if kind == 'counter':
+            for label_string, value in sorted(fields.items()):
+                lines.append(f'{name}{{{label_string}}} {value:g}')
+            continue
+
+        series = defaultdict(dict)
+        for field, value in fields.items():
+            label_string, part = field.split('\t', 1)
+            series[label_string][part] = value
+        for label_string, parts in sorted(series.items()):
+            prefix = f'{label_string},' if label_string else ''
+            cumulative = 0.0
+            for index, bound in enumerate([*buckets, '+Inf']):
+                cumulative += parts.get(f'bucket\t{index}', 0.0)
+                le = bound if bound == '+Inf' else f'{bound:g}'
+                lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative:g}')
+            lines.append(f'{name}_sum{{{label_string}}} {parts.get("sum", 0.0):g}')
+            lines.append(f'{name}_count{{{label_string}}} {parts.get("count", 0.0):g}')
+    return '\n'.join(lines) + '\n'
+
+
+class StageTimings:
+    """
+    Seconds spent in each stage of one scan (or shard): runtime (waiting on the tool), parse and persist.
+
+    Streaming scans interleave the stages host by host, so each is accumulated over many short spans.
+    Stages nest: time spent in an inner stage is charged to it only, not to the enclosing one
+    (the streaming parser pulls tool output from inside its own iteration).
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self._nested: list = []  # Per open stage, seconds spent in stages nested in it
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        self._nested.append(0.0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.seconds[name] += elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def timed(self, name: str, iterable: Iterable) -> Iterator:
+        """Pass ``iterable`` through, charging the time spent producing each item to ``name``."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def merge(self, other: Dict[str, float]) -> None:
+        for name, seconds in other.items():
+            self.seconds[name] += seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        return {name: round(seconds, 4) for name, seconds in self.seconds.items()}
+
+
+def job_timings(job, stages: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """
+    The ``timings`` stored on a finished job: scheduler and worker queue wait from its timestamps,
+    the per-stage seconds measured by the worker, output size and total wall-clock time.
+    """
+    timings = {}
+    if job.dispatched_at:
+        timings['schedule_wait'] = round(max((job.dispatched_at - job.created_at).total_seconds(), 0.0), 4)
+    if job.started_at:
+        queued_since = job.dispatched_at or job.created_at
+        timings['queue_wait'] = round(max((job.started_at - queued_since).total_seconds(), 0.0), 4)
+    timings.update(stages or {})
+    timings['output_bytes'] = job.raw_output_size
+    if job.started_at and job.completed_at:
+        timings['total'] = round((job.completed_at - job.started_at).total_seconds(), 4)
+    return timings
+
+
+def record_scan_metrics(job) -> None:
+    """Export a finished job's timings; called once per job when it reaches a final status."""
+    tool = job.tool.name
+    timings = job.timings or {}
+    observations = [('tooldock_scans_finished_total', 1, {'tool': tool, 'status': job.status})]
+    for stage, seconds in timings.items():
+        if stage != 'output_bytes':
+            observations.append(('tooldock_scan_stage_seconds', seconds, {'tool': tool, 'stage': stage}))
+    if job.status == 'completed':
+        observations.append(('tooldock_scan_output_bytes', timings.get('output_bytes', 0), {'tool': tool}))
+    record_many(observations)
@@ -0,0 +1,47 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from core.query_inspector import record_queries
+
+from .metrics import record_many
+
+
+def _record_request(request, response, seconds, queries):
+    match = getattr(request, 'resolver_match', None)
+    # View names, not paths, keep the label set small (no ids in it)
+    labels = {'method': request.method, 'view': match.view_name if match else 'unmatched'}
+    # Buffered and written to Redis by a background thread: a slow Redis must not slow down the API
+    record_many([
+        ('tooldock_http_request_duration_seconds', seconds, {**labels, 'status': f'{response.status_code // 100}xx'}),
+        ('tooldock_http_request_queries', queries, labels),
+    ], defer=True)
+
+
+@sync_and_async_middleware
+def request_metrics_middleware(get_response):
+    """
+    Observe every request's latency and number of DB queries into the tooldock_http_* histograms
+    served at /metrics.
+
+    Queries are counted with core.query_inspector.record_queries(), so this works with DEBUG off and
+    under ASGI, where sync views and the ORM calls of async views run in worker threads. Queries an
+    async view runs while streaming its response (events) come after the count is taken.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            with record_queries() as log:
+                response = await get_response(request)
+            _record_request(request, response, time.perf_counter() - started, log.count)
+            return response
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            with record_queries() as log:
+                response = get_response(request)
+            _record_request(request, response, time.perf_counter() - started, log.count)
+            return response
+
+    return middleware
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:06
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+SEVERITY_COUNTERS = {
+    'critical': 'critical_count',
+    'high': 'high_count',
+    'medium': 'medium_count',
+    'low': 'low_count',
+    'info': 'info_count',
+}
+
+
+def backfill_summary(apps, schema_editor):
+    ScanJob = apps.get_model('scans', 'ScanJob')
+    aggregates = {
+        'agg_total': Count('findings'),
+        'agg_max_cvss': Max('findings__cvss_score'),
+    }
+    for severity, field in SEVERITY_COUNTERS.items():
+        aggregates[f'agg_{field}'] = Count('findings', filter=Q(findings__severity=severity))
+
+    for job in ScanJob.objects.annotate(**aggregates).filter(agg_total__gt=0).iterator():
+        updates = {field: getattr(job, f'agg_{field}') for field in SEVERITY_COUNTERS.values()}
+        ScanJob.objects.filter(pk=job.pk).update(
+            total_findings=job.agg_total,
+            max_cvss=job.agg_max_cvss or 0.0,
+            **updates,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='critical_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='high_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='info_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='low_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='max_cvss',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='medium_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='total_findings',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0002_scanjob_finding_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scanjob',
+            index=models.Index(fields=['user', 'created_at'], name='scanjob_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scanjob',
+            index=models.Index(fields=['user', 'status', 'created_at'], name='scanjob_user_status_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:07
+
+import gzip
+import hashlib
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def move_raw_output_to_artifacts(apps, schema_editor):
+    # Same layout as scans.artifacts.artifact_path, inlined so the migration stays frozen
+    ScanJob = apps.get_model('scans', 'ScanJob')
+    jobs = ScanJob.objects.exclude(raw_output__isnull=True).exclude(raw_output='').only('job_id', 'raw_output')
+    for job in jobs.iterator():
+        job_id = str(job.job_id)
+        path = Path(settings.SCAN_ARTIFACTS_DIR) / job_id[:2] / f'{job_id}.xml.gz'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = job.raw_output.encode('utf-8')
+        tmp_path = path.with_name(path.name + '.part')
+        with gzip.open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        ScanJob.objects.filter(pk=job.pk).update(
+            raw_output_size=len(data),
+            raw_output_sha256=hashlib.sha256(data).hexdigest(),
+            raw_output_preview=job.raw_output[:500],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0003_scanjob_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='raw_output_preview',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='raw_output_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='raw_output_size',
+            field=models.PositiveBigIntegerField(default=0, help_text='Uncompressed bytes'),
+        ),
+        migrations.RunPython(move_raw_output_to_artifacts, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='scanjob',
+            name='raw_output',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0004_scanjob_raw_output_artifacts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='shard_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='shards_done',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
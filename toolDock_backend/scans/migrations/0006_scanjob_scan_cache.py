@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0005_scanjob_shards'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='cache_key',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='source_job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='attached_jobs', to='scans.scanjob'),
+        ),
+        migrations.AddIndex(
+            model_name='scanjob',
+            index=models.Index(fields=['cache_key', 'created_at'], name='scanjob_cache_key_idx'),
+        ),
+    ]
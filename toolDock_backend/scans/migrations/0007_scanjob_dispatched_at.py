@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:19
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_dispatched(apps, schema_editor):
+    # Every existing job was already sent to Celery at submit time
+    ScanJob = apps.get_model('scans', 'ScanJob')
+    ScanJob.objects.update(dispatched_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0006_scanjob_scan_cache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='dispatched_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_dispatched, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='scanjob',
+            index=models.Index(fields=['status', 'dispatched_at', 'created_at'], name='scanjob_dispatch_idx'),
+        ),
+    ]
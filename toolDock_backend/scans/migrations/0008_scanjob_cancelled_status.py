@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0007_scanjob_dispatched_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scanjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0008_scanjob_cancelled_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='finding',
+            name='cvss_vector',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='finding',
+            name='cwe_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
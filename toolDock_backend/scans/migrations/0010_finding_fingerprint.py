@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:32
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+
+def fingerprint(finding):
+    # Same as scans.persistence.finding_fingerprint at the time of this migration
+    key = [
+        finding.affected_component or '', finding.port, (finding.protocol or '').lower(),
+        (finding.service or '').lower(), sorted({c.upper() for c in finding.cve_ids or []}),
+    ]
+    return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def backfill_fingerprints(apps, schema_editor):
+    Finding = apps.get_model('scans', 'Finding')
+    batch = []
+    fields = ['id', 'affected_component', 'port', 'protocol', 'service', 'cve_ids']
+    for finding in Finding.objects.only(*fields).iterator(chunk_size=2000):
+        finding.fingerprint = fingerprint(finding)
+        batch.append(finding)
+        if len(batch) >= 2000:
+            Finding.objects.bulk_update(batch, ['fingerprint'])
+            batch = []
+    if batch:
+        Finding.objects.bulk_update(batch, ['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0009_finding_cve_enrichment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='finding',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='finding',
+            index=models.Index(fields=['job', 'fingerprint'], name='finding_job_fingerprint_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_finding_cves(apps, schema_editor):
+    Finding = apps.get_model('scans', 'Finding')
+    Cve = apps.get_model('scans', 'Cve')
+    FindingCve = apps.get_model('scans', 'FindingCve')
+
+    def write(links):
+        Cve.objects.bulk_create([Cve(cve_id=cve_id) for cve_id in {cve_id for _, cve_id in links}], ignore_conflicts=True)
+        FindingCve.objects.bulk_create(
+            [FindingCve(finding_id=pk, cve_id=cve_id) for pk, cve_id in links], ignore_conflicts=True, batch_size=2000,
+        )
+
+    links = []
+    for pk, cve_ids in Finding.objects.values_list('id', 'cve_ids').iterator(chunk_size=2000):
+        links.extend((pk, cve_id) for cve_id in {c.upper() for c in cve_ids or []})
+        if len(links) >= 2000:
+            write(links)
+            links = []
+    if links:
+        write(links)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0010_finding_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cve',
+            fields=[
+                ('cve_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('cvss_score', models.FloatField(default=0.0)),
+                ('cvss_vector', models.CharField(blank=True, max_length=200)),
+                ('cwe_ids', models.JSONField(blank=True, default=list)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FindingCve',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cve', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='finding_links', to='scans.cve')),
+                ('finding', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cve_links', to='scans.finding')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='finding',
+            name='cves',
+            field=models.ManyToManyField(blank=True, related_name='findings', through='scans.FindingCve', to='scans.cve'),
+        ),
+        migrations.AddIndex(
+            model_name='finding',
+            index=models.Index(fields=['job', 'severity'], name='finding_job_severity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='finding',
+            index=models.Index(fields=['job', 'service', 'version'], name='finding_job_service_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='findingcve',
+            index=models.Index(fields=['cve', 'finding'], name='findingcve_cve_finding_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='findingcve',
+            constraint=models.UniqueConstraint(fields=('finding', 'cve'), name='findingcve_finding_cve_uniq'),
+        ),
+        migrations.RunPython(backfill_finding_cves, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0011_finding_cve_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='timings',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
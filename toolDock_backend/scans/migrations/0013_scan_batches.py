@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:45
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0012_scanjob_timings'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanBatch',
+            fields=[
+                ('batch_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('input_type', models.CharField(max_length=50)),
+                ('options', models.JSONField(default=dict, null=True)),
+                ('total_jobs', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('tool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scan_batches', to='scans.tool')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scan_batches', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='scans.scanbatch'),
+        ),
+        migrations.AddIndex(
+            model_name='scanbatch',
+            index=models.Index(fields=['user', 'created_at'], name='scanbatch_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0013_scan_batches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='expected_duration',
+            field=models.PositiveIntegerField(blank=True, help_text='In seconds', null=True),
+        ),
+        migrations.CreateModel(
+            name='ScanDurationStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scan_type', models.CharField(blank=True, max_length=32)),
+                ('port_spec', models.CharField(blank=True, max_length=100)),
+                ('size_bucket', models.PositiveSmallIntegerField(help_text='floor(log2(addresses in the target))')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('mean', models.FloatField(default=0.0, help_text='In seconds')),
+                ('m2', models.FloatField(default=0.0, help_text='Sum of squared deviations from the mean')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('tool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='duration_stats', to='scans.tool')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tool', 'scan_type', 'port_spec', 'size_bucket'), name='scandurationstats_group_uniq')],
+            },
+        ),
+    ]
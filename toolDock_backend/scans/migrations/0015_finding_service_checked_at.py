@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 03:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0014_scan_duration_estimates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='finding',
+            name='service_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
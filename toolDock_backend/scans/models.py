@@ -49,6 +49,25 @@ class Tool(models.Model):
     def __str__(self):
         return self.display_name
 
+class ScanBatch(models.Model):
+    # Many targets submitted in one request (scans/batches/), tracked as a unit
+    batch_id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="scan_batches")
+    tool = models.ForeignKey(Tool, on_delete=models.CASCADE, related_name="scan_batches")
+    input_type = models.CharField(max_length=50)
+    options = models.JSONField(default=dict, null=True)
+    total_jobs = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='scanbatch_user_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tool.name} batch ({self.batch_id})"
+
+
 class ScanJob(models.Model):
 
     STATUS = [
@@ -56,6 +75,7 @@ class ScanJob(models.Model):
         ('running', 'Running'),
         ('completed', 'Completed'),
         ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
     ]
 
     job_id = models.UUIDField(primary_key=True,default=uuid4,editable=False,unique=True)
@@ -73,12 +93,106 @@ class ScanJob(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    # Set when the scheduler hands the job to Celery; queued jobs without it are waiting for a slot
+    dispatched_at = models.DateTimeField(null=True, blank=True)
 
-    raw_output = models.TextField(blank=True, null=True)
+    # Full raw output lives in compressed artifact storage (scans.artifacts); the row keeps a summary
+    raw_output_size = models.PositiveBigIntegerField(default=0, help_text="Uncompressed bytes")
+    raw_output_sha256 = models.CharField(max_length=64, blank=True)
+    raw_output_preview = models.CharField(max_length=500, blank=True)
+
+    # Set when the target is split into parallel sub-scans (scans.sharding)
+    shard_count = models.PositiveSmallIntegerField(default=0)
+    shards_done = models.PositiveSmallIntegerField(default=0)
+
+    # Seconds per pipeline stage (queue wait, tool runtime, parse, persist) and output bytes, see scans.metrics
+    timings = models.JSONField(default=dict, blank=True)
+    # Estimated at submission from completed scans like this one (scans.estimates); drives lane, scheduling and ETA
+    expected_duration = models.PositiveIntegerField(null=True, blank=True, help_text="In seconds")
+
+    # Set for jobs submitted through scans/batches/
+    batch = models.ForeignKey(ScanBatch, null=True, blank=True, on_delete=models.SET_NULL, related_name='jobs')
+
+    # Identical recent scans are served from one execution (scans.cache)
+    cache_key = models.CharField(max_length=64, blank=True)
+    source_job = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='attached_jobs')
+
+    # Denormalized finding summary, maintained by FindingWriter as findings are persisted
+    total_findings = models.PositiveIntegerField(default=0)
+    critical_count = models.PositiveIntegerField(default=0)
+    high_count = models.PositiveIntegerField(default=0)
+    medium_count = models.PositiveIntegerField(default=0)
+    low_count = models.PositiveIntegerField(default=0)
+    info_count = models.PositiveIntegerField(default=0)
+    max_cvss = models.FloatField(default=0.0)
+
+    SEVERITY_COUNTERS = {
+        'critical': 'critical_count',
+        'high': 'high_count',
+        'medium': 'medium_count',
+        'low': 'low_count',
+        'info': 'info_count',
+    }
+
+    class Meta:
+        indexes = [
+            # History listing: per-user, newest first, optionally narrowed by status
+            models.Index(fields=['user', 'created_at'], name='scanjob_user_created_idx'),
+            models.Index(fields=['user', 'status', 'created_at'], name='scanjob_user_status_idx'),
+            # Result cache lookup: latest execution for a cache key
+            models.Index(fields=['cache_key', 'created_at'], name='scanjob_cache_key_idx'),
+            # Scheduler: pending jobs oldest first, and the active set
+            models.Index(fields=['status', 'dispatched_at', 'created_at'], name='scanjob_dispatch_idx'),
+        ]
 
     def __str__(self):
         return f"{self.tool.name} ({self.job_id})"
+
+    def summary(self):
+        data = {"total_findings": self.total_findings}
+        for severity, field in self.SEVERITY_COUNTERS.items():
+            data[severity] = getattr(self, field)
+        data["max_cvss"] = self.max_cvss
+        return data
     
+class ScanDurationStats(models.Model):
+    """
+    Running mean and variance (Welford) of completed scan durations for one group of similar scans:
+    same tool, scan type and port spec, and target size within a power of two. See scans.estimates.
+    """
+    tool = models.ForeignKey(Tool, on_delete=models.CASCADE, related_name="duration_stats")
+    scan_type = models.CharField(max_length=32, blank=True)
+    port_spec = models.CharField(max_length=100, blank=True)
+    size_bucket = models.PositiveSmallIntegerField(help_text="floor(log2(addresses in the target))")
+    count = models.PositiveIntegerField(default=0)
+    mean = models.FloatField(default=0.0, help_text="In seconds")
+    m2 = models.FloatField(default=0.0, help_text="Sum of squared deviations from the mean")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tool', 'scan_type', 'port_spec', 'size_bucket'], name='scandurationstats_group_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.tool_id} {self.scan_type or '-'} {self.port_spec or '-'} /2^{self.size_bucket}: {self.mean:.0f}s (n={self.count})"
+
+    def add(self, seconds: float) -> None:
+        """Welford's online update. The count stops at SCAN_DURATION_MAX_SAMPLES, after which the
+        oldest samples fade out, so the estimate follows tools and networks getting faster or slower."""
+        if self.count >= settings.SCAN_DURATION_MAX_SAMPLES:
+            self.m2 *= (self.count - 1) / self.count
+        else:
+            self.count += 1
+        delta = seconds - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (seconds - self.mean)
+
+    @property
+    def stddev(self) -> float:
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+
 class Finding(models.Model):
     job = models.ForeignKey(ScanJob, on_delete=models.CASCADE, related_name="findings")
     severity = models.CharField(max_length=10, default='info')
@@ -87,6 +201,9 @@ class Finding(models.Model):
     category = models.CharField(max_length=100, blank=True)
     cvss_score = models.FloatField(default=0.0)
     cve_ids = models.JSONField(default=list, blank=True)
+    # Filled from the local CVE index (scans.enrichment) when the findings are persisted
+    cvss_vector = models.CharField(max_length=200, blank=True)
+    cwe_ids = models.JSONField(default=list, blank=True)
     port = models.IntegerField(null=True, blank=True)
     protocol = models.CharField(max_length=10, blank=True)
     service = models.CharField(max_length=50, blank=True)
@@ -94,6 +211,48 @@ class Finding(models.Model):
     remediation = models.TextField(blank=True)
     references = models.JSONField(default=list, blank=True)
     affected_component = models.CharField(max_length=255, blank=True)
+    # When the service/version was last actually probed: the scan's start, or earlier for ports an
+    # incremental rescan carried over from a previous scan (scans.incremental)
+    service_checked_at = models.DateTimeField(null=True, blank=True)
+    # persistence.finding_fingerprint: same issue on the same target → same value across scans
+    fingerprint = models.CharField(max_length=64, blank=True)
+    # Normalized copy of cve_ids, written by FindingWriter; queries by CVE go through this, not the JSON list
+    cves = models.ManyToManyField('Cve', through='FindingCve', related_name='findings', blank=True)
+
+    class Meta:
+        indexes = [
+            # Cross-scan diffs are anti-joins on (job, fingerprint)
+            models.Index(fields=['job', 'fingerprint'], name='finding_job_fingerprint_idx'),
+            # Finding search (scans/findings/): by severity and by service/version within a user's jobs
+            models.Index(fields=['job', 'severity'], name='finding_job_severity_idx'),
+            models.Index(fields=['job', 'service', 'version'], name='finding_job_service_idx'),
+        ]
+
+
+class Cve(models.Model):
+    # Advisory id as reported by vulners, upper-cased, e.g. "CVE-2021-44228"; natural key, so inserts need no read-back
+    cve_id = models.CharField(primary_key=True, max_length=64)
+    # From the local CVE index (scans.cve_index), refreshed when a scan reports the id or the index is rebuilt; empty otherwise
+    cvss_score = models.FloatField(default=0.0)
+    cvss_vector = models.CharField(max_length=200, blank=True)
+    cwe_ids = models.JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return self.cve_id
+
+
+class FindingCve(models.Model):
+    finding = models.ForeignKey(Finding, on_delete=models.CASCADE, related_name='cve_links')
+    cve = models.ForeignKey(Cve, on_delete=models.CASCADE, related_name='finding_links')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['finding', 'cve'], name='findingcve_finding_cve_uniq'),
+        ]
+        indexes = [
+            # "Which findings carry this CVE": range scan on cve, finding ids straight from the index
+            models.Index(fields=['cve', 'finding'], name='findingcve_cve_finding_idx'),
+        ]
 
 
 class Profile(models.Model):
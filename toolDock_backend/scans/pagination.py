@@ -0,0 +1,25 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ScanHistoryPagination(CursorPagination):
+    # Keyset pagination: each page is a range scan on (user, created_at), no OFFSET
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = '-created_at'
+
+
+class FindingPagination(CursorPagination):
+    # Findings of a user run into the millions; keyset on the primary key keeps deep pages cheap
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = '-id'
+
+
+class BatchJobPagination(CursorPagination):
+    # Jobs of a batch share their created_at; the job id is unique and the batch index already holds it
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = 'job_id'
@@ -0,0 +1,163 @@
+# parsing functions (no prints, no file IO)
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from tools.nmap_adapter import HostReader
+
+
+def parse_scan_output(raw_output: str, tool_name: str) -> List[Dict]:
+    """
+    Parse Nmap XML output and extract findings for the Finding model.
+
+    This function assumes the raw_output is Nmap's XML format (from -oX).
+    It extracts open ports/services as basic 'info' findings and, if vulners NSE script
+    was used, extracts vulnerabilities with CVE, CVSS, etc.
+
+    :param raw_output: The raw XML string from Nmap.
+    :param tool_name: The tool name (e.g., 'nmap') for filtering/custom logic.
+    :return: List of dicts, each representing a Finding object's fields.
+    """
+    if tool_name != 'nmap':
+        return []  # Only handle nmap for this example; extend for other tools
+
+    findings = []
+    try:
+        root = ET.fromstring(raw_output)
+    except ET.ParseError as e:
+        # Handle invalid XML (e.g., incomplete scan)
+        return [parse_error_finding(e)]
+
+    # Iterate over each <host> in the <nmaprun>
+    for host in root.findall('host'):
+        findings.extend(parse_host(host))
+
+    return findings
+
+
+def stream_scan_output(lines: Iterable[str], tool_name: str) -> Iterator[List[Dict]]:
+    """
+    Incrementally parse Nmap XML output while it is being produced.
+
+    Yields the findings of each <host> as soon as its closing tag has been read.
+    Finished elements are dropped from the tree, so memory stays flat no matter
+    how many hosts the scan covers.
+
+    :param lines: Iterable of raw XML chunks (e.g., NmapRunner.stream()).
+    :param tool_name: The tool name (e.g., 'nmap') for filtering/custom logic.
+    :return: Iterator over per-host lists of Finding field dicts.
+    """
+    if tool_name != 'nmap':
+        for _ in lines:
+            pass  # Still drain the runner so it can finish; nothing to parse
+        return
+
+    for host in HostReader.read(lines):
+        findings = parse_host(host)
+        host.clear()
+        if findings:
+            yield findings
+
+
+def parse_error_finding(error: Exception) -> Dict:
+    return {'title': 'Parse Error', 'description': f'Failed to parse Nmap XML: {str(error)}', 'severity': 'critical'}
+
+
+def cvss_severity(cvss: float) -> Optional[str]:
+    """Severity for a CVSS score (common mapping); None for 0.0."""
+    if cvss >= 9.0:
+        return 'critical'
+    if cvss >= 7.0:
+        return 'high'
+    if cvss >= 4.0:
+        return 'medium'
+    if cvss > 0.0:
+        return 'low'
+    return None
+
+
+def parse_host(host: ET.Element) -> List[Dict]:
+    """
+    Extract findings from a single Nmap <host> element.
+
+    :param host: The <host> element.
+    :return: List of dicts, each representing a Finding object's fields.
+    """
+    findings = []
+    addr_elem = host.find("address[@addrtype='ipv4']")
+    host_address = addr_elem.get('addr') if addr_elem is not None else 'Unknown'
+    # Extract ports and services
+    ports = host.find('ports')
+    if ports is None:
+        return findings
+
+    for port in ports.findall('port'):
+        state_elem = port.find('state')
+        if state_elem is None or state_elem.get('state') != 'open': # Only open ports
+            continue
+
+        port_id = int(port.get('portid')) # type: ignore
+        protocol = port.get('protocol', 'tcp')
+
+        service_elem = port.find('service')
+        service_name = service_elem.get('name') if service_elem is not None else 'Unknown'
+        if service_elem is not None:
+            version = ' '.join(filter(None, [
+                service_elem.get('product'),
+                service_elem.get('version')
+            ])).strip()
+        else:
+            version = ''
+
+        finding = {
+            'severity': 'info', # Default; override if vuln found
+            'title': f'Open Port: {port_id}/{protocol}',
+            'description': f'Open port detected on {host_address}. Service: {service_name}. Version: {version}.',
+            'category': 'Network Exposure',
+            'cvss_score': 0.0,
+            'cve_ids': [],
+            'port': port_id,
+            'protocol': protocol,
+            'service': service_name,
+            'version': version,
+            'remediation': 'Ensure this port is necessary and properly secured (e.g., firewall rules, updates).',
+            'references': [],
+            'affected_component': host_address
+        }
+        # Ports carried over by an incremental rescan say when their service was really probed
+        if port.get('checked'):
+            finding['service_checked_at'] = datetime.fromtimestamp(float(port.get('checked')), tz=timezone.utc) # type: ignore
+
+        # Check for script outputs (e.g., vulners for vulnerabilities)
+        for script in port.findall('script'):
+            if script.get('id') == 'vulners':
+                # Parse vulners output: Typically a <table> with <elem> for cve, cvss, etc.
+                for table in script.findall('table'):
+                    cve = ''
+                    cvss = 0.0
+                    refs = []
+                    for elem in table.findall('elem'):
+                        key = elem.get('key')
+                        if key == 'id':
+                            cve = elem.text
+                        elif key == 'cvss':
+                            try:
+                                cvss = float(elem.text) # type: ignore
+                            except (ValueError, TypeError):
+                                cvss = 0.0
+                        elif key == 'references':
+                            refs = elem.text.split() if elem.text else []  # Assuming space-separated
+
+                    if cve:
+                        finding['cve_ids'].append(cve)
+                        finding['cvss_score'] = max(finding['cvss_score'], cvss)  # Take highest
+                        finding['references'].extend(refs)
+                        # Update severity based on CVSS (common mapping)
+                        finding['severity'] = cvss_severity(cvss) or finding['severity']
+                        # Enhance description and remediation
+                        finding['description'] += f'\nVulnerability: {cve} (CVSS: {cvss}).'
+                        finding['remediation'] += ' Apply patches or mitigations as per references.'
+
+        findings.append(finding)
+
+    return findings
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .cve_index import CveRecord
+from .enrichment import CVE_INDEX_FIELDS, enrich_findings
+from .models import Cve, Finding, FindingCve, ScanJob
+
+
+def finding_fingerprint(affected_component: str, port, protocol: str, service: str, cve_ids: Iterable[str]) -> str:
+    """
+    Stable identity of a finding across scans: where it is (host, port, protocol, service) and which CVEs it carries.
+
+    The same issue found by two scans of a target gets the same fingerprint, so diffs are set operations on it.
+    """
+    key = [affected_component or '', port, (protocol or '').lower(), (service or '').lower(), sorted({c.upper() for c in cve_ids})]
+    return hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def finding_fields(finding: Dict) -> Dict:
+    """Map a parsed finding dict onto Finding model fields, filling defaults."""
+    fields = dict(
+        severity=finding.get('severity', 'info'),
+        title=finding.get('title', 'Untitled Finding'),
+        description=finding.get('description', ''),
+        category=finding.get('category', ''),
+        cvss_score=finding.get('cvss_score', 0.0),
+        cve_ids=finding.get('cve_ids', []),
+        cvss_vector=finding.get('cvss_vector', ''),
+        cwe_ids=finding.get('cwe_ids', []),
+        port=finding.get('port'),
+        protocol=finding.get('protocol') or '',
+        service=finding.get('service') or '',
+        version=finding.get('version') or '',
+        remediation=finding.get('remediation', ''),
+        references=finding.get('references', []),
+        affected_component=finding.get('affected_component', ''),
+        service_checked_at=finding.get('service_checked_at'),
+    )
+    fields['fingerprint'] = finding_fingerprint(
+        fields['affected_component'], fields['port'], fields['protocol'], fields['service'], fields['cve_ids'],
+    )
+    return fields
+
+
+class FindingWriter:
+    """
+    Buffer parsed findings for a job and write them with bulk_create.
+
+    Each flush is one transaction holding up to ``batch_size`` rows. The buffer is
+    also flushed once it is older than ``flush_interval`` seconds, so findings fed
+    from a streaming parser still show up while the scan is running.
+
+    Every flush also bumps the job's summary counters (total, per severity, max CVSS),
+    so readers never have to count findings, enriches the batch from the local CVE index
+    and links the findings to the normalized Cve table.
+
+    Use as a context manager; whatever is buffered is written on a clean exit.
+    """
+
+    def __init__(self, job: ScanJob, batch_size: int = None, flush_interval: float = None): # type: ignore
+        self.job = job
+        self.batch_size = batch_size or settings.FINDINGS_BATCH_SIZE
+        self.flush_interval = settings.FINDINGS_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.buffer: List[Finding] = []
+        self.written = 0
+        self._buffer_started = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+
+    def add(self, finding: Dict) -> None:
+        if not self.buffer:
+            self._buffer_started = time.monotonic()
+        fields = finding_fields(finding)
+        if fields['service_checked_at'] is None and fields['port'] is not None:
+            fields['service_checked_at'] = self.job.started_at  # Probed by this scan
+        self.buffer.append(Finding(job=self.job, **fields))
+
+        if len(self.buffer) >= self.batch_size or self._buffer_expired():
+            self.flush()
+
+    def extend(self, findings: Iterable[Dict]) -> None:
+        for finding in findings:
+            self.add(finding)
+
+    def flush(self) -> None:
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        # One CVE index lookup for the whole batch, before the summary counters are computed
+        records = enrich_findings(batch)
+        with transaction.atomic():
+            Finding.objects.bulk_create(batch, batch_size=self.batch_size)
+            self._link_cves(batch, records)
+            ScanJob.objects.filter(pk=self.job.pk).update(**self._summary_increments(batch))
+        self.written += len(batch)
+
+    def _link_cves(self, batch: List[Finding], records: Dict[str, CveRecord]) -> None:
+        """Insert the batch's CVEs and its finding-to-CVE rows; existing CVEs take the index's data if it has them."""
+        with_cves = [finding for finding in batch if finding.cve_ids]
+        if not with_cves:
+            return
+
+        indexed, unknown = [], []
+        for cve_id in sorted({cve_id.upper() for finding in with_cves for cve_id in finding.cve_ids}):
+            record = records.get(cve_id)
+            if record:
+                indexed.append(Cve(cve_id=cve_id, cvss_score=record.cvss, cvss_vector=record.vector, cwe_ids=list(record.cwe_ids)))
+            else:
+                unknown.append(Cve(cve_id=cve_id))
+        Cve.objects.bulk_create(unknown, ignore_conflicts=True, batch_size=self.batch_size)
+        # A CVE first seen before the index had it would otherwise keep empty data for good
+        Cve.objects.bulk_create(
+            indexed, update_conflicts=True, update_fields=CVE_INDEX_FIELDS, batch_size=self.batch_size,
+            # MySQL upserts on any unique key and refuses an explicit target
+            unique_fields=['cve_id'] if connection.features.supports_update_conflicts_with_target else None,
+        )
+
+        if all(finding.pk for finding in with_cves):
+            finding_ids = [([finding.pk], finding.cve_ids) for finding in with_cves]
+        else:
+            # MySQL's bulk_create does not return primary keys: read them back through the (job, fingerprint) index.
+            # Rows of earlier batches with the same fingerprint come back too; their links already exist.
+            by_fingerprint = defaultdict(list)
+            rows = Finding.objects.filter(job=self.job, fingerprint__in={finding.fingerprint for finding in with_cves})
+            for pk, fingerprint in rows.values_list('pk', 'fingerprint'):
+                by_fingerprint[fingerprint].append(pk)
+            # The fingerprint covers the CVE set, so one finding per fingerprint is enough
+            unique = {finding.fingerprint: finding for finding in with_cves}.values()
+            finding_ids = [(by_fingerprint[finding.fingerprint], finding.cve_ids) for finding in unique]
+
+        links = [
+            FindingCve(finding_id=pk, cve_id=cve_id)
+            for pks, cve_ids in finding_ids
+            for pk in pks
+            for cve_id in {cve_id.upper() for cve_id in cve_ids}
+        ]
+        FindingCve.objects.bulk_create(links, ignore_conflicts=True, batch_size=self.batch_size)
+
+    def _summary_increments(self, batch: List[Finding]) -> Dict:
+        """Counter updates for the job's summary fields, applied in the same transaction as the batch."""
+        counts = {field: 0 for field in ScanJob.SEVERITY_COUNTERS.values()}
+        for finding in batch:
+            field = ScanJob.SEVERITY_COUNTERS.get(finding.severity)
+            if field:
+                counts[field] += 1
+
+        updates = {field: F(field) + n for field, n in counts.items() if n}
+        updates['total_findings'] = F('total_findings') + len(batch)
+        updates['max_cvss'] = Greatest(F('max_cvss'), max(finding.cvss_score for finding in batch))
+        return updates
+
+    def _buffer_expired(self) -> bool:
+        return self.flush_interval > 0 and time.monotonic() - self._buffer_started >= self.flush_interval # type: ignore
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, Iterable, Optional
+
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[redis.Redis] = None
+_backend = None
+
+
+def progress_channel(job_id) -> str:
+    return f'scans:progress:{job_id}'
+
+
+def get_redis() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.SCAN_PROGRESS_REDIS_URL,
+            socket_timeout=settings.SCAN_PROGRESS_REDIS_TIMEOUT,
+            socket_connect_timeout=settings.SCAN_PROGRESS_REDIS_TIMEOUT,
+        )
+    return _client
+
+
+class ProgressBackend(ABC):
+    """
+    Where live progress of running scans is kept between state transitions.
+
+    The ScanJob row is only written when the status changes; intermediate progress
+    goes through the backend configured by SCAN_PROGRESS_BACKEND.
+    """
+
+    @abstractmethod
+    def set(self, job_id, progress: int, current_step: str) -> None:
+        ...
+
+    @abstractmethod
+    def set_part(self, job_id, part: int, parts: int, progress: int, current_step: str) -> None:
+        """Progress of one of ``parts`` sub-tasks of a job (e.g. shards); the job's progress is their mean."""
+
+    @abstractmethod
+    def get_many(self, job_ids: Iterable) -> Dict[str, Dict]:
+        """Live values keyed by str(job_id); jobs without live progress are left out."""
+
+    @abstractmethod
+    def clear(self, job_id) -> None:
+        ...
+
+
+class DatabaseProgressBackend(ProgressBackend):
+    """Writes progress straight to the ScanJob row (the original behaviour)."""
+
+    def set(self, job_id, progress, current_step):
+        from .models import ScanJob
+        ScanJob.objects.filter(pk=job_id).update(progress=progress, current_step=current_step)
+
+    def set_part(self, job_id, part, parts, progress, current_step):
+        pass  # The row only advances as whole parts complete
+
+    def get_many(self, job_ids):
+        return {}  # Already on the row
+
+    def clear(self, job_id):
+        pass
+
+
+class RedisProgressBackend(ProgressBackend):
+    """Keeps progress in a Redis hash per job, expiring after SCAN_PROGRESS_TTL seconds."""
+
+    def key(self, job_id) -> str:
+        return f'scans:progress:state:{job_id}'
+
+    def parts_key(self, job_id) -> str:
+        return f'scans:progress:parts:{job_id}'
+
+    def set(self, job_id, progress, current_step):
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hset(self.key(job_id), mapping={'progress': progress, 'current_step': current_step})
+        pipe.expire(self.key(job_id), settings.SCAN_PROGRESS_TTL)
+        try:
+            pipe.execute()
+        except redis.RedisError:
+            # Losing a progress tick must not fail the scan
+            logger.warning('Could not store progress for job %s', job_id, exc_info=True)
+
+    def set_part(self, job_id, part, parts, progress, current_step):
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hset(self.parts_key(job_id), str(part), progress)
+        pipe.expire(self.parts_key(job_id), settings.SCAN_PROGRESS_TTL)
+        pipe.hvals(self.parts_key(job_id))
+        try:
+            values = pipe.execute()[-1]
+        except redis.RedisError:
+            logger.warning('Could not store progress for job %s', job_id, exc_info=True)
+            return
+        self.set(job_id, sum(int(v) for v in values) // parts, current_step)
+
+    def get_many(self, job_ids):
+        job_ids = [str(job_id) for job_id in job_ids]
+        if not job_ids:
+            return {}
+        pipe = get_redis().pipeline(transaction=False)
+        for job_id in job_ids:
+            pipe.hgetall(self.key(job_id))
+        live = {}
+        for job_id, values in zip(job_ids, pipe.execute()):
+            if values:
+                live[job_id] = {
+                    'progress': int(values[b'progress']),
+                    'current_step': values[b'current_step'].decode(),
+                }
+        return live
+
+    def clear(self, job_id):
+        try:
+            get_redis().delete(self.key(job_id), self.parts_key(job_id))
+        except redis.RedisError:
+            logger.warning('Could not clear progress for job %s', job_id, exc_info=True)  # Expires via TTL anyway
+
+
+def load_progress_backend(path: str) -> ProgressBackend:
+    """
+    Resolve and instantiate SCAN_PROGRESS_BACKEND. Called from ScansConfig.ready(), so a
+    misconfigured path fails at startup instead of in the progress callback of a running scan.
+    """
+    global _backend
+    try:
+        cls = import_string(path)
+    except ImportError as e:
+        raise ImproperlyConfigured(f"SCAN_PROGRESS_BACKEND = '{path}' cannot be imported: {e}")
+    if not (isinstance(cls, type) and issubclass(cls, ProgressBackend)):
+        raise ImproperlyConfigured(f"SCAN_PROGRESS_BACKEND = '{path}' is not a ProgressBackend")
+    try:
+        _backend = cls()
+    except TypeError as e:  # Abstract methods left unimplemented
+        raise ImproperlyConfigured(f"SCAN_PROGRESS_BACKEND = '{path}' cannot be instantiated: {e}")
+    return _backend
+
+
+def get_progress_backend() -> ProgressBackend:
+    if _backend is None:
+        return load_progress_backend(settings.SCAN_PROGRESS_BACKEND)
+    return _backend
+
+
+def merge_live_progress(jobs: Iterable) -> None:
+    """
+    Overlay live progress onto running ScanJob instances in place, with one backend round trip.
+
+    Falls back to the values on the row if the backend is unreachable.
+    """
+    running = [job for job in jobs if job.status == 'running']
+    if not running:
+        return
+    try:
+        live = get_progress_backend().get_many(job.job_id for job in running)
+    except redis.RedisError:
+        logger.warning('Could not read live progress', exc_info=True)
+        return
+    for job in running:
+        values = live.get(str(job.job_id))
+        if values:
+            job.progress = values['progress']
+            job.current_step = values['current_step']
+
+
+def publish_progress(job_id, payload: Dict) -> None:
+    """
+    Publish a progress/status update for a job to its pub/sub channel.
+
+    Best effort: a Redis outage must never fail the scan itself, subscribers simply miss the update.
+    """
+    message = json.dumps({'job_id': str(job_id), **payload})
+    try:
+        get_redis().publish(progress_channel(job_id), message)
+    except redis.RedisError:
+        logger.warning('Could not publish progress for job %s', job_id, exc_info=True)
+
+
+def publish_job_state(job) -> None:
+    publish_progress(job.job_id, {'status': job.status, 'progress': job.progress, 'current_step': job.current_step})
+
+
+async def subscribe_progress(job_id, heartbeat: float) -> AsyncIterator[Optional[Dict]]:
+    """
+    Yield progress updates published for a job as they arrive.
+
+    Yields None when nothing arrived for ``heartbeat`` seconds so callers can keep the
+    connection alive. The subscription is opened before the first yield, so anything
+    published after the caller reads the job's current state is not lost.
+    """
+    client = aioredis.Redis.from_url(settings.SCAN_PROGRESS_REDIS_URL)
+    pubsub = client.pubsub()
+    try:
+        await pubsub.subscribe(progress_channel(job_id))
+        yield None
+        last_yield = time.monotonic()
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=heartbeat)
+            if message is not None:
+                yield json.loads(message['data'])
+                last_yield = time.monotonic()
+            elif time.monotonic() - last_yield >= heartbeat:
+                yield None
+                last_yield = time.monotonic()
+            else:
+                await asyncio.sleep(0.1)  # Subscribe confirmations also come back as None
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
@@ -0,0 +1,325 @@
+import heapq
+import logging
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import redis
+from django.conf import settings
+from kombu.exceptions import OperationalError
+from django.db.models import F, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+
+from .models import ScanJob
+from .progress import get_redis
+
+logger = logging.getLogger(__name__)
+
+QUICK, LONG = 'quick', 'long'
+LOCK_KEY = 'scans:scheduler:lock'
+RERUN_KEY = 'scans:scheduler:rerun'
+
+
+@dataclass(frozen=True)
+class PendingScan:
+    job_id: object
+    user_id: int
+    tool_name: str
+    lane: str
+    cost: int  # Expected duration in seconds, the weight a job adds to its user's load
+    created_at: datetime
+
+
+@dataclass(frozen=True)
+class SchedulerLimits:
+    per_user: int
+    per_tool: Dict[str, int]
+    default_per_tool: int
+    per_lane: Dict[str, int]
+
+    @classmethod
+    def from_settings(cls) -> 'SchedulerLimits':
+        return cls(
+            per_user=settings.SCAN_USER_CONCURRENCY,
+            per_tool={name.lower(): limit for name, limit in settings.SCAN_TOOL_CONCURRENCY.items()},
+            default_per_tool=settings.SCAN_DEFAULT_TOOL_CONCURRENCY,
+            per_lane=settings.SCAN_LANE_CONCURRENCY,
+        )
+
+    def tool_limit(self, tool_name: str) -> int:
+        return self.per_tool.get(tool_name.lower(), self.default_per_tool)
+
+
+@dataclass
+class SchedulerState:
+    """Jobs currently holding a slot, counted per user, tool and lane, plus each user's load."""
+    by_user: Dict[int, int] = field(default_factory=lambda: defaultdict(int))
+    by_tool: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    by_lane: Dict[str, int] = field(default_factory=lambda: defaultdict(int))
+    load: Dict[int, int] = field(default_factory=lambda: defaultdict(int))
+
+    @classmethod
+    def from_db(cls) -> 'SchedulerState':
+        state = cls()
+        active = ScanJob.objects.filter(status__in=('queued', 'running'), dispatched_at__isnull=False)
+        for user_id, tool_name, duration in active.values_list('user_id', 'tool__name', expected_duration()):
+            state.add(user_id, tool_name.lower(), lane_for(duration), job_cost(duration))
+        return state
+
+    def add(self, user_id: int, tool_name: str, lane: str, cost: int) -> None:
+        self.by_user[user_id] += 1
+        self.by_tool[tool_name] += 1
+        self.by_lane[lane] += 1
+        self.load[user_id] += cost
+
+    def remove(self, user_id: int, tool_name: str, lane: str, cost: int) -> None:
+        self.by_user[user_id] -= 1
+        self.by_tool[tool_name] -= 1
+        self.by_lane[lane] -= 1
+        self.load[user_id] -= cost
+
+    def admits(self, scan: PendingScan, limits: SchedulerLimits) -> bool:
+        return (
+            self.by_user[scan.user_id] < limits.per_user
+            and self.by_tool[scan.tool_name] < limits.tool_limit(scan.tool_name)
+            and self.by_lane[scan.lane] < limits.per_lane.get(scan.lane, limits.per_lane[QUICK])
+        )
+
+
+def expected_duration():
+    # The job's own estimate (scans.estimates), or the tool's static one for jobs submitted without it
+    return Coalesce('expected_duration', 'tool__estimated_duration')
+
+
+def lane_for(estimated_duration: Optional[int]) -> str:
+    return LONG if (estimated_duration or 0) > settings.SCAN_LONG_SCAN_THRESHOLD else QUICK
+
+
+def job_cost(estimated_duration: Optional[int]) -> int:
+    return max(estimated_duration or 0, 1)
+
+
+def queue_for_lane(lane: str) -> str:
+    return settings.SCAN_LANE_QUEUES[lane]
+
+
+def shortest_first_key(scan: PendingScan):
+    """
+    Sort key putting the scan expected to finish soonest first, less SCAN_SCHEDULER_AGING seconds
+    for every second it has waited: a scan submitted N seconds before another goes first unless it
+    is expected to run more than N * aging seconds longer, so long scans are never starved.
+    """
+    return scan.cost + scan.created_at.timestamp() * settings.SCAN_SCHEDULER_AGING, scan.created_at
+
+
+def fair_order(pending: Iterable[PendingScan], state: SchedulerState, limits: Optional[SchedulerLimits] = None) -> Iterator[PendingScan]:
+    """
+    Yield pending scans in weighted fair dispatch order, updating ``state`` as each one is taken.
+
+    The next scan always comes from the user with the least load, where load is the summed
+    expected duration of their active scans; a user running hours of full scans therefore
+    yields to one submitting a quick scan. Within a user, scans go shortest expected first
+    (see shortest_first_key()), or in submission order with SCAN_SCHEDULER_SHORTEST_FIRST off.
+    With ``limits``, scans that would exceed a per-user, per-tool or per-lane limit are
+    skipped (without blocking that user's other scans) and the generator stops once
+    nothing more fits. Pure: no DB access, so it also drives simulations.
+    """
+    pending = sorted(pending, key=shortest_first_key if settings.SCAN_SCHEDULER_SHORTEST_FIRST else lambda scan: scan.created_at)
+    queues: Dict[int, deque] = defaultdict(deque)
+    for scan in pending:
+        queues[scan.user_id].append(scan)
+
+    heap = [(state.load[user_id], user_queue[0].created_at, user_id) for user_id, user_queue in queues.items()]
+    heapq.heapify(heap)
+    while heap:
+        _, _, user_id = heapq.heappop(heap)
+        user_queue = queues[user_id]
+
+        scan = None
+        for candidate in user_queue:
+            if limits is None or state.admits(candidate, limits):
+                scan = candidate
+                break
+        if scan is None:
+            continue  # Nothing of this user's fits right now; their scans wait for a slot
+
+        user_queue.remove(scan)
+        state.add(scan.user_id, scan.tool_name, scan.lane, scan.cost)
+        yield scan
+        if user_queue:
+            heapq.heappush(heap, (state.load[user_id], user_queue[0].created_at, user_id))
+
+
+def pending_scans() -> List[PendingScan]:
+    """
+    Oldest SCAN_SCHEDULER_WINDOW scans waiting for dispatch (jobs attached to a cached scan never run).
+
+    At most SCAN_SCHEDULER_USER_WINDOW of them per user, so a user who submits a batch of
+    thousands cannot push everyone else's scans out of the window.
+    """
+    rows = (
+        ScanJob.objects
+        .filter(status='queued', dispatched_at__isnull=True, source_job__isnull=True)
+        .annotate(user_rank=Window(RowNumber(), partition_by=[F('user_id')], order_by=F('created_at').asc()))
+        .filter(user_rank__lte=settings.SCAN_SCHEDULER_USER_WINDOW)
+        .order_by('created_at')
+        .values_list('job_id', 'user_id', 'tool__name', expected_duration(), 'created_at')
+        [:settings.SCAN_SCHEDULER_WINDOW]
+    )
+    return [
+        PendingScan(job_id, user_id, tool_name.lower(), lane_for(duration), job_cost(duration), created_at)
+        for job_id, user_id, tool_name, duration, created_at in rows
+    ]
+
+
+@contextmanager
+def _dispatch_lock() -> Iterator[bool]:
+    """
+    Serialize dispatchers so limits hold across web and worker processes; yields False if busy.
+
+    Never waits: dispatch_pending() runs in request threads, and a busy lock means another
+    dispatcher is mid-round (see _request_rerun()).
+    """
+    lock = get_redis().lock(LOCK_KEY, timeout=30)
+    try:
+        acquired = lock.acquire(blocking=False)
+    except redis.RedisError:
+        # Without Redis the claim below still prevents double dispatch, limits are just best effort
+        logger.warning('Scheduler lock unavailable, dispatching unlocked', exc_info=True)
+        yield True
+        return
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except redis.exceptions.LockNotOwnedError:
+                pass  # Lock expired; it is released already
+            except redis.RedisError:
+                logger.warning('Could not release scheduler lock, it expires on its own', exc_info=True)
+
+
+def _request_rerun() -> bool:
+    """
+    Ask the dispatcher holding the lock for one more round once it is done, since it may have read
+    the pending set before our job existed. False if the lock was released meanwhile (take it then).
+    """
+    try:
+        client = get_redis()
+        client.set(RERUN_KEY, 1, ex=60)
+        # The holder checks the flag after releasing, so if it still holds the lock now it will see it
+        return bool(client.exists(LOCK_KEY))
+    except redis.RedisError:
+        return True  # Beat's next round picks the job up
+
+
+def _rerun_requested() -> bool:
+    try:
+        return bool(get_redis().delete(RERUN_KEY))
+    except redis.RedisError:
+        return False
+
+
+def dispatch_pending() -> int:
+    """
+    Send every pending scan that fits within the concurrency limits to its lane's Celery queue.
+
+    Called when a scan is submitted, when one finishes, and periodically from beat. Each job is
+    claimed with a conditional update of ``dispatched_at``, so it is sent at most once; a job that
+    could not be sent (broker down) is released again for the next round.
+    :return: number of scans dispatched
+    """
+    dispatched = 0
+    while True:
+        with _dispatch_lock() as acquired:
+            if acquired:
+                now = timezone.now()
+                claimed = [
+                    scan for scan in fair_order(pending_scans(), SchedulerState.from_db(), SchedulerLimits.from_settings())
+                    if ScanJob.objects.filter(pk=scan.job_id, dispatched_at__isnull=True).update(dispatched_at=now)
+                ]
+        if not acquired:
+            if _request_rerun():
+                return dispatched
+            continue
+
+        # Sent outside the lock: an eager or very fast task finishing re-enters dispatch_pending
+        dispatched += _send(claimed, now)
+        if not _rerun_requested():
+            return dispatched
+
+
+def _send(claimed: List[PendingScan], dispatched_at: datetime) -> int:
+    from .tasks import run_scan_task # type: ignore
+
+    if not claimed:
+        return 0
+    sent = 0
+    try:
+        # One producer (connection and channel) for the whole round instead of one per message
+        with run_scan_task.app.producer_or_acquire() as producer:
+            for scan in claimed:
+                run_scan_task.apply_async(args=[str(scan.job_id)], queue=queue_for_lane(scan.lane), producer=producer)
+                sent += 1
+    except OperationalError:
+        # Unsent jobs would otherwise hold their slot without ever running
+        logger.warning('Could not publish %d scans, releasing them for the next round', len(claimed) - sent, exc_info=True)
+        unsent = [scan.job_id for scan in claimed[sent:]]
+        ScanJob.objects.filter(pk__in=unsent, status='queued', dispatched_at=dispatched_at).update(dispatched_at=None)
+    return sent
+
+
+def reap_stale_jobs() -> Dict[str, int]:
+    """
+    Free the slots of jobs whose worker or Celery message was lost (called from beat).
+
+    A job dispatched but still queued SCAN_DISPATCH_STALE_AFTER seconds later is released for
+    dispatch again (run_scan_task skips whichever copy starts second). A job still running
+    SCAN_RUNNING_STALE_GRACE seconds past its wall-clock limit (scan_timeouts()) is failed;
+    jobs without a limit are left alone.
+    :return: number of jobs released and failed
+    """
+    from .cancellation import scan_timeouts # type: ignore
+    from .tasks import fail_job # type: ignore
+
+    now = timezone.now()
+    released = ScanJob.objects.filter(
+        status='queued', dispatched_at__lt=now - timedelta(seconds=settings.SCAN_DISPATCH_STALE_AFTER),
+    ).update(dispatched_at=None)
+
+    failed = 0
+    grace = timedelta(seconds=settings.SCAN_RUNNING_STALE_GRACE)
+    for job in ScanJob.objects.filter(status='running', started_at__lt=now - grace).select_related('tool'):
+        limit = scan_timeouts(job.tool.name, job.options if isinstance(job.options, dict) else {})['timeout']
+        if limit and job.started_at + timedelta(seconds=limit) + grace < now:
+            logger.warning('Scan %s still running %s past its time limit, failing it', job.job_id, grace)
+            fail_job(job, 'worker lost')
+            failed += 1
+
+    if released:
+        dispatch_pending()
+    return {'released': released, 'failed': failed}
+
+
+def annotate_queue_positions(jobs: Iterable[ScanJob]) -> None:
+    """
+    Set ``queue_position`` on queued ScanJob instances in place.
+
+    The position is 1-based within the job's lane, following the fair order the dispatcher
+    would use right now; 0 means the job is not waiting on the scheduler (already dispatched
+    and waiting for a worker, or attached to an identical scan).
+    """
+    queued = [job for job in jobs if job.status == 'queued']
+    if not queued:
+        return
+    pending = pending_scans()
+    positions, seen = {}, defaultdict(int)
+    for scan in fair_order(pending, SchedulerState.from_db()):
+        seen[scan.lane] += 1
+        positions[scan.job_id] = seen[scan.lane]
+    for job in queued:
+        job.queue_position = positions.get(job.pk, 0)
@@ -1,7 +1,11 @@
+import math
 import uuid
 from django.conf import settings
 from rest_framework import serializers
-from .models import ScanJob, Tool, Finding,Profile
+from .estimates import remaining_seconds
+from .models import ScanBatch, ScanJob, Tool, Finding,Profile
+from .tasks import normalize_options
+from .utils import runner_registry
 
 
 
@@ -15,11 +19,58 @@ class FindingSerializer(serializers.ModelSerializer):
             "description",
             "category",
             "cvss_score",
+            "cvss_vector",
+            "cwe_ids",
             "remediation",
             "affected_component"
         ]
 
 
+class FindingSearchSerializer(FindingSerializer):
+    job_id = serializers.UUIDField(read_only=True)
+
+    class Meta(FindingSerializer.Meta):
+        fields = FindingSerializer.Meta.fields + [
+            "job_id",
+            "port",
+            "protocol",
+            "service",
+            "version",
+            "service_checked_at",
+            "cve_ids",
+        ]
+
+
+
+def validate_scan_request(attrs):
+    """Consent, tool and input type checks shared by single and batch submissions."""
+    if not attrs.get('consent', False):
+        raise serializers.ValidationError({"error": "User consent required for this tool."})
+
+    tool = attrs.get('tool')
+    if not tool:
+        raise serializers.ValidationError({"error": "Tool is required."})
+
+    if not runner_registry.is_registered(tool.name):
+        raise serializers.ValidationError({"error": f"Tool '{tool.name}' is not supported."})
+
+    input_type = attrs.get('input_type')
+    if input_type and input_type not in tool.supported_input_types:
+        raise serializers.ValidationError({
+            "error": f"Input type '{input_type}' is not supported by '{tool.name}'. "
+        })
+
+    # Checked here, as a bad value would otherwise only fail the scan in the worker
+    service_ttl = normalize_options(attrs.get('options')).get('service_ttl')
+    if service_ttl not in (None, ''):
+        try:
+            valid = not isinstance(service_ttl, bool) and 0 <= float(service_ttl) < math.inf
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            raise serializers.ValidationError({"options": "service_ttl must be a non-negative number of seconds."})
+    return attrs
+
 
 class ScanSerializer(serializers.ModelSerializer):
     status = serializers.CharField(read_only=True)
@@ -30,22 +81,7 @@ class ScanSerializer(serializers.ModelSerializer):
     consent = serializers.BooleanField(write_only=True)
 
     def validate(self, attrs):
-        if not attrs.get('consent', False):
-            raise serializers.ValidationError({"error": "User consent required for this tool."})
-
-        tool = attrs.get('tool')
-        if not tool:
-            raise serializers.ValidationError({"error": "Tool is required."})
-
-        if not settings.TOOL_RUNNERS.get(tool.name.lower()):
-            raise serializers.ValidationError({"error": f"Tool '{tool.name}' is not supported."})
-
-        input_type = attrs.get('input_type')
-        if input_type and input_type not in tool.supported_input_types:
-            raise serializers.ValidationError({
-                "error": f"Input type '{input_type}' is not supported by '{tool.name}'. "
-            })
-        return attrs
+        return validate_scan_request(attrs)
 
     class Meta:
         model = ScanJob
@@ -68,20 +104,13 @@ class ScanResultSerializer(serializers.ModelSerializer):
     raw_output = serializers.SerializerMethodField()
 
     def get_summary(self, obj: ScanJob):
-        findings = obj.findings.all()
-        return {
-            "total_findings": findings.count(),
-            "critical": findings.filter(severity="critical").count(),
-            "high": findings.filter(severity="high").count(),
-            "medium": findings.filter(severity="medium").count(),
-            "low": findings.filter(severity="low").count(),
-            "info": findings.filter(severity="info").count(),
-        }
+        return obj.summary()
 
     def get_raw_output(self, obj: ScanJob):
-        if obj.raw_output:
+        # Only a preview is kept on the row; the full output is served by results/<id>/raw/
+        if obj.raw_output_preview:
             # Limit to first 500 characters
-            return obj.raw_output[:100] + "..." if len(obj.raw_output) > 500 else obj.raw_output
+            return obj.raw_output_preview[:100] + "..." if obj.raw_output_size > 500 else obj.raw_output_preview
         return ""
 
 
@@ -108,11 +137,22 @@ class ScanResultSerializer(serializers.ModelSerializer):
             "findings",
             "summary",
             "raw_output",
+            "timings",
         ]
 
 
 
 class ScanRetrieveSerializer(serializers.ModelSerializer):
+    queue_position = serializers.SerializerMethodField()
+    eta_seconds = serializers.SerializerMethodField()
+
+    def get_queue_position(self, obj: ScanJob):
+        # Set by scheduler.annotate_queue_positions on queued jobs
+        return getattr(obj, "queue_position", None)
+
+    def get_eta_seconds(self, obj: ScanJob):
+        return remaining_seconds(obj)
+
     class Meta:
         model = ScanJob
         fields = [
@@ -122,9 +162,13 @@ class ScanRetrieveSerializer(serializers.ModelSerializer):
             "status",
             "progress",
             "current_step",
+            "queue_position",
+            "expected_duration",
+            "eta_seconds",
             "created_at",
             "started_at",
             "completed_at",
+            "timings",
         ]
     
 
@@ -148,28 +192,110 @@ class ScanRetrieveSerializer(serializers.ModelSerializer):
         if instance.status != "running":
             # remove fields that only make sense for running scans
             data.pop("current_step", None)
+            data.pop("eta_seconds", None)
+        if instance.status != "queued":
+            data.pop("queue_position", None)
 
         return data
 
 
 
+class ScanBatchCreateSerializer(serializers.Serializer):
+    """
+    Many targets for one tool: a JSON list in ``targets``, and/or an uploaded text file in
+    ``targets_file`` (one target per line, blank lines and ``#`` comments ignored).
+    """
+    tool = serializers.PrimaryKeyRelatedField(queryset=Tool.objects.all())
+    input_type = serializers.CharField(max_length=50)
+    consent = serializers.BooleanField()
+    options = serializers.JSONField(required=False)
+    targets = serializers.ListField(child=serializers.CharField(allow_blank=True, trim_whitespace=True), required=False)
+    targets_file = serializers.FileField(required=False)
+
+    def validate(self, attrs):
+        validate_scan_request(attrs)
+
+        targets = list(attrs.get("targets") or [])
+        upload = attrs.pop("targets_file", None)
+        if upload is not None:
+            try:
+                content = upload.read().decode("utf-8")
+            except UnicodeDecodeError:
+                raise serializers.ValidationError({"targets_file": "Must be UTF-8 text, one target per line."})
+            targets.extend(line.split("#", 1)[0].strip() for line in content.splitlines())
+
+        targets = [target for target in targets if target]
+        if not targets:
+            raise serializers.ValidationError({"targets": "At least one target is required."})
+        if len(targets) > settings.SCAN_BATCH_MAX_TARGETS:
+            raise serializers.ValidationError({"targets": f"At most {settings.SCAN_BATCH_MAX_TARGETS} targets per batch."})
+
+        # Validated in one pass; every bad target is reported, not just the first
+        max_length = ScanJob._meta.get_field("target").max_length
+        errors = [f"#{index + 1}: longer than {max_length} characters" for index, target in enumerate(targets) if len(target) > max_length]
+        if errors:
+            raise serializers.ValidationError({"targets": errors[:50]})
+
+        attrs["targets"] = targets
+        return attrs
+
+
+class ScanBatchSerializer(serializers.ModelSerializer):
+    counts = serializers.SerializerMethodField()
+    progress = serializers.SerializerMethodField()
+
+    def get_counts(self, obj: ScanBatch):
+        # Set by the view: jobs per status, from one grouped query
+        return getattr(obj, "status_counts", {})
+
+    def get_progress(self, obj: ScanBatch):
+        counts = getattr(obj, "status_counts", {})
+        finished = sum(counts.get(status, 0) for status in ("completed", "failed", "cancelled"))
+        return finished * 100 // obj.total_jobs if obj.total_jobs else 100
+
+    class Meta:
+        model = ScanBatch
+        fields = ["batch_id", "tool", "input_type", "total_jobs", "counts", "progress", "created_at"]
+
+
+class BatchJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScanJob
+        fields = ["job_id", "target", "status", "progress"]
+
+
+class ScanStatusRequestSerializer(serializers.Serializer):
+    job_ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False)
+
+    def validate_job_ids(self, value):
+        if len(value) > settings.SCAN_STATUS_MAX_IDS:
+            raise serializers.ValidationError(f"At most {settings.SCAN_STATUS_MAX_IDS} job ids per request.")
+        return list(dict.fromkeys(value))
+
+
+class ScanStatusSerializer(serializers.ModelSerializer):
+    queue_position = serializers.SerializerMethodField()
+    eta_seconds = serializers.SerializerMethodField()
+
+    def get_queue_position(self, obj: ScanJob):
+        # Set by scheduler.annotate_queue_positions on queued jobs
+        return getattr(obj, "queue_position", None) if obj.status == "queued" else None
+
+    def get_eta_seconds(self, obj: ScanJob):
+        return remaining_seconds(obj)
+
+    class Meta:
+        model = ScanJob
+        fields = ["job_id", "status", "progress", "current_step", "queue_position", "eta_seconds"]
+
+
 class ScanHistorySerializer(serializers.ModelSerializer):
     scan = serializers.SerializerMethodField()
 
     def get_scan(self, obj: ScanJob):
-        findings = obj.findings.all()
-        summary = {
-            "total_findings": findings.count(),
-            "critical": findings.filter(severity="critical").count(),
-            "high": findings.filter(severity="high").count(),
-            "medium": findings.filter(severity="medium").count(),
-            "low": findings.filter(severity="low").count(),
-            "info": findings.filter(severity="info").count(),
-        }
-
         # Serialize the scan job (not a list)
         scan_data = ScanRetrieveSerializer(obj).data
-        scan_data["summary"] = summary
+        scan_data["summary"] = obj.summary()
         return scan_data
 
     class Meta:
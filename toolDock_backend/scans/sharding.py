@@ -0,0 +1,124 @@
+import ipaddress
+import math
+import xml.etree.ElementTree as ET
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+from tools.nmap_adapter import HostReader
+
+from .artifacts import ArtifactWriter, artifact_path, open_artifact
+
+
+def _tokens(target: str) -> List[str]:
+    return target.replace(',', ' ').split()
+
+
+def _network(token: str) -> Optional[ipaddress._BaseNetwork]:
+    try:
+        return ipaddress.ip_network(token, strict=False)
+    except ValueError:
+        return None  # Hostname or nmap range syntax; scanned as a single unit
+
+
+def count_addresses(target: str) -> int:
+    total = 0
+    for token in _tokens(target):
+        network = _network(token)
+        total += network.num_addresses if network is not None else 1
+    return total
+
+
+def split_target(target: str, shards: int) -> List[str]:
+    """
+    Split a target (CIDRs and/or a host list) into at most ``shards`` targets of similar size.
+
+    Networks are cut into subnets no larger than an even share of the total, then the
+    pieces are packed in order into contiguous groups. Returns one target string per shard.
+    """
+    total = count_addresses(target)
+    share = max(1, math.ceil(total / max(shards, 1)))
+
+    units: List[Tuple[str, int]] = []
+    for token in _tokens(target):
+        network = _network(token)
+        if network is None or network.num_addresses <= share:
+            units.append((token, network.num_addresses if network is not None else 1))
+            continue
+        new_prefix = min(network.max_prefixlen, network.max_prefixlen - int(math.log2(share)))
+        units.extend((str(subnet), subnet.num_addresses) for subnet in network.subnets(new_prefix=new_prefix))
+
+    groups: List[List[str]] = []
+    current: List[str] = []
+    size = 0
+    for token, n in units:
+        current.append(token)
+        size += n
+        if size >= share and len(groups) < shards - 1:
+            groups.append(current)
+            current, size = [], 0
+    if current:
+        groups.append(current)
+
+    return [' '.join(group) for group in groups]
+
+
+def plan_shards(target: str, options: dict, max_parallelism: Optional[int] = None) -> List[str]:
+    """
+    Decide whether a scan should be sharded and return the shard targets ([] means run as one job).
+
+    ``options['shards']`` forces a shard count (0/1 disables sharding); otherwise targets with more
+    than SCAN_SHARD_HOSTS addresses are split into one shard per SCAN_SHARD_HOSTS addresses.
+    Either way the count is capped by SCAN_MAX_SHARDS and the runner's ``max_parallelism``.
+    """
+    limit = settings.SCAN_MAX_SHARDS
+    if max_parallelism:
+        limit = min(limit, max_parallelism)
+
+    requested = options.get('shards')
+    if requested is not None:
+        try:
+            shards = int(requested)
+        except (TypeError, ValueError):
+            shards = 1
+    else:
+        shards = math.ceil(count_addresses(target) / settings.SCAN_SHARD_HOSTS)
+
+    shards = min(shards, limit)
+    if shards <= 1:
+        return []
+
+    targets = split_target(target, shards)
+    return targets if len(targets) > 1 else []
+
+
+def shard_part(index: int) -> str:
+    return f'shard{index}'
+
+
+def merge_shard_artifacts(job_id, shard_count: int) -> ArtifactWriter:
+    """
+    Merge the per-shard Nmap XML artifacts of a job into its main artifact.
+
+    Hosts are streamed out of each shard document one at a time, so the merge never holds a
+    whole document in memory. Shard artifacts are removed once the merged one is in place.
+    """
+    with ArtifactWriter(job_id) as artifact:
+        artifact.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        artifact.write(f'<nmaprun scanner="nmap" shards="{shard_count}">\n')
+        for index in range(shard_count):
+            if not artifact_path(job_id, shard_part(index)).exists():
+                continue  # Shard produced no output
+            with open_artifact(job_id, shard_part(index)) as f:
+                chunks = iter(lambda: f.read(64 * 1024), b'')
+                try:
+                    for host in HostReader.read(chunks):
+                        artifact.write(ET.tostring(host, encoding='unicode'))
+                        artifact.write('\n')
+                except ET.ParseError:
+                    pass  # Truncated shard output; keep the hosts that were complete
+        artifact.write('</nmaprun>\n')
+
+    for index in range(shard_count):
+        artifact_path(job_id, shard_part(index)).unlink(missing_ok=True)
+    return artifact
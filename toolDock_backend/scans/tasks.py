@@ -1,10 +1,30 @@
 import json
-from celery import shared_task
+import logging
+from celery import chord, group, shared_task
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.utils import timezone
-from .models import ScanJob, Finding
+from .models import ScanJob
+from .parsers import parse_error_finding, parse_scan_output, stream_scan_output
+from .persistence import FindingWriter
+from .artifacts import ArtifactWriter, write_artifact
+from .progress import get_progress_backend, publish_job_state
+from .sharding import merge_shard_artifacts, plan_shards, shard_part
+from .cache import release_attached_jobs
+from .cancellation import request_cancel, runner_scope
+from .metrics import StageTimings, job_timings, record_scan_metrics
+from .estimates import record_duration
+from .incremental import find_baseline, load_baseline
+from .scheduler import dispatch_pending, lane_for, queue_for_lane, reap_stale_jobs
+from tools.engine import ProcessCancelled, ProcessTimeout
+from kombu.exceptions import OperationalError
+import xml.etree.ElementTree as ET
 import time
 
-# logger = logging.getLogger(__name__)
+ARTIFACT_FIELDS = ['raw_output_size', 'raw_output_sha256', 'raw_output_preview']
+
+logger = logging.getLogger(__name__)
 
 @shared_task(bind=True)
 def run_scan_task(self, job_id):
@@ -14,25 +34,29 @@ def run_scan_task(self, job_id):
     except ScanJob.DoesNotExist:
         raise ValueError(f"ScanJob with job_id {job_id} does not exist")
 
-    # Update status to 'running' and set started_at
+    # Update status to 'running' and set started_at, unless the job was cancelled while it was queued
     job.status = 'running'
     job.started_at = timezone.now()
     job.current_step = 'Initializing scan'
-    job.save(update_fields=['status', 'started_at', 'current_step'])
+    if not ScanJob.objects.filter(pk=job.pk, status='queued').update(status=job.status, started_at=job.started_at, current_step=job.current_step):
+        return {'job_id': str(job.job_id), 'skipped': True}
+    publish_job_state(job)
 
     # Get the tool runner
-    from .utils import get_tool_runner # type: ignore
+    from .utils import get_tool_runner, runner_registry # type: ignore
     try:
         runner = get_tool_runner(job.tool.name)
+        capabilities = runner_registry.capabilities(job.tool.name)
     except ValueError as e:
-        job.status = 'failed'
-        job.completed_at = timezone.now()
-        job.save(update_fields=['status', 'completed_at'])
+        fail_job(job, e)
         raise
 
-    enable_progress = job.tool.estimated_duration > 30
+    enable_progress = (job.expected_duration or capabilities.expected_duration or job.tool.estimated_duration) > 30
     last_update_time = time.time()
 
+    progress_backend = get_progress_backend()
+    stages = StageTimings()
+
     def progress_callback(progress_percent, step_description, force_save=False):
         nonlocal last_update_time
         if not enable_progress and not force_save:
@@ -41,189 +65,317 @@ def run_scan_task(self, job_id):
         if force_save or (current_time - last_update_time >= 5):  # Throttle to every 5+ seconds
             job.progress = progress_percent
             job.current_step = step_description
-            job.save(update_fields=['progress', 'current_step'])
+            if force_save:
+                job.save(update_fields=['progress', 'current_step'])
+            else:
+                # Transient values go to the progress backend; the row is written on state transitions only
+                progress_backend.set(job.job_id, progress_percent, step_description)
             last_update_time = current_time  # Update timestamp
             # Optional: Celery state for monitoring tools
             self.update_state(state='PROGRESS', meta={'progress': progress_percent, 'current_step': step_description})
+            # Push to SSE subscribers so dashboards don't have to poll
+            publish_job_state(job)
 
     try:
         # Initial progress (0%) right before runner
         progress_callback(0, 'Starting scan', force_save=True)
 
-        opts = job.options
+        opts = normalize_options(job.options)
+        baseline = incremental_baseline(job, opts, capabilities, progress_callback)
 
-        # Normalize:
-        if opts is None or (isinstance(opts, str) and opts.strip() == ""):
-            opts = {}
-        elif isinstance(opts, str):
-            try:
-                opts = json.loads(opts)
-            except Exception:
-                opts = {}
-        elif isinstance(opts, dict):
-            # already good
-            pass
-        else:
-            # Try to coerce (for example a QueryDict or list of pairs)
-            try:
-                opts = dict(opts)
-            except Exception:
-                opts = {}
-
-        # final safe fallback
-        opts = opts or {}
-
-        raw_output = runner.run(job.target, opts, progress_callback=progress_callback)
+        if capabilities.supports_streaming:
+            # Large targets fan out across workers; the chord callback finishes the job
+            shard_targets = plan_shards(job.target, opts, capabilities.max_parallelism)
+            if shard_targets:
+                return dispatch_shards(job, shard_targets)
+
+        # Tool processes run under the job's timeouts and die on a cancel request
+        with runner_scope(job.job_id, job.tool.name, opts):
+            if capabilities.supports_streaming:
+                # Findings are written host by host while the scan is still running,
+                # raw output goes straight to compressed artifact storage
+                artifact, findings_count = stream_scan(
+                    job, runner, job.target, opts, progress_callback, output_format=capabilities.output_format, stages=stages,
+                    baseline=baseline,
+                )
+            else:
+                with stages.stage('runtime'):
+                    raw_output = runner.run(job.target, opts, progress_callback=progress_callback)
+        if not capabilities.supports_streaming:
+            artifact = write_artifact(job.job_id, raw_output)
+
+            # parse findings (pure function)
+            with stages.stage('parse'):
+                findings_data = parse_scan_output(raw_output, job.tool.name)
+
+            # Create DB findings in batched transactions, before the job is marked completed
+            # so anything reading a completed job (including cache reuse) sees all of them
+            with stages.stage('persist'), FindingWriter(job) as writer:
+                writer.extend(findings_data)
 
 
         # Final progress (100%) after runner, force save
         progress_callback(100, 'Scan completed', force_save=True)
 
-        # Save raw_output, status, etc.
-        job.raw_output = raw_output
-        job.status = 'completed'
-        job.completed_at = timezone.now()
-        job.save(update_fields=['raw_output', 'status', 'completed_at'])
-
-        # parse findings (pure function)
-        findings_data = parse_scan_output(raw_output, job.tool.name)
-        
-        # Create DB findings
-        # with transaction.atomic():
-        for finding in findings_data:
-            Finding.objects.create(
-                job=job,
-                severity=finding.get('severity', 'info'),
-                title=finding.get('title', 'Untitled Finding'),
-                description=finding.get('description', ''),
-                category=finding.get('category', ''),
-                cvss_score=finding.get('cvss_score', 0.0),
-                cve_ids=finding.get('cve_ids', []),
-                port=finding.get('port'),
-                protocol=finding.get('protocol'),
-                service=finding.get('service'),
-                version=finding.get('version'),
-                remediation=finding.get('remediation', ''),
-                references=finding.get('references', []),
-                affected_component=finding.get('affected_component', '')
-            )
+        # Save raw output summary, status, etc.
+        complete_job(job, artifact, stages.as_dict())
+
+        if capabilities.supports_streaming:
+            return {'job_id': str(job.job_id), 'findings': findings_count}
 
         return findings_data
 
+    except ProcessCancelled:
+        # cancel_job() already marked the job and freed its slot; keep the partial output and what was measured
+        job.refresh_from_db(fields=['completed_at'])
+        job.timings = job_timings(job, stages.as_dict())
+        job.save(update_fields=[*ARTIFACT_FIELDS, 'timings'])
+        return {'job_id': str(job.job_id), 'cancelled': True}
     except Exception as e:
-        job.status = 'failed'
-        job.completed_at = timezone.now()
-        job.current_step = f'Error: {str(e)}'
-        job.save(update_fields=['status', 'completed_at', 'current_step'])
+        fail_job(job, e, stages.as_dict())
         raise
 
 
-# parsing function (no prints, no file IO)
-import xml.etree.ElementTree as ET
-from typing import List, Dict
+@shared_task(bind=True)
+def run_scan_shard_task(self, job_id, shard_index, shard_target):
+    """Scan one shard of a sharded job; findings go straight to the parent job."""
+    from .utils import get_tool_runner, runner_registry # type: ignore
+    job = ScanJob.objects.select_related('tool').get(job_id=job_id)
+    runner = get_tool_runner(job.tool.name)
+    progress_backend = get_progress_backend()
+    shard_label = f'Shard {shard_index + 1}/{job.shard_count}'
+
+    enable_progress = (job.expected_duration or job.tool.estimated_duration) > 30
+    last_update_time = 0.0
+
+    def progress_callback(progress_percent, step_description, force_save=False):
+        nonlocal last_update_time
+        current_time = time.time()
+        if enable_progress and current_time - last_update_time >= 5:  # Throttle to every 5+ seconds
+            # Job progress is the mean over all shards
+            progress_backend.set_part(job.job_id, shard_index, job.shard_count, progress_percent, f'{shard_label}: {step_description}')
+            last_update_time = current_time
+
+    opts = normalize_options(job.options)
+    capabilities = runner_registry.capabilities(job.tool.name)
+    baseline = incremental_baseline(job, opts, capabilities)
+    stages = StageTimings()
+    with runner_scope(job.job_id, job.tool.name, opts):
+        artifact, findings_count = stream_scan(
+            job, runner, shard_target, opts, progress_callback,
+            part=shard_part(shard_index), output_format=capabilities.output_format,
+            stages=stages, baseline=baseline,
+        )
+
+    # Finishing a shard is a state transition: the row advances by whole shards
+    progress_backend.set_part(job.job_id, shard_index, job.shard_count, 100, f'{shard_label} completed')
+    ScanJob.objects.filter(pk=job.pk).update(shards_done=F('shards_done') + 1)
+    job.refresh_from_db(fields=['status', 'progress', 'current_step', 'shards_done'])
+    shards_progress = job.shards_done * 100 // job.shard_count
+    ScanJob.objects.filter(pk=job.pk).update(progress=Greatest(F('progress'), shards_progress))
+    job.progress = max(job.progress, shards_progress)
+    publish_job_state(job)
+
+    return {'job_id': str(job.job_id), 'shard': shard_index, 'findings': findings_count, 'timings': stages.as_dict()}
+
+
+@shared_task
+def merge_scan_shards_task(shard_results, job_id):
+    """Chord callback: merge shard outputs into the parent job's artifact and complete it."""
+    job = ScanJob.objects.get(job_id=job_id)
+    artifact = merge_shard_artifacts(job.job_id, job.shard_count)
+
+    job.progress = 100
+    job.current_step = 'Scan completed'
+    job.save(update_fields=['progress', 'current_step'])
+    # Stage times of a sharded job are summed over its shards
+    stages = StageTimings()
+    for result in shard_results:
+        stages.merge(result.get('timings', {}))
+    complete_job(job, artifact, stages.as_dict())
+
+    return {'job_id': job_id, 'shards': len(shard_results), 'findings': sum(r['findings'] for r in shard_results)}
+
+
+@shared_task
+def dispatch_pending_scans_task():
+    """Periodic (beat) scheduler round, so no pending scan waits forever on a missed trigger."""
+    return dispatch_pending()
+
+
+@shared_task
+def job_finished_task(job_id):
+    """
+    Follow-ups of a job reaching a final status, off the path that finished it (a worker or a
+    cancel request): metrics, the duration model, jobs attached to it, and a dispatch round.
+    """
+    job = ScanJob.objects.select_related('tool').get(job_id=job_id)
+    record_scan_metrics(job)
+    # Completed runs refine the duration estimate of scans like this one
+    record_duration(job)
+    release_attached_jobs(job)
+    # A slot is free now
+    dispatch_pending()
+
+
+@shared_task
+def reap_stale_scans_task():
+    """Periodic (beat): free the slots of scans whose Celery message or worker was lost."""
+    return reap_stale_jobs()
+
+
+@shared_task
+def fail_sharded_scan_task(request, exc, traceback, job_id):
+    """Chord errback: a shard failed (or was cancelled), so the parent job fails; what the shards got is kept."""
+    job = ScanJob.objects.get(job_id=job_id)
+    merge_shard_artifacts(job.job_id, job.shard_count).save_to(job)
+    fail_job(job, exc)
 
-def parse_scan_output(raw_output: str, tool_name: str) -> List[Dict]:
+
+def dispatch_shards(job, shard_targets):
+    job.shard_count = len(shard_targets)
+    job.shards_done = 0
+    job.current_step = f'Scanning {job.shard_count} shards'
+    job.save(update_fields=['shard_count', 'shards_done', 'current_step'])
+    publish_job_state(job)
+
+    job_id = str(job.job_id)
+    # Shards run in the parent's lane; the scheduler counts the whole sharded job as one slot
+    queue = queue_for_lane(lane_for(job.expected_duration or job.tool.estimated_duration))
+    header = group(run_scan_shard_task.s(job_id, index, target).set(queue=queue) for index, target in enumerate(shard_targets))
+    callback = merge_scan_shards_task.s(job_id).on_error(fail_sharded_scan_task.s(job_id))
+    chord(header)(callback)
+
+    return {'job_id': job_id, 'shards': job.shard_count}
+
+
+def incremental_baseline(job, opts, capabilities, progress_callback=None):
+    """
+    For an incremental rescan (``options["incremental"]``), the open ports of the scan it builds on
+    (see scans.incremental); None for a normal scan, or when there is nothing to build on.
+    """
+    if not (opts.get('incremental') and capabilities.supports_incremental):
+        return None
+    source = find_baseline(job)
+    baseline = load_baseline(source) if source is not None else None
+    if baseline is not None and progress_callback:
+        progress_callback(0, f'Incremental rescan of scan {source.job_id}', force_save=True)
+    return baseline
+
+
+def stream_scan(job, runner, target, opts, progress_callback, part=None, output_format=None, stages=None, baseline=None):
+    """
+    Run a streaming runner against ``target`` and persist findings host by host.
+
+    Raw output is written to the job's artifact (or the named ``part`` of it).
+    Time spent waiting on the tool, parsing and persisting is added to ``stages`` (a StageTimings).
+    With a ``baseline`` (incremental_baseline()) the runner only re-probes what changed.
+    :return: (ArtifactWriter, number of findings written)
+    """
+    output_format = output_format or job.tool.name
+    stages = stages if stages is not None else StageTimings()
+    interrupted = None
+    if baseline is not None:
+        tool_output = runner.stream_incremental(target, opts, baseline, progress_callback=progress_callback)
+    else:
+        tool_output = runner.stream(target, opts, progress_callback=progress_callback)
+    with ArtifactWriter(job.job_id, part=part) as artifact, FindingWriter(job) as writer:
+        try:
+            output = stages.timed('runtime', tool_output)
+            for host_findings in stages.timed('parse', stream_scan_output(artifact.tee(output), output_format)):
+                with stages.stage('persist'):
+                    writer.extend(host_findings)
+            with stages.stage('persist'):
+                writer.flush()
+        except ET.ParseError as e:
+            # Handle invalid XML (e.g., incomplete scan)
+            writer.add(parse_error_finding(e))
+        except (ProcessCancelled, ProcessTimeout) as e:
+            # Hosts finished before the kill are already persisted; keep them and the partial output
+            interrupted = e
+
+    artifact.save_to(job)
+    if interrupted is not None:
+        raise interrupted
+    return artifact, writer.written
+
+
+def complete_job(job, artifact, stages=None):
+    artifact.save_to(job)
+    job.save(update_fields=ARTIFACT_FIELDS)
+    _finish_job(job, 'completed', stages=stages)
+
+
+def fail_job(job, error, stages=None):
+    job.save(update_fields=ARTIFACT_FIELDS)  # Partial output, if any
+    _finish_job(job, 'failed', f'Error: {str(error)}'[:100], stages=stages)
+
+
+def cancel_job(job):
     """
-    Parse Nmap XML output and extract findings for the Finding model.
-    
-    This function assumes the raw_output is Nmap's XML format (from -oX).
-    It extracts open ports/services as basic 'info' findings and, if vulners NSE script
-    was used, extracts vulnerabilities with CVE, CVSS, etc.
-    
-    :param raw_output: The raw XML string from Nmap.
-    :param tool_name: The tool name (e.g., 'nmap') for filtering/custom logic.
-    :return: List of dicts, each representing a Finding object's fields.
+    Cancel a queued or running job: it is marked cancelled and its scheduler slot freed right away,
+    then the worker running it (if any) kills the tool processes and keeps the partial results.
+
+    :return: False if the job had already finished.
     """
-    if tool_name != 'nmap':
-        return []  # Only handle nmap for this example; extend for other tools
-    
-    findings = []
+    if not _finish_job(job, 'cancelled', 'Cancelled by user'):
+        return False
+    request_cancel(job.job_id)
+    return True
+
+
+def _finish_job(job, status, current_step=None, stages=None):
+    """
+    Move an unfinished job to a final status; a job that already finished (e.g. cancelled) is left alone.
+
+    The job's timings are recorded in the same update, from its timestamps plus the worker's ``stages``.
+    Everything else that follows from it runs in job_finished_task once the update is committed.
+    """
+    now = timezone.now()
+    updates = {'status': status, 'completed_at': now}
+    if current_step is not None:
+        updates['current_step'] = current_step
+    job.completed_at = now
+    updates['timings'] = job_timings(job, stages)
+    if not ScanJob.objects.filter(pk=job.pk, status__in=('queued', 'running')).update(**updates):
+        job.refresh_from_db(fields=['status', 'completed_at', 'current_step', 'timings'])
+        return False
+    for field, value in updates.items():
+        setattr(job, field, value)
+
+    get_progress_backend().clear(job.job_id)
+    publish_job_state(job)
+    transaction.on_commit(lambda: _job_finished(str(job.job_id)))
+    return True
+
+
+def _job_finished(job_id):
     try:
-        root = ET.fromstring(raw_output)
-    except ET.ParseError as e:
-        # Handle invalid XML (e.g., incomplete scan)
-        return [{'title': 'Parse Error', 'description': f'Failed to parse Nmap XML: {str(e)}', 'severity': 'critical'}]
-    
-    # Iterate over each <host> in the <nmaprun>
-    for host in root.findall('host'):
-        addr_elem = host.find("address[@addrtype='ipv4']")
-        host_address = addr_elem.get('addr') if addr_elem is not None else 'Unknown'
-        # Extract ports and services
-        ports = host.find('ports')
-        if ports is None:
-            continue
-
-        for port in ports.findall('port'):
-            state_elem = port.find('state')
-            if state_elem is None or state_elem.get('state') != 'open': # Only open ports
-                continue
-
-            port_id = int(port.get('portid')) # type: ignore
-            protocol = port.get('protocol', 'tcp')
-
-            service_elem = port.find('service')
-            service_name = service_elem.get('name') if service_elem is not None else 'Unknown'
-            if service_elem is not None:
-                version = ' '.join(filter(None, [
-                    service_elem.get('product'),
-                    service_elem.get('version')
-                ])).strip()
-            else:
-                version = ''
-
-            finding = {
-                'severity': 'info', # Default; override if vuln found
-                'title': f'Open Port: {port_id}/{protocol}',
-                'description': f'Open port detected on {host_address}. Service: {service_name}. Version: {version}.',
-                'category': 'Network Exposure',
-                'cvss_score': 0.0,
-                'cve_ids': [],
-                'port': port_id,
-                'protocol': protocol,
-                'service': service_name,
-                'version': version,
-                'remediation': 'Ensure this port is necessary and properly secured (e.g., firewall rules, updates).',
-                'references': [],
-                'affected_component': host_address
-            }
-
-            # Check for script outputs (e.g., vulners for vulnerabilities)
-            for script in port.findall('script'):
-                if script.get('id') == 'vulners':
-                    # Parse vulners output: Typically a <table> with <elem> for cve, cvss, etc.
-                    for table in script.findall('table'):
-                        cve = ''
-                        cvss = 0.0
-                        refs = []
-                        for elem in table.findall('elem'):
-                            key = elem.get('key')
-                            if key == 'id':
-                                cve = elem.text
-                            elif key == 'cvss':
-                                try:
-                                    cvss = float(elem.text) # type: ignore
-                                except (ValueError, TypeError):
-                                    cvss = 0.0
-                            elif key == 'references':
-                                refs = elem.text.split() if elem.text else []  # Assuming space-separated
-
-                        if cve:
-                            finding['cve_ids'].append(cve)
-                            finding['cvss_score'] = max(finding['cvss_score'], cvss)  # Take highest
-                            finding['references'].extend(refs)
-                            # Update severity based on CVSS (common mapping)
-                            if cvss >= 9.0:
-                                finding['severity'] = 'critical'
-                            elif cvss >= 7.0:
-                                finding['severity'] = 'high'
-                            elif cvss >= 4.0:
-                                finding['severity'] = 'medium'
-                            elif cvss > 0.0:
-                                finding['severity'] = 'low'
-                            # Enhance description and remediation
-                            finding['description'] += f'\nVulnerability: {cve} (CVSS: {cvss}).'
-                            finding['remediation'] += ' Apply patches or mitigations as per references.'
-
-            findings.append(finding)
-
-    return findings
+        job_finished_task.delay(job_id)
+    except OperationalError:
+        # Broker unreachable: attached jobs would never be released, so do it here
+        logger.warning('Could not queue follow-ups of job %s, running them inline', job_id, exc_info=True)
+        job_finished_task(job_id)
+
+
+def normalize_options(opts):
+    # Normalize:
+    if opts is None or (isinstance(opts, str) and opts.strip() == ""):
+        opts = {}
+    elif isinstance(opts, str):
+        try:
+            opts = json.loads(opts)
+        except Exception:
+            opts = {}
+    elif isinstance(opts, dict):
+        # already good
+        pass
+    else:
+        # Try to coerce (for example a QueryDict or list of pairs)
+        try:
+            opts = dict(opts)
+        except Exception:
+            opts = {}
+
+    # final safe fallback
+    return opts or {}
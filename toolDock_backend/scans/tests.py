@@ -1,3 +1,1312 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import os
+import shutil
+import socket
+import statistics
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from kombu.exceptions import OperationalError
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.query_inspector import assert_max_queries
+from tooldock.celery import app as celery_app
+from tools.engine import ProcessTimeout, current_scope
+from tools.fake_adapter import iter_synthetic_nmap_xml, write_synthetic_nmap_xml
+from tools.nmap_adapter import HostReader
+from tools.tests import FakeNmapEngine
+
+from . import progress
+from .artifacts import ArtifactWriter, artifact_path, read_artifact
+from .cache import clone_results, find_reusable_jobs, scan_cache_key
+from .cve_index import build_cve_index
+from .estimates import DurationModel, duration_group, estimate_duration, record_duration, remaining_seconds
+from .incremental import find_baseline, load_baseline
+from .management.commands.bench_pipeline import Command as BenchPipelineCommand
+from .metrics import MetricsBuffer, record_many
+from .models import Cve, Finding, ScanBatch, ScanDurationStats, ScanJob, Tool, ToolCategory
+from .parsers import parse_scan_output, stream_scan_output
+from .persistence import FindingWriter
+from .sharding import merge_shard_artifacts, plan_shards, shard_part, split_target
+from .scheduler import (
+    RERUN_KEY, PendingScan, SchedulerLimits, SchedulerState, dispatch_pending, fair_order, pending_scans, reap_stale_jobs,
+)
+from .tasks import cancel_job, job_finished_task, run_scan_task
+from .utils import runner_registry
+
+FAKE_TOOL = 'fake_nmap'
+# Nothing listens there: every Redis-backed feature runs its degraded path (no pub/sub, unlocked scheduler)
+UNREACHABLE_REDIS = 'redis://127.0.0.1:1/0'
+
+
+def synthetic_xml(hosts=3, ports_per_host=2, vulns_per_port=1):
+    addresses = (f'10.0.0.{i + 1}' for i in range(hosts))
+    return ''.join(iter_synthetic_nmap_xml(addresses, ports_per_host, vulns_per_port))
+
+
+def sample_findings(count):
+    """Findings on ports 0..count-1 of one host: even ports high with CVE-2020-0001, odd ones info."""
+    return [
+        {'title': f'Open Port: {port}/tcp', 'port': port, 'protocol': 'tcp', 'service': 'http',
+         'severity': ('high', 'info')[port % 2], 'cvss_score': 7.5 if port % 2 == 0 else 0.0,
+         'cve_ids': ['CVE-2020-0001'] if port % 2 == 0 else [], 'affected_component': '10.0.0.1'}
+        for port in range(count)
+    ]
+
+
+class ScanTestCase(TestCase):
+    """
+    Base for scan tests. Scans run inline (eager Celery) on the fake nmap runner (tools.fake_adapter),
+    raw output goes to a temporary artifacts directory, progress is written to the row and Redis is
+    unreachable, so nothing depends on services outside the test database.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.artifacts_dir = tempfile.mkdtemp(prefix='tooldock-tests-')
+        cls._overrides = override_settings(
+            TOOL_RUNNERS={**settings.TOOL_RUNNERS, FAKE_TOOL: 'tools.fake_adapter.FakeNmapRunner'},
+            SCAN_ARTIFACTS_DIR=cls.artifacts_dir,
+            SCAN_PROGRESS_BACKEND='scans.progress.DatabaseProgressBackend',
+            SCAN_PROGRESS_REDIS_URL=UNREACHABLE_REDIS,
+            CVE_INDEX_PATH=os.path.join(cls.artifacts_dir, 'missing-cve-index.sqlite3'),
+            METRICS_ENABLED=False,
+            QUERY_BUDGET_STRICT=False,
+        )
+        cls._overrides.enable()
+        cls._celery_conf = {name: celery_app.conf[name] for name in ('task_always_eager', 'task_eager_propagates')}
+        celery_app.conf.update(task_always_eager=True, task_eager_propagates=True)
+        # Eager tasks still report their state to the result backend, which is Redis
+        cls._update_state = mock.patch('celery.app.task.Task.update_state')
+        cls._update_state.start()
+        # Nothing to subscribe to; tests deliver cancel requests by cancelling the scan's scope directly
+        cls._cancel_listener = mock.patch('scans.cancellation.cancel_listener._ensure_running')
+        cls._cancel_listener.start()
+        cls._reset_module_state()
+        # Redis being down is expected here; its warnings would only bury test output
+        logging.disable(logging.WARNING)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        logging.disable(logging.NOTSET)
+        cls._cancel_listener.stop()
+        cls._update_state.stop()
+        celery_app.conf.update(cls._celery_conf)
+        cls._overrides.disable()
+        cls._reset_module_state()
+        shutil.rmtree(cls.artifacts_dir, ignore_errors=True)
+
+    @staticmethod
+    def _reset_module_state():
+        # Module-level clients and caches built from settings
+        progress._client = None
+        progress._backend = None
+        runner_registry.load(settings.TOOL_RUNNERS)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('alice')
+        cls.other_user = make_user('bob')
+        category = ToolCategory.objects.create(id='network_scanning', name='Network scanning')
+        cls.tool = Tool.objects.create(
+            name=FAKE_TOOL, display_name='Fake nmap', category=category, difficulty='easy',
+            supported_input_types=['ip', 'cidr', 'domain'], estimated_duration=10,
+        )
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def make_job(self, user=None, **fields):
+        fields = {'input_type': 'ip', 'target': '10.0.0.1', 'status': 'completed', **fields}
+        return ScanJob.objects.create(user=user or self.user, tool=self.tool, **fields)
+
+    def submit(self, client=None, **data):
+        data = {'tool': self.tool.pk, 'target': '10.0.0.1', 'input_type': 'ip', 'consent': True, 'options': {}, **data}
+        return (client or self.client_for(self.user)).post(reverse('scan-list'), data, format='json')
+
+    def run_job(self, job):
+        """Run a queued job through the real scan task, as a worker would, follow-ups included."""
+        with self.captureOnCommitCallbacks(execute=True):
+            run_scan_task.apply(args=[str(job.pk)])
+        job.refresh_from_db()
+        return job
+
+
+def make_user(username):
+    return get_user_model().objects.create_user(username=username, email=f'{username}@example.com', password='secret-pass-123')
+
+
+class StreamingParseTests(TestCase):
+    def test_streamed_findings_match_whole_document_parse(self):
+        raw = synthetic_xml(hosts=5, ports_per_host=3, vulns_per_port=2)
+        streamed = [finding for batch in stream_scan_output(raw.splitlines(keepends=True), 'nmap') for finding in batch]
+        self.assertEqual(streamed, parse_scan_output(raw, 'nmap'))
+        self.assertEqual(len(streamed), 15)
+
+    def test_findings_are_yielded_per_host_as_chunks_arrive(self):
+        lines = iter(synthetic_xml(hosts=3).splitlines(keepends=True))
+        batches = stream_scan_output(lines, 'nmap')
+        first = next(batches)
+        self.assertEqual({finding['affected_component'] for finding in first}, {'10.0.0.1'})
+        # The rest of the document has not been read yet
+        self.assertGreater(len(list(lines)), 0)
+
+    def test_finished_hosts_are_dropped_from_the_tree(self):
+        hosts = list(HostReader.read(synthetic_xml(hosts=4).splitlines(keepends=True)))
+        self.assertEqual(len(hosts), 4)
+        # Each host is detached from <nmaprun> once the next element is read; the last one is what is left
+        self.assertEqual(hosts[-1].find('address').get('addr'), '10.0.0.4')
+
+    def test_truncated_output_keeps_complete_hosts(self):
+        raw = synthetic_xml(hosts=3)
+        truncated = raw[:raw.rindex('<host')]  # Cut inside the last host
+        batches = stream_scan_output([truncated], 'nmap')
+        self.assertEqual(len(next(batches)), 2)
+        self.assertEqual(len(next(batches)), 2)
+        with self.assertRaises(ET.ParseError):
+            list(batches)
+
+    def test_vulners_entries_become_cves_and_severity(self):
+        finding = parse_scan_output(synthetic_xml(hosts=1, ports_per_host=1, vulns_per_port=1), 'nmap')[0]
+        self.assertEqual(finding['port'], 20)
+        self.assertEqual(finding['cve_ids'], ['CVE-2021-00000'])
+        self.assertEqual(finding['service'], 'http')
+
+    def test_other_tools_are_drained_without_findings(self):
+        lines = iter(['a\n', 'b\n'])
+        self.assertEqual(list(stream_scan_output(lines, 'whois')), [])
+        self.assertEqual(list(lines), [])
+
+
+class IncompleteProgressBackend(progress.ProgressBackend):
+    def set(self, job_id, progress, current_step):
+        pass
+
+
+class ProgressBackendTests(TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, progress, '_backend', progress._backend)
+
+    def test_misconfigured_backend_fails_at_startup(self):
+        for path in ('scans.progress.MissingBackend', 'scans.models.ScanJob', f'{__name__}.IncompleteProgressBackend'):
+            with self.subTest(path=path), override_settings(SCAN_PROGRESS_BACKEND=path), \
+                    self.assertRaisesMessage(ImproperlyConfigured, path):
+                apps.get_app_config('scans').ready()
+
+    def test_backend_is_resolved_once(self):
+        backend = progress.load_progress_backend('scans.progress.DatabaseProgressBackend')
+        self.assertIsInstance(backend, progress.DatabaseProgressBackend)
+        self.assertIs(progress.get_progress_backend(), backend)
+
+
+class FindingWriterTests(ScanTestCase):
+    def test_writes_in_batches_of_batch_size(self):
+        job = self.make_job(status='running')
+        with FindingWriter(job, batch_size=4, flush_interval=3600) as writer:
+            writer.extend(sample_findings(9))
+            self.assertEqual(writer.written, 8)
+            self.assertEqual(len(writer.buffer), 1)
+            self.assertEqual(Finding.objects.filter(job=job).count(), 8)
+        self.assertEqual(writer.written, 9)
+        self.assertEqual(Finding.objects.filter(job=job).count(), 9)
+
+    def test_partial_batch_is_flushed_once_older_than_flush_interval(self):
+        job = self.make_job(status='running')
+        first, second = sample_findings(2)
+        with FindingWriter(job, batch_size=100, flush_interval=0.05) as writer:
+            writer.add(first)
+            self.assertEqual(writer.written, 0)
+            time.sleep(0.06)
+            writer.add(second)
+            self.assertEqual(writer.written, 2)
+
+    def test_buffer_is_dropped_when_the_block_raises(self):
+        job = self.make_job(status='running')
+        with self.assertRaises(RuntimeError):
+            with FindingWriter(job, batch_size=100, flush_interval=3600) as writer:
+                writer.extend(sample_findings(3))
+                raise RuntimeError
+        self.assertFalse(Finding.objects.filter(job=job).exists())
+
+    def test_summary_counters_follow_every_flush(self):
+        job = self.make_job(status='running')
+        with FindingWriter(job, batch_size=3, flush_interval=3600) as writer:
+            writer.extend(sample_findings(7))
+        job.refresh_from_db()
+        self.assertEqual(job.total_findings, 7)
+        self.assertEqual(job.high_count, 4)
+        self.assertEqual(job.info_count, 3)
+        self.assertEqual(job.max_cvss, 7.5)
+
+    def test_cves_are_linked_once_per_finding(self):
+        job = self.make_job(status='running')
+        with FindingWriter(job, batch_size=2, flush_interval=3600) as writer:
+            writer.extend(sample_findings(4))
+        linked = Finding.objects.filter(job=job, cve_links__cve_id='CVE-2020-0001')
+        self.assertEqual(sorted(linked.values_list('port', flat=True)), [0, 2])
+
+
+    def write_nvd_dump(self, path):
+        path.write_text(json.dumps({'vulnerabilities': [{'cve': {
+            'id': 'CVE-2020-0001',
+            'metrics': {'cvssMetricV31': [{'type': 'Primary', 'cvssData': {'baseScore': 9.8, 'vectorString': 'CVSS:3.1/AV:N'}}]},
+            'weaknesses': [{'description': [{'value': 'CWE-79'}]}],
+            'references': [],
+        }}]}))
+        return path
+
+    def test_cves_seen_before_the_index_take_its_data(self):
+        first = self.make_job(status='running')
+        with FindingWriter(first, flush_interval=0) as writer:
+            writer.extend(sample_findings(1))
+        self.assertEqual(Cve.objects.get(pk='CVE-2020-0001').cvss_score, 0.0)  # No index yet
+
+        index_dir = Path(tempfile.mkdtemp(dir=self.artifacts_dir))
+        with override_settings(CVE_INDEX_PATH=index_dir / 'cve.sqlite3'):
+            build_cve_index([self.write_nvd_dump(index_dir / 'nvd.json')], index_dir / 'cve.sqlite3')
+            with FindingWriter(self.make_job(status='running'), flush_interval=0) as writer:
+                writer.extend(sample_findings(1))
+        cve = Cve.objects.get(pk='CVE-2020-0001')
+        self.assertEqual((cve.cvss_score, cve.cvss_vector, cve.cwe_ids), (9.8, 'CVSS:3.1/AV:N', ['CWE-79']))
+
+    def test_loading_the_index_refreshes_known_cves(self):
+        with FindingWriter(self.make_job(status='running'), flush_interval=0) as writer:
+            writer.extend(sample_findings(1))
+        index_dir = Path(tempfile.mkdtemp(dir=self.artifacts_dir))
+        out = StringIO()
+        with override_settings(CVE_INDEX_PATH=index_dir / 'cve.sqlite3'):
+            call_command('load_cve_index', str(self.write_nvd_dump(index_dir / 'nvd.json')), stdout=out)
+        self.assertIn('Refreshed 1 known CVEs', out.getvalue())
+        self.assertEqual(Cve.objects.get(pk='CVE-2020-0001').cwe_ids, ['CWE-79'])
+
+
+class FindingSearchTests(ScanTestCase):
+    def setUp(self):
+        self.job = self.make_job(status='running')
+        with FindingWriter(self.job, flush_interval=0) as writer:
+            writer.extend(sample_findings(6))
+            writer.add({'title': 'Open Port: 22/tcp', 'port': 22, 'protocol': 'tcp', 'service': 'ssh', 'version': 'OpenSSH 8.9',
+                        'severity': 'medium', 'cve_ids': ['CVE-2021-44228'], 'affected_component': '10.0.0.1'})
+        self.theirs = self.make_job(user=self.other_user, status='running')
+        with FindingWriter(self.theirs, flush_interval=0) as writer:
+            writer.extend(sample_findings(2))
+
+    def search(self, **params):
+        response = self.client_for(self.user).get(reverse('finding-list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_by_cve(self):
+        results = self.search(cve='cve-2020-0001')['results']
+        self.assertEqual(sorted(finding['port'] for finding in results), [0, 2, 4])
+        self.assertEqual({finding['job_id'] for finding in results}, {str(self.job.pk)})
+
+    def test_by_service_and_version_prefix(self):
+        self.assertEqual(len(self.search(service='http')['results']), 6)
+        self.assertEqual([f['port'] for f in self.search(service='ssh', version='OpenSSH 8')['results']], [22])
+        self.assertEqual(self.search(service='ssh', version='OpenSSH 7')['results'], [])
+
+    def test_by_severity_and_job(self):
+        self.assertEqual(len(self.search(severity='high, MEDIUM')['results']), 4)
+        self.assertEqual(len(self.search(job=str(self.job.pk), severity='info')['results']), 3)
+        self.assertEqual(self.search(job=str(self.theirs.pk))['results'], [])
+
+    def test_keyset_pages(self):
+        first = self.search(page_size=4)
+        self.assertEqual(len(first['results']), 4)
+        second = self.client_for(self.user).get(first['next']).data
+        self.assertEqual(len(second['results']), 3)
+        self.assertIsNone(second['next'])
+        ids = [f['id'] for f in first['results'] + second['results']]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_invalid_job_id(self):
+        response = self.client_for(self.user).get(reverse('finding-list'), {'job': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+class JobFinishedTests(ScanTestCase):
+    """Follow-ups of a finished job run in job_finished_task once its final status is committed."""
+
+    def test_cancel_request_leaves_the_follow_ups_to_a_task(self):
+        job = self.make_job(status='queued')
+        with mock.patch('scans.tasks.dispatch_pending') as dispatch, \
+                self.captureOnCommitCallbacks() as callbacks:
+            response = self.client_for(self.user).post(reverse('scan-cancel', args=[job.pk]))
+            self.assertEqual(response.status_code, 202)
+            dispatch.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+        with mock.patch.object(job_finished_task, 'delay') as delay:
+            callbacks[0]()
+        delay.assert_called_once_with(str(job.pk))
+
+    def test_task_releases_attached_jobs_and_dispatches(self):
+        source = self.make_job(status='queued', options={'fake_ports_per_host': 2, 'fake_vulns_per_port': 0})
+        attached = self.make_job(status='queued', source_job=source)
+        waiting = self.make_job(user=self.other_user, status='queued')
+        with override_settings(SCAN_USER_CONCURRENCY=1), mock.patch.object(run_scan_task, 'apply_async') as apply_async:
+            self.run_job(source)
+        attached.refresh_from_db()
+        self.assertEqual((attached.status, attached.total_findings), ('completed', 2))
+        self.assertEqual(attached.findings.count(), 2)
+        self.assertEqual([call.kwargs['args'][0] for call in apply_async.call_args_list], [str(waiting.pk)])
+
+    def test_follow_ups_run_inline_when_the_broker_is_down(self):
+        job = self.make_job(status='queued')
+        with mock.patch.object(job_finished_task, 'delay', side_effect=OperationalError('broker down')), \
+                mock.patch('scans.tasks.release_attached_jobs') as release, \
+                self.captureOnCommitCallbacks(execute=True):
+            cancel_job(job)
+        release.assert_called_once()
+        self.assertEqual(release.call_args.args[0].pk, job.pk)
+
+
+class ScanPipelineTests(ScanTestCase):
+    def test_scan_task_streams_findings_and_stores_raw_output(self):
+        job = self.run_job(self.make_job(status='queued', target='10.0.0.0/29', options={'fake_ports_per_host': 2}))
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.progress, 100)
+        self.assertEqual(job.total_findings, 12)  # 6 usable addresses, 2 ports each
+        self.assertEqual(Finding.objects.filter(job=job).count(), 12)
+        self.assertTrue(artifact_path(job.pk).exists())
+        self.assertEqual(len(read_artifact(job.pk).encode()), job.raw_output_size)
+        self.assertIn('runtime', job.timings)
+
+    def test_job_no_longer_queued_is_skipped(self):
+        job = self.make_job(status='cancelled')
+        result = run_scan_task.apply(args=[str(job.pk)]).get()
+        self.assertTrue(result['skipped'])
+        self.assertFalse(Finding.objects.filter(job=job).exists())
+
+
+class ShardingTests(ScanTestCase):
+    def test_split_target_into_even_contiguous_shards(self):
+        self.assertEqual(split_target('10.0.0.0/24', 4), ['10.0.0.0/26', '10.0.0.64/26', '10.0.0.128/26', '10.0.0.192/26'])
+        self.assertEqual(split_target('10.0.0.1 10.0.0.2 10.0.0.3 example.com', 2), ['10.0.0.1 10.0.0.2', '10.0.0.3 example.com'])
+
+    @override_settings(SCAN_SHARD_HOSTS=256, SCAN_MAX_SHARDS=16)
+    def test_plan_shards(self):
+        self.assertEqual(plan_shards('10.0.0.0/24', {}), [])
+        self.assertEqual(len(plan_shards('10.0.0.0/22', {})), 4)
+        self.assertEqual(len(plan_shards('10.0.0.0/16', {})), 16)
+        self.assertEqual(len(plan_shards('10.0.0.0/16', {}, max_parallelism=4)), 4)
+        self.assertEqual(len(plan_shards('10.0.0.0/28', {'shards': 2})), 2)
+        self.assertEqual(plan_shards('10.0.0.0/16', {'shards': 1}), [])
+
+    def test_sharded_scan_merges_findings_and_output(self):
+        job = self.run_job(self.make_job(status='queued', target='10.0.0.0/27', options={'shards': 4, 'fake_ports_per_host': 1}))
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.shard_count, 4)
+        self.assertEqual(job.shards_done, 4)
+        self.assertEqual(job.progress, 100)
+        # Every usable address of each /29 shard, once
+        hosts = Finding.objects.filter(job=job).values_list('affected_component', flat=True)
+        self.assertEqual(len(hosts), 24)
+        self.assertEqual(len(set(hosts)), 24)
+        self.assertEqual(job.total_findings, 24)
+
+        merged = ET.fromstring(read_artifact(job.pk))
+        self.assertEqual(merged.get('shards'), '4')
+        self.assertEqual(len(merged.findall('host')), 24)
+        for index in range(4):
+            self.assertFalse(artifact_path(job.pk, shard_part(index)).exists())
+
+    def test_merge_keeps_complete_hosts_of_a_truncated_shard(self):
+        job = self.make_job(status='running', shard_count=2)
+        with ArtifactWriter(job.pk, part=shard_part(0)) as artifact:
+            artifact.write(synthetic_xml(hosts=2))
+        truncated = synthetic_xml(hosts=3)
+        with ArtifactWriter(job.pk, part=shard_part(1)) as artifact:
+            artifact.write(truncated[:truncated.rindex('<host')])
+        merged = merge_shard_artifacts(job.pk, 2)
+        self.assertEqual(len(ET.fromstring(read_artifact(job.pk)).findall('host')), 4)
+        self.assertEqual(merged.size, len(read_artifact(job.pk).encode()))
+
+
+class IncrementalRescanTests(ScanTestCase):
+    """options["incremental"] rescans build on the user's last matching scan (scans.incremental)."""
+
+    options = {'ports': '22', 'service_ttl': 3600}
+
+    def setUp(self):
+        # The real NmapRunner, on processes that answer like nmap would (tools.tests.FakeNmapEngine)
+        self.engine = FakeNmapEngine()
+        overrides = override_settings(TOOL_RUNNERS={**settings.TOOL_RUNNERS, FAKE_TOOL: 'tools.nmap_adapter.NmapRunner'})
+        overrides.enable()
+        self.addCleanup(self._reset_module_state)
+        self.addCleanup(overrides.disable)
+        runner_registry.load(settings.TOOL_RUNNERS)
+        patcher = mock.patch('tools.nmap_adapter.get_engine', return_value=self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scan(self, **options):
+        return self.run_job(self.make_job(status='queued', target='10.0.0.1 10.0.0.2', options={**self.options, **options}))
+
+    def test_rescan_probes_only_what_changed(self):
+        first = self.scan()
+        self.assertEqual(first.total_findings, 2)
+        self.assertEqual(len(self.engine.started), 1)
+
+        self.engine.started.clear()
+        rescan = self.scan(incremental=True)
+        self.assertEqual(rescan.status, 'completed')
+        # A port sweep without version detection, and nothing left to probe
+        self.assertEqual(len(self.engine.started), 1)
+        self.assertNotIn('-sV', self.engine.started[0].args)
+        self.assertEqual(rescan.total_findings, 2)
+        self.assertEqual(
+            set(rescan.findings.values_list('description', flat=True)),
+            set(first.findings.values_list('description', flat=True)),
+        )
+        document = ET.fromstring(read_artifact(rescan.pk))
+        self.assertEqual((document.get('carried'), document.get('probed')), ('2', '0'))
+
+    def test_stale_ports_are_probed_again(self):
+        first = self.scan()
+        ScanJob.objects.filter(pk=first.pk).update(started_at=timezone.now() - timedelta(hours=2))
+        self.engine.started.clear()
+        rescan = self.scan(incremental=True)
+        self.assertEqual(ET.fromstring(read_artifact(rescan.pk)).get('probed'), '2')
+        self.assertIn('-sV', self.engine.started[-1].args)
+
+    def test_baseline_is_the_latest_matching_scan_of_the_user(self):
+        job = self.make_job(status='queued', target='10.0.0.1', options={'ports': '22', 'incremental': True})
+        self.assertIsNone(find_baseline(job))
+        older = self.make_job(target='10.0.0.1', options={'ports': '22'}, raw_output_size=10)
+        latest = self.make_job(target='10.0.0.1', options={'ports': '22', 'incremental': True}, raw_output_size=10)
+        self.make_job(target='10.0.0.1', options={'ports': '80'}, raw_output_size=10)  # Other ports
+        self.make_job(target='10.0.0.1', options={'ports': '22'})  # No raw output left
+        self.make_job(user=self.other_user, target='10.0.0.1', options={'ports': '22'}, raw_output_size=10)
+        self.assertEqual(find_baseline(job), latest)
+        latest.delete()
+        self.assertEqual(find_baseline(job), older)
+
+    def test_load_baseline_keeps_when_ports_were_really_probed(self):
+        started = timezone.now() - timedelta(hours=1)
+        job = self.make_job(started_at=started)
+        with ArtifactWriter(job.pk) as artifact:
+            artifact.write(
+                '<nmaprun><host><address addr="10.0.0.1" addrtype="ipv4"/><ports>'
+                '<port protocol="tcp" portid="22"><state state="open"/><service name="ssh"/></port>'
+                '<port protocol="tcp" portid="80" checked="1000.000"><state state="open"/></port>'
+                '<port protocol="udp" portid="53"><state state="closed"/></port>'
+                '</ports></host></nmaprun>'
+            )
+        baseline = load_baseline(job)
+        self.assertEqual(set(baseline['10.0.0.1']), {'tcp/22', 'tcp/80'})
+        self.assertAlmostEqual(baseline['10.0.0.1']['tcp/22'][1], started.timestamp())
+        self.assertEqual(baseline['10.0.0.1']['tcp/80'][1], 1000.0)
+        self.assertIn('name="ssh"', baseline['10.0.0.1']['tcp/22'][0])
+        self.assertIsNone(load_baseline(self.make_job()))  # No artifact
+
+
+class BenchPipelineTests(ScanTestCase):
+    def test_history_benchmark_reaches_a_deep_page(self):
+        command = BenchPipelineCommand()
+        for jobs in (21, 100):
+            with self.subTest(jobs=jobs):
+                result = command._bench_history(jobs, repeat=1)
+                self.assertEqual(result['deep_page']['queries'], result['first_page']['queries'])
+        self.assertIsNone(command._bench_history(20, repeat=1)['deep_page'])  # A single page
+
+    def test_end_to_end_replays_the_fixture(self):
+        fixtures_dir = tempfile.mkdtemp(dir=self.artifacts_dir)
+        fixture = write_synthetic_nmap_xml(os.path.join(fixtures_dir, 'nmap.xml'), hosts=4, ports_per_host=2, vulns_per_port=1)
+        result = BenchPipelineCommand()._bench_end_to_end(fixture)
+        self.assertEqual((result['status'], result['findings']), ('completed', 8))
+
+
+class CancelTimeoutTests(ScanTestCase):
+    """Cancel and timeouts of a running scan, which keep what was scanned before the stop."""
+    options = {'fake_host_delay': 0.1, 'fake_ports_per_host': 1, 'fake_vulns_per_port': 0}
+
+    def test_timeout_fails_the_scan_with_partial_results(self):
+        job = self.make_job(status='queued', input_type='cidr', target='10.0.0.0/28', options={**self.options, 'timeout': 0.35})
+        with self.assertRaises(ProcessTimeout):
+            run_scan_task.apply(args=[str(job.pk)])
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(job.current_step.startswith('Error: Scan timed out'))
+        self.assertTrue(0 < job.total_findings < 14)
+        self.assertEqual(job.findings.count(), job.total_findings)
+        self.assertEqual(read_artifact(job.job_id).count('<host '), job.total_findings)
+
+    def test_cancel_of_a_running_scan_keeps_partial_results(self):
+        job = self.make_job(status='queued', input_type='cidr', target='10.0.0.0/28', options=self.options)
+        client, hosts = self.client_for(self.user), 0
+
+        def next_host(delay):
+            nonlocal hosts
+            hosts += 1
+            if hosts == 4:
+                response = client.post(reverse('scan-cancel', args=[job.pk]))
+                self.assertEqual(response.status_code, 202)
+                # What the worker's cancel listener does on the message (Redis is unreachable here)
+                current_scope().cancel()
+
+        with mock.patch('tools.fake_adapter.time.sleep', side_effect=next_host):
+            self.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.current_step), ('cancelled', 'Cancelled by user'))
+        self.assertEqual(job.findings.count(), 3)
+        self.assertEqual(read_artifact(job.job_id).count('<host '), 3)
+        self.assertIn('runtime', job.timings)
+
+
+class ScanEndpointTests(ScanTestCase):
+    def test_status(self):
+        job = self.make_job(status='running', progress=40, current_step='Port scanning')
+        response = self.client_for(self.user).get(reverse('scan-detail', args=[job.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'running')
+        self.assertEqual(response.data['progress'], 40)
+
+    def test_cancel_queued_scan(self):
+        job = self.make_job(status='queued', dispatched_at=timezone.now())
+        response = self.client_for(self.user).post(reverse('scan-cancel', args=[job.pk]))
+        self.assertEqual(response.status_code, 202)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'cancelled')
+        # The worker picking it up afterwards does nothing
+        self.assertTrue(run_scan_task.apply(args=[str(job.pk)]).get()['skipped'])
+
+    def test_cancel_finished_scan_conflicts(self):
+        job = self.make_job(status='completed')
+        response = self.client_for(self.user).post(reverse('scan-cancel', args=[job.pk]))
+        self.assertEqual(response.status_code, 409)
+
+    def test_raw_output_with_range(self):
+        job = self.run_job(self.make_job(status='queued'))
+        raw = read_artifact(job.pk).encode()
+        client = self.client_for(self.user)
+
+        response = client.get(reverse('result-raw', args=[job.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), raw)
+
+        response = client.get(reverse('result-raw', args=[job.pk]), HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), raw[:10])
+        self.assertEqual(response['Content-Range'], f'bytes 0-9/{len(raw)}')
+
+        response = client.get(reverse('result-raw', args=[job.pk]), HTTP_RANGE=f'bytes={len(raw) + 10}-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_diff_against_previous_scan(self):
+        base = self.run_job(self.make_job(status='queued', target='10.0.0.1', options={'fake_ports_per_host': 2}))
+        head = self.run_job(self.make_job(status='queued', target='10.0.0.1', options={'fake_ports_per_host': 3}))
+        response = self.client_for(self.user).get(reverse('result-diff', args=[head.pk]), {'base': str(base.pk)})
+        self.assertEqual(response.status_code, 200)
+        data = response.data['data']
+        self.assertEqual(data['base'], str(base.pk))
+        self.assertEqual(data['counts'], {'new': 1, 'resolved': 0, 'unchanged': 2})
+        self.assertEqual(len(data['new']), 1)
+
+    def test_diff_defaults_to_the_previous_scan_of_the_target(self):
+        base = self.run_job(self.make_job(status='queued', options={'fake_ports_per_host': 3}))
+        head = self.run_job(self.make_job(status='queued', options={'fake_ports_per_host': 3}))
+        client = self.client_for(self.user)
+        response = client.get(reverse('result-diff', args=[head.pk]), {'limit': 1})
+        self.assertEqual(response.data['data']['base'], str(base.pk))
+        self.assertEqual(response.data['data']['counts'], {'new': 0, 'resolved': 0, 'unchanged': 3})
+        self.assertEqual(len(response.data['data']['unchanged']), 1)
+        self.assertEqual(client.get(reverse('result-diff', args=[base.pk])).status_code, 404)
+        self.assertEqual(client.get(reverse('result-diff', args=[head.pk]), {'base': 'not-a-uuid'}).status_code, 404)
+
+    def test_diff_of_a_scan_in_progress_conflicts(self):
+        job = self.make_job(status='running')
+        self.assertEqual(self.client_for(self.user).get(reverse('result-diff', args=[job.pk])).status_code, 409)
+
+
+class ScanSubmitTests(ScanTestCase):
+    def test_submit_runs_the_scan(self):
+        response = self.submit(options={'fake_ports_per_host': 1, 'fake_vulns_per_port': 0})
+        self.assertEqual(response.status_code, 202)
+        job = ScanJob.objects.get(pk=response.data['data']['job_id'])
+        self.assertEqual(job.user, self.user)
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.total_findings, 1)
+
+    def test_options_as_object_or_json_string(self):
+        for options in ({'scan_type': 'quick'}, json.dumps({'scan_type': 'quick'})):
+            with self.subTest(options=options), mock.patch.object(run_scan_task, 'apply_async'):
+                response = self.submit(options=options, target=f'10.0.1.{len(str(options))}')
+                self.assertEqual(response.status_code, 202)
+                self.assertIn('wait_url', response.data['data'])
+                job = ScanJob.objects.get(pk=response.data['data']['job_id'])
+                self.assertEqual(job.options, {'scan_type': 'quick'})
+
+    def test_quick_scan_is_never_run_in_the_request(self):
+        with mock.patch.object(run_scan_task, 'apply_async') as apply_async:
+            response = self.submit(options={'scan_type': 'quick'})
+        data = response.data['data']
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(data['status'], 'queued')
+        self.assertTrue(data['wait_url'].endswith(reverse('scan-wait', args=[data['job_id']])))
+        apply_async.assert_called_once()
+
+    def test_invalid_service_ttl_is_refused_at_submission(self):
+        for ttl in ('1h', -5, 'nan', 'inf', True, [60]):
+            with self.subTest(service_ttl=ttl):
+                response = self.submit(options={'incremental': True, 'service_ttl': ttl})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('service_ttl', response.data['options'][0])
+        batch = self.client_for(self.user).post(reverse('batch-list'), {
+            'tool': self.tool.pk, 'input_type': 'ip', 'consent': True, 'targets': ['10.0.0.1'],
+            'options': {'service_ttl': '1h'},
+        }, format='json')
+        self.assertEqual(batch.status_code, 400)
+        self.assertFalse(ScanJob.objects.exists())
+
+        with mock.patch.object(run_scan_task, 'apply_async'):
+            for ttl in (0, '3600', 1.5):
+                with self.subTest(service_ttl=ttl):
+                    self.assertEqual(self.submit(options={'incremental': True, 'service_ttl': ttl}).status_code, 202)
+
+    def test_submit_requires_consent(self):
+        response = self.submit(consent=False)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ScanJob.objects.exists())
+
+
+class ScanCacheTests(ScanTestCase):
+    def test_identical_scan_reuses_the_previous_results(self):
+        first = ScanJob.objects.get(pk=self.submit().data['data']['job_id'])
+        response = self.submit()
+        self.assertEqual(response.data['data']['reused_from'], str(first.pk))
+        job = ScanJob.objects.get(pk=response.data['data']['job_id'])
+        self.assertEqual(job.status, 'completed')
+        self.assertEqual(job.total_findings, first.total_findings)
+        self.assertEqual(job.findings.count(), first.findings.count())
+        self.assertEqual(read_artifact(job.job_id), read_artifact(first.job_id))
+
+    def test_results_are_not_shared_across_users(self):
+        self.submit()
+        response = self.submit(client=self.client_for(self.other_user))
+        self.assertNotIn('reused_from', response.data['data'])
+        job = ScanJob.objects.get(pk=response.data['data']['job_id'])
+        self.assertIsNone(job.source_job)
+        self.assertEqual(job.status, 'completed')
+
+    def test_batches_do_not_reuse_other_users_scans(self):
+        theirs = self.make_job(user=self.other_user, cache_key=scan_cache_key(FAKE_TOOL, '10.0.0.1', {}),
+                               completed_at=timezone.now())
+        mine = self.make_job(target='10.0.0.2', cache_key=scan_cache_key(FAKE_TOOL, '10.0.0.2', {}),
+                             completed_at=timezone.now())
+        keys = [theirs.cache_key, mine.cache_key]
+        self.assertEqual(find_reusable_jobs(self.user, keys), {mine.cache_key: mine})
+        self.assertEqual(find_reusable_jobs(self.other_user, keys), {theirs.cache_key: theirs})
+
+    def test_clone_only_writes_the_result_columns(self):
+        source = self.make_job(total_findings=2, high_count=2, max_cvss=7.5, completed_at=timezone.now())
+        job = self.make_job(status='queued', target='10.0.0.1')
+        # Changed by someone else after this copy of the row was loaded
+        ScanJob.objects.filter(pk=job.pk).update(target='10.0.0.9')
+        clone_results(source, job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.total_findings, job.high_count, job.max_cvss), ('completed', 2, 2, 7.5))
+        self.assertEqual(job.target, '10.0.0.9')
+
+
+class BatchSubmitTests(ScanTestCase):
+    def submit_batch(self, client=None, format='json', **data):
+        data = {'tool': self.tool.pk, 'input_type': 'ip', 'consent': True, **data}
+        return (client or self.client_for(self.user)).post(reverse('batch-list'), data, format=format)
+
+    def test_targets_from_list_and_file_are_submitted_once(self):
+        upload = SimpleUploadedFile('targets.txt', b'10.0.0.3\n\n# office\n10.0.0.4  # printer\n10.0.0.1\n')
+        with mock.patch.object(run_scan_task, 'apply_async') as apply_async:
+            response = self.submit_batch(format='multipart', targets=['10.0.0.1', '10.0.0.2', '10.0.0.1'], targets_file=upload)
+        self.assertEqual(response.status_code, 202)
+        data = response.data['data']
+        self.assertEqual((data['total_jobs'], data['duplicates'], data['reused']), (4, 2, 0))
+        batch = ScanBatch.objects.get(pk=data['batch_id'])
+        self.assertEqual(sorted(batch.jobs.values_list('target', flat=True)), ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4'])
+        # One scheduler round for the whole batch, within the user's concurrency
+        self.assertEqual(apply_async.call_count, settings.SCAN_USER_CONCURRENCY)
+
+    def test_targets_scanned_recently_reuse_the_results(self):
+        previous = self.run_job(self.make_job(status='queued', options={}, cache_key=scan_cache_key(FAKE_TOOL, '10.0.0.1', {})))
+        with mock.patch.object(run_scan_task, 'apply_async'):
+            data = self.submit_batch(targets=['10.0.0.1', '10.0.0.2']).data['data']
+        self.assertEqual(data['reused'], 1)
+        reused = ScanJob.objects.get(batch_id=data['batch_id'], target='10.0.0.1')
+        self.assertEqual((reused.source_job_id, reused.status), (previous.pk, 'completed'))
+        self.assertEqual(reused.findings.count(), previous.findings.count())
+
+    def test_progress_and_jobs_of_a_batch(self):
+        with mock.patch.object(run_scan_task, 'apply_async'):
+            batch_id = self.submit_batch(targets=[f'10.0.0.{i}' for i in range(1, 6)]).data['data']['batch_id']
+        ScanJob.objects.filter(batch_id=batch_id, target__in=['10.0.0.1', '10.0.0.2']).update(status='completed')
+        client = self.client_for(self.user)
+        data = client.get(reverse('batch-detail', args=[batch_id])).data['data']
+        self.assertEqual(data['counts'], {'completed': 2, 'queued': 3})
+        self.assertEqual(data['progress'], 40)
+
+        page = client.get(reverse('batch-jobs', args=[batch_id]), {'page_size': 2}).data
+        self.assertEqual(len(page['results']), 2)
+        self.assertIsNotNone(page['next'])
+        queued = client.get(reverse('batch-jobs', args=[batch_id]), {'status': 'queued'}).data['results']
+        self.assertEqual(sorted(job['target'] for job in queued), ['10.0.0.3', '10.0.0.4', '10.0.0.5'])
+        self.assertEqual(self.client_for(self.other_user).get(reverse('batch-detail', args=[batch_id])).status_code, 404)
+
+    def test_whole_list_is_validated_at_once(self):
+        long_target = 'x' * (ScanJob._meta.get_field('target').max_length + 1)
+        response = self.submit_batch(targets=['10.0.0.1', long_target, '10.0.0.2', long_target])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['targets']), 2)
+        self.assertTrue(response.data['targets'][0].startswith('#2:'))
+        self.assertEqual(self.submit_batch(targets=['', ' ']).status_code, 400)
+        self.assertEqual(self.submit_batch(format='multipart', targets_file=SimpleUploadedFile('t.txt', b'\xff\xfe')).status_code, 400)
+        with override_settings(SCAN_BATCH_MAX_TARGETS=2):
+            self.assertEqual(self.submit_batch(targets=['10.0.0.1', '10.0.0.2', '10.0.0.3']).status_code, 400)
+        self.assertFalse(ScanBatch.objects.exists())
+
+
+class BulkStatusTests(ScanTestCase):
+    def test_status_of_many_jobs_in_one_request(self):
+        done = self.make_job(progress=100)
+        running = self.make_job(status='running', progress=10, current_step='Port scanning', started_at=timezone.now())
+        queued = self.make_job(status='queued')
+        theirs = self.make_job(user=self.other_user)
+        client = self.client_for(self.user)
+        ids = [done.pk, running.pk, queued.pk, theirs.pk]
+
+        response = client.post(reverse('scan-bulk-status'), {'job_ids': [str(job_id) for job_id in ids]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        jobs = response.data['data']['jobs']
+        self.assertEqual([job['job_id'] for job in jobs], [str(done.pk), str(running.pk), str(queued.pk)])
+        self.assertEqual(jobs[1]['current_step'], 'Port scanning')
+        self.assertEqual(jobs[2]['queue_position'], 1)
+        self.assertEqual(response.data['data']['missing'], [str(theirs.pk)])
+
+        response = client.get(reverse('scan-bulk-status'), {'ids': f'{done.pk},{queued.pk}'})
+        self.assertEqual([job['status'] for job in response.data['data']['jobs']], ['completed', 'queued'])
+
+    def test_live_progress_of_running_jobs(self):
+        running = self.make_job(status='running', progress=10, started_at=timezone.now())
+        progress.get_progress_backend().set(running.job_id, 55, 'Host 11/20')
+        jobs = self.client_for(self.user).get(reverse('scan-bulk-status'), {'ids': str(running.pk)}).data['data']['jobs']
+        self.assertEqual((jobs[0]['progress'], jobs[0]['current_step']), (55, 'Host 11/20'))
+
+    def test_raw_output_is_never_loaded(self):
+        job = self.make_job()
+        with CaptureQueriesContext(connection) as captured:
+            self.client_for(self.user).get(reverse('scan-bulk-status'), {'ids': str(job.pk)})
+        job_queries = [query['sql'] for query in captured if 'scans_scanjob' in query['sql']]
+        self.assertEqual(len(job_queries), 1)
+        self.assertNotIn('raw_output', job_queries[0])
+
+    def test_invalid_requests(self):
+        client = self.client_for(self.user)
+        self.assertEqual(client.get(reverse('scan-bulk-status')).status_code, 400)
+        self.assertEqual(client.get(reverse('scan-bulk-status'), {'ids': 'not-a-uuid'}).status_code, 400)
+        with override_settings(SCAN_STATUS_MAX_IDS=2):
+            ids = ','.join(str(self.make_job().pk) for _ in range(3))
+            self.assertEqual(client.get(reverse('scan-bulk-status'), {'ids': ids}).status_code, 400)
+
+
+class DurationEstimateTests(ScanTestCase):
+    """Expected durations learned from completed scans (scans.estimates) and the live ETA built on them."""
+
+    def stats(self, scan_type='', port_spec='', size_bucket=0, count=3, mean=60.0):
+        return ScanDurationStats.objects.create(
+            tool=self.tool, scan_type=scan_type, port_spec=port_spec, size_bucket=size_bucket, count=count, mean=mean,
+        )
+
+    def estimate(self, target='10.0.0.1', **options):
+        return DurationModel.for_tools([self.tool.pk]).estimate(self.tool, target, options)
+
+    def test_duration_group(self):
+        self.assertEqual(
+            duration_group(self.tool.pk, '10.0.0.0/24', {'scan_type': 'full', 'ports': '1-1000', 'incremental': True}),
+            {'tool_id': self.tool.pk, 'scan_type': 'full+incremental', 'port_spec': '1-1000', 'size_bucket': 8},
+        )
+        self.assertEqual(duration_group(self.tool.pk, 'example.com', None)['size_bucket'], 0)
+        self.assertEqual(duration_group(self.tool.pk, '10.0.0.0/30 10.0.1.0/30', {})['size_bucket'], 3)
+
+    def test_estimate_falls_back_from_the_exact_group_to_the_tool(self):
+        self.assertEqual(self.estimate('10.0.0.0/24', scan_type='quick'), 10)  # Nothing learned: Tool.estimated_duration
+        self.stats('quick', size_bucket=8, count=2, mean=999)  # Too few samples to be trusted
+        self.stats('quick', size_bucket=4, mean=40)
+        self.stats('quick', size_bucket=2, count=5, mean=24)
+        self.stats('full', port_spec='80', count=4, mean=300)
+
+        self.assertEqual(self.estimate('10.0.0.0/28', scan_type='quick'), 40)  # Exact group
+        self.assertEqual(self.estimate('10.0.0.0/24', scan_type='quick'), 40)  # Nearest trusted size
+        self.assertEqual(self.estimate('10.0.0.0/30', scan_type='quick'), 24)
+        self.assertEqual(self.estimate(scan_type='quick', ports='443'), 30)  # Same scan type, any ports: (3*40 + 5*24) / 8
+        self.assertEqual(self.estimate(scan_type='full'), 300)
+        self.assertEqual(self.estimate(scan_type='discovery'), 120)  # Whole tool: (120 + 120 + 1200) / 12
+        self.assertEqual(estimate_duration(self.tool, '10.0.0.0/28', {'scan_type': 'quick'}), 40)
+
+    def test_completed_scans_update_their_group(self):
+        job = self.run_job(self.make_job(status='queued'))
+        stats = ScanDurationStats.objects.get(**duration_group(self.tool.pk, job.target, job.options))
+        self.assertEqual(stats.count, 1)
+        self.assertAlmostEqual(stats.mean, (job.completed_at - job.started_at).total_seconds())
+
+        now = timezone.now()
+        record_duration(self.make_job(started_at=now - timedelta(seconds=90), completed_at=now))
+        # Neither a run served from another scan's results nor one that failed says how long this scan takes
+        record_duration(self.make_job(source_job=job, started_at=now - timedelta(seconds=500), completed_at=now))
+        record_duration(self.make_job(status='failed', started_at=now - timedelta(seconds=500), completed_at=now))
+        stats.refresh_from_db()
+        self.assertEqual(stats.count, 2)
+        self.assertAlmostEqual(stats.mean, (job.completed_at - job.started_at).total_seconds() / 2 + 45)
+
+    @override_settings(SCAN_DURATION_MAX_SAMPLES=3)
+    def test_oldest_samples_fade_out_past_the_cap(self):
+        stats = ScanDurationStats(tool=self.tool, size_bucket=0)
+        for seconds in (10, 20, 30):
+            stats.add(seconds)
+        self.assertEqual((stats.count, stats.mean, stats.stddev), (3, 20, 10))
+        stats.add(50)
+        self.assertEqual(stats.count, 3)
+        self.assertAlmostEqual(stats.mean, 30)
+
+    def test_rebuild_command_learns_from_history(self):
+        now = timezone.now()
+        for seconds, target in ((30, '10.0.0.1'), (60, '10.0.0.2'), (600, '10.0.0.0/24')):
+            source = self.make_job(target=target, started_at=now - timedelta(seconds=seconds), completed_at=now)
+        self.make_job(target='10.0.0.0/24', source_job=source, started_at=now - timedelta(seconds=5), completed_at=now)
+        self.make_job(status='running', started_at=now)
+        self.stats('stale', count=50)
+
+        out = StringIO()
+        call_command('rebuild_duration_stats', stdout=out)
+        self.assertIn('Learned 2 duration groups from 3 completed scans', out.getvalue())
+        learned = {row.size_bucket: (row.count, row.mean) for row in ScanDurationStats.objects.all()}
+        self.assertEqual(learned, {0: (2, 45), 8: (1, 600)})
+
+    def test_submissions_store_the_learned_estimate(self):
+        self.stats(mean=42)
+        with mock.patch.object(run_scan_task, 'apply_async'):
+            response = self.submit()
+            batch = self.client_for(self.user).post(reverse('batch-list'), {
+                'tool': self.tool.pk, 'input_type': 'ip', 'consent': True, 'targets': ['10.0.0.2', '10.0.0.0/24'],
+            }, format='json')
+        self.assertEqual(ScanJob.objects.get(pk=response.data['data']['job_id']).expected_duration, 42)
+        durations = dict(ScanJob.objects.filter(batch_id=batch.data['data']['batch_id']).values_list('target', 'expected_duration'))
+        self.assertEqual(durations, {'10.0.0.2': 42, '10.0.0.0/24': 42})
+
+    @override_settings(SCAN_LONG_SCAN_THRESHOLD=300)
+    def test_scheduler_routes_by_the_expected_duration(self):
+        long = self.make_job(status='queued', expected_duration=3600)
+        quick = self.make_job(status='queued')  # No estimate: Tool.estimated_duration
+        lanes = {scan.job_id: (scan.lane, scan.cost) for scan in pending_scans()}
+        self.assertEqual(lanes, {long.pk: ('long', 3600), quick.pk: ('quick', 10)})
+
+    def test_remaining_seconds_blends_the_estimate_and_the_progress_rate(self):
+        now = timezone.now()
+        job = ScanJob(status='running', started_at=now - timedelta(seconds=60), progress=0, expected_duration=100)
+        self.assertEqual(remaining_seconds(job, now), 40)  # Estimate only
+        job.progress = 50
+        self.assertEqual(remaining_seconds(job, now), 50)  # Halfway: 60s at the progress rate, 40s by the estimate
+        job.expected_duration = 50
+        self.assertEqual(remaining_seconds(job, now), 60)  # Past its estimate: the progress rate only
+        job.progress = 0
+        self.assertIsNone(remaining_seconds(job, now))
+        job.status = 'queued'
+        self.assertIsNone(remaining_seconds(job, now))
+
+    def test_eta_of_running_jobs(self):
+        running = self.make_job(status='running', started_at=timezone.now() - timedelta(seconds=60), expected_duration=100)
+        done = self.make_job(expected_duration=100)
+        client = self.client_for(self.user)
+        jobs = client.get(reverse('scan-bulk-status'), {'ids': f'{running.pk},{done.pk}'}).data['data']['jobs']
+        self.assertAlmostEqual(jobs[0]['eta_seconds'], 40, delta=2)
+        self.assertIsNone(jobs[1]['eta_seconds'])
+
+        detail = client.get(reverse('scan-detail', args=[running.pk])).data
+        self.assertEqual(detail['expected_duration'], 100)
+        self.assertAlmostEqual(detail['eta_seconds'], 40, delta=2)
+        self.assertNotIn('eta_seconds', client.get(reverse('scan-detail', args=[done.pk])).data)
+
+
+class QuickScanWaitTests(ScanTestCase):
+    """Long-polling on scans/start/<id>/wait/: an async view, so waiting clients don't hold a worker each."""
+
+    def wait(self, job, user=None, **params):
+        token = RefreshToken.for_user(user or self.user).access_token
+        return AsyncClient().get(reverse('scan-wait', args=[job.pk]), params, headers={'Authorization': f'JWT {token}'})
+
+    async def test_returns_the_result_once_the_scan_finishes(self):
+        job = await sync_to_async(self.make_job)(status='running', dispatched_at=timezone.now())
+
+        async def finish():
+            await asyncio.sleep(0.3)
+            await ScanJob.objects.filter(pk=job.pk).aupdate(status='completed', progress=100, completed_at=timezone.now())
+
+        response, _ = await asyncio.gather(
+            self.wait(job, timeout=5), finish(),
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['data']['status'], 'completed')
+
+    async def test_times_out_with_the_current_status(self):
+        job = await sync_to_async(self.make_job)(status='running', progress=30, dispatched_at=timezone.now())
+        response = await self.wait(job, timeout=0.2)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['data']['progress'], 30)
+
+    async def test_other_users_scans_are_not_found(self):
+        job = await sync_to_async(self.make_job)(user=self.other_user, status='running')
+        response = await self.wait(job, timeout=0.2)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual((await AsyncClient().get(reverse('scan-wait', args=[job.pk]))).status_code, 401)
+
+    async def test_concurrent_waits_do_not_serialize(self):
+        """Load test: 100 clients long-polling at once finish in about one timeout, not one timeout each."""
+        clients, timeout = 100, 0.5
+        jobs = [await sync_to_async(self.make_job)(status='running', dispatched_at=timezone.now()) for _ in range(clients)]
+        started = time.monotonic()
+        responses = await asyncio.gather(*(self.wait(job, timeout=timeout) for job in jobs))
+        elapsed = time.monotonic() - started
+        self.assertEqual({response.status_code for response in responses}, {202})
+        self.assertLess(elapsed, clients * timeout / 10)
+
+
+class RequestMetricsTests(ScanTestCase):
+    """scans.middleware.request_metrics_middleware, under WSGI (sync branch) and ASGI (async branch)."""
+
+    def observed(self, record_many):
+        (observations,), _ = record_many.call_args
+        return {name: (value, labels) for name, value, labels in observations}
+
+    def test_sync_request_records_latency_and_queries(self):
+        self.make_job()
+        with mock.patch('scans.middleware.record_many') as record_many:
+            self.client_for(self.user).get(reverse('history-list'))
+        observed = self.observed(record_many)
+        self.assertEqual(observed['tooldock_http_request_duration_seconds'][1],
+                         {'method': 'GET', 'view': 'history-list', 'status': '2xx'})
+        self.assertGreater(observed['tooldock_http_request_queries'][0], 0)
+
+    async def test_async_request_records_queries_of_a_sync_view(self):
+        await sync_to_async(self.make_job)()
+        token = RefreshToken.for_user(self.user).access_token
+        with mock.patch('scans.middleware.record_many') as record_many:
+            response = await AsyncClient().get(reverse('history-list'), headers={'Authorization': f'JWT {token}'})
+        self.assertEqual(response.status_code, 200)
+        queries, labels = self.observed(record_many)['tooldock_http_request_queries']
+        self.assertEqual(labels, {'method': 'GET', 'view': 'history-list'})
+        # Authentication and the page, run in the sync view's worker thread
+        self.assertEqual(queries, 2)
+
+    async def test_async_request_records_queries_of_an_async_view(self):
+        job = await sync_to_async(self.make_job)()
+        token = RefreshToken.for_user(self.user).access_token
+        with mock.patch('scans.middleware.record_many') as record_many:
+            response = await AsyncClient().get(reverse('scan-wait', args=[job.pk]), {'timeout': 0.1},
+                                               headers={'Authorization': f'JWT {token}'})
+        self.assertEqual(response.status_code, 200)
+        queries, labels = self.observed(record_many)['tooldock_http_request_queries']
+        self.assertEqual(labels['view'], 'scan-wait')
+        self.assertGreater(queries, 0)
+
+
+@override_settings(METRICS_ENABLED=True)
+class MetricsRecordingTests(ScanTestCase):
+    def test_buffered_observations_are_summed_up_until_flushed(self):
+        buffer = MetricsBuffer()
+        with mock.patch('scans.metrics.get_redis') as get_redis:
+            buffer.add([('tooldock_http_request_queries', 3, {'view': 'a'})])
+            buffer.add([('tooldock_http_request_queries', 4, {'view': 'a'})])
+            get_redis.assert_not_called()
+            buffer.flush()
+            buffer.flush()  # Nothing left to write
+        pipeline = get_redis.return_value.pipeline.return_value
+        pipeline.execute.assert_called_once()
+        writes = {call.args[1]: call.args[2] for call in pipeline.hincrbyfloat.call_args_list}
+        self.assertEqual(writes, {'view="a"\tbucket\t3': 2, 'view="a"\tsum': 7, 'view="a"\tcount': 2})
+
+    def test_a_stalled_redis_does_not_hold_up_requests(self):
+        # Accepts connections (into its backlog) and never answers
+        stalled = socket.socket()
+        stalled.bind(('127.0.0.1', 0))
+        stalled.listen(8)
+        self.addCleanup(stalled.close)
+        self.addCleanup(setattr, progress, '_client', None)
+        progress._client = None
+        client = self.client_for(self.user)
+        client.get(reverse('history-list'))  # Warm up, so only the request itself is timed below
+        with override_settings(SCAN_PROGRESS_REDIS_URL=f'redis://127.0.0.1:{stalled.getsockname()[1]}/0'):
+            started = time.monotonic()
+            self.assertEqual(client.get(reverse('history-list')).status_code, 200)
+            self.assertLess(time.monotonic() - started, 0.2)  # Request metrics are buffered
+            record_many([('tooldock_scans_finished_total', 1, {'tool': FAKE_TOOL, 'status': 'completed'})])
+            self.assertLess(time.monotonic() - started, 2)  # A direct write gives up after SCAN_PROGRESS_REDIS_TIMEOUT
+
+
+class MetricsEndpointTests(ScanTestCase):
+    def test_not_served_without_a_token(self):
+        with override_settings(METRICS_TOKEN=''), mock.patch('scans.views.render_metrics') as render:
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        render.assert_not_called()
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_scrapers_need_the_token(self):
+        with mock.patch('scans.views.render_metrics', return_value='# metrics\n'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+            self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+            response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual((response.status_code, response.content), (200, b'# metrics\n'))
+
+
+class QueryBudgetTests(ScanTestCase):
+    """The endpoints stay within their QUERY_BUDGETS entries, authenticated as a real client would be (JWT)."""
+
+    def setUp(self):
+        self.jwt_client = APIClient()
+        self.jwt_client.credentials(HTTP_AUTHORIZATION=f'JWT {RefreshToken.for_user(self.user).access_token}')
+        self.done = self.run_job(self.make_job(status='queued'))
+        self.queued = self.make_job(status='queued')
+
+    def get_within_budget(self, path):
+        with assert_max_queries(method='GET', path=path):
+            response = self.jwt_client.get(path)
+        self.assertEqual(response.status_code, 200)
+
+    def test_submit(self):
+        path = reverse('scan-list')
+        # The scan itself runs in a worker
+        with mock.patch.object(run_scan_task, 'apply_async'), assert_max_queries(method='POST', path=path):
+            response = self.submit(client=self.jwt_client, target='10.0.9.9')
+        self.assertEqual(response.status_code, 202)
+
+    def test_scan_status(self):
+        self.get_within_budget(reverse('scan-detail', args=[self.done.pk]))
+        self.get_within_budget(reverse('scan-detail', args=[self.queued.pk]))
+        self.get_within_budget(f"{reverse('scan-bulk-status')}?ids={self.done.pk},{self.queued.pk}")
+
+    def test_results_and_histories(self):
+        self.get_within_budget(reverse('result-detail', args=[self.done.pk]))
+        for _ in range(10):
+            self.make_job()
+        self.get_within_budget(reverse('history-list'))
+        self.get_within_budget(f"{reverse('history-list')}?status=queued")
+
+
+class ScanAccessTests(ScanTestCase):
+    def test_anonymous_requests_are_rejected(self):
+        job = self.make_job(status='running')
+        client = APIClient()
+        self.assertEqual(client.post(reverse('scan-list'), {'tool': self.tool.pk}, format='json').status_code, 401)
+        self.assertEqual(client.get(reverse('scan-detail', args=[job.pk])).status_code, 401)
+        self.assertEqual(client.post(reverse('scan-cancel', args=[job.pk])).status_code, 401)
+        self.assertEqual(ScanJob.objects.count(), 1)
+
+    def test_other_users_scans_are_not_found(self):
+        job = self.make_job(user=self.other_user, status='running')
+        client = self.client_for(self.user)
+        self.assertEqual(client.get(reverse('scan-detail', args=[job.pk])).status_code, 404)
+        self.assertEqual(client.post(reverse('scan-cancel', args=[job.pk])).status_code, 404)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+
+class ScanResultAccessTests(ScanTestCase):
+    def test_raw_output_requires_authentication(self):
+        job = self.run_job(self.make_job(status='queued'))
+        self.assertEqual(APIClient().get(reverse('result-raw', args=[job.pk])).status_code, 401)
+        self.assertEqual(APIClient().get(reverse('result-raw', args=[job.pk]), HTTP_RANGE='bytes=0-9').status_code, 401)
+
+    def test_other_users_results_are_not_found(self):
+        job = self.run_job(self.make_job(user=self.other_user, status='queued'))
+        client = self.client_for(self.user)
+        self.assertEqual(client.get(reverse('result-detail', args=[job.pk])).status_code, 404)
+        self.assertEqual(client.get(reverse('result-raw', args=[job.pk])).status_code, 404)
+        self.assertEqual(self.client_for(self.other_user).get(reverse('result-raw', args=[job.pk])).status_code, 200)
+
+    def test_diff_only_compares_the_users_own_scans(self):
+        theirs = self.run_job(self.make_job(user=self.other_user, status='queued'))
+        mine = self.run_job(self.make_job(status='queued'))
+        client = self.client_for(self.user)
+        # Their scan of the same target is neither a base to compare with nor a head to open
+        self.assertEqual(client.get(reverse('result-diff', args=[mine.pk]), {'base': str(theirs.pk)}).status_code, 404)
+        self.assertEqual(client.get(reverse('result-diff', args=[theirs.pk]), {'base': str(mine.pk)}).status_code, 404)
+        response = client.get(reverse('result-diff', args=[mine.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['error'], 'No earlier scan of this target to compare with')
+
+
+class SchedulerTests(ScanTestCase):
+    limits = SchedulerLimits(per_user=2, per_tool={}, default_per_tool=10, per_lane={'quick': 10, 'long': 10})
+
+    def pending(self, job_id, user_id, cost=10, submitted=0):
+        return PendingScan(job_id, user_id, 'nmap', 'quick', cost, datetime(2024, 1, 1) + timedelta(seconds=submitted))
+
+    @override_settings(SCAN_SCHEDULER_SHORTEST_FIRST=False)
+    def test_fair_order_alternates_between_users(self):
+        pending = [self.pending(i, 1, submitted=i) for i in range(3)] + [self.pending(10 + i, 2, submitted=5 + i) for i in range(2)]
+        order = [scan.job_id for scan in fair_order(pending, SchedulerState())]
+        self.assertEqual(order, [0, 10, 1, 11, 2])
+
+    def test_fair_order_prefers_the_least_loaded_user(self):
+        state = SchedulerState()
+        state.add(1, 'nmap', 'long', 3600)  # User 1 already runs an hour-long scan
+        pending = [self.pending('busy', 1, submitted=0), self.pending('idle', 2, submitted=10)]
+        self.assertEqual([scan.job_id for scan in fair_order(pending, state)], ['idle', 'busy'])
+
+    def test_fair_order_stops_at_the_limits(self):
+        pending = [self.pending(i, 1, submitted=i) for i in range(5)]
+        self.assertEqual(len(list(fair_order(pending, SchedulerState(), self.limits))), 2)
+
+    @override_settings(SCAN_SCHEDULER_AGING=1.0)
+    def test_shortest_first_with_aging(self):
+        pending = [self.pending('long', 1, cost=600, submitted=0), self.pending('short', 1, cost=10, submitted=5)]
+        self.assertEqual([scan.job_id for scan in fair_order(pending, SchedulerState())][0], 'short')
+        # Waited longer than it is expected to outlast the other one: no longer passed over
+        pending = [self.pending('long', 1, cost=600, submitted=0), self.pending('short', 1, cost=10, submitted=900)]
+        self.assertEqual([scan.job_id for scan in fair_order(pending, SchedulerState())][0], 'long')
+
+    @override_settings(SCAN_USER_CONCURRENCY=2)
+    def test_dispatch_respects_per_user_concurrency(self):
+        jobs = [self.make_job(status='queued') for _ in range(3)]
+        other = self.make_job(user=self.other_user, status='queued')
+        with mock.patch.object(run_scan_task, 'apply_async') as apply_async:
+            self.assertEqual(dispatch_pending(), 3)
+        dispatched = {call.kwargs['args'][0] for call in apply_async.call_args_list}
+        self.assertIn(str(other.pk), dispatched)
+        self.assertEqual(len(dispatched & {str(job.pk) for job in jobs}), 2)
+        # Claimed jobs are never sent twice
+        with mock.patch.object(run_scan_task, 'apply_async') as apply_async:
+            self.assertEqual(dispatch_pending(), 0)
+        apply_async.assert_not_called()
+
+    @override_settings(SCAN_USER_CONCURRENCY=1)
+    def test_finished_scan_frees_its_slot(self):
+        first, second = self.make_job(status='queued'), self.make_job(status='queued')
+        with mock.patch.object(run_scan_task, 'apply_async'):
+            dispatch_pending()
+        first.refresh_from_db()
+        self.assertIsNotNone(first.dispatched_at)
+        # The first scan runs to completion, which dispatches the second
+        self.run_job(first)
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'completed')
+
+    def test_publish_failure_releases_the_claim(self):
+        job = self.make_job(status='queued')
+        with mock.patch.object(run_scan_task, 'apply_async', side_effect=OperationalError('broker down')):
+            self.assertEqual(dispatch_pending(), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.dispatched_at), ('queued', None))
+        # Back in the pending set: the next round sends it
+        with mock.patch.object(run_scan_task, 'apply_async') as apply_async:
+            self.assertEqual(dispatch_pending(), 1)
+        self.assertEqual(apply_async.call_args.kwargs['args'], [str(job.pk)])
+
+    def test_busy_lock_is_not_waited_for(self):
+        job = self.make_job(status='queued')
+        client = mock.Mock()
+        client.lock.return_value.acquire.return_value = False
+        client.exists.return_value = 1
+        with mock.patch('scans.scheduler.get_redis', return_value=client), \
+                mock.patch.object(run_scan_task, 'apply_async') as apply_async:
+            self.assertEqual(dispatch_pending(), 0)
+        client.lock.return_value.acquire.assert_called_once_with(blocking=False)
+        # The dispatcher holding the lock is asked for another round instead
+        client.set.assert_called_once_with(RERUN_KEY, 1, ex=60)
+        apply_async.assert_not_called()
+        job.refresh_from_db()
+        self.assertIsNone(job.dispatched_at)
+
+    def test_lock_holder_runs_the_requested_round(self):
+        self.make_job(status='queued')
+        client = mock.Mock()
+        client.lock.return_value.acquire.return_value = True
+        client.delete.side_effect = [1, 0]
+        with mock.patch('scans.scheduler.get_redis', return_value=client), \
+                mock.patch('scans.scheduler.pending_scans', wraps=pending_scans) as rounds, \
+                mock.patch.object(run_scan_task, 'apply_async'):
+            self.assertEqual(dispatch_pending(), 1)
+        self.assertEqual(rounds.call_count, 2)
+
+    def test_reaper_redispatches_jobs_whose_message_was_lost(self):
+        lost = self.make_job(status='queued', dispatched_at=timezone.now() - timedelta(hours=1))
+        waiting = self.make_job(status='queued', dispatched_at=timezone.now())
+        with mock.patch.object(run_scan_task, 'apply_async') as apply_async:
+            self.assertEqual(reap_stale_jobs(), {'released': 1, 'failed': 0})
+        self.assertEqual([call.kwargs['args'][0] for call in apply_async.call_args_list], [str(lost.pk)])
+        waiting.refresh_from_db()
+        self.assertIsNotNone(waiting.dispatched_at)
+
+    @override_settings(SCAN_RUNNING_STALE_GRACE=600)
+    def test_reaper_fails_jobs_running_past_their_time_limit(self):
+        now, dispatched = timezone.now(), timezone.now() - timedelta(hours=7)
+        lost = self.make_job(status='running', dispatched_at=dispatched, started_at=now - timedelta(hours=7))
+        limited = self.make_job(status='running', dispatched_at=dispatched, started_at=now - timedelta(minutes=30),
+                                options={'timeout': 60})
+        alive = self.make_job(status='running', dispatched_at=dispatched, started_at=now - timedelta(hours=1))
+        queued = self.make_job(user=self.user, status='queued')
+        with override_settings(SCAN_USER_CONCURRENCY=3), mock.patch.object(run_scan_task, 'apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reap_stale_jobs(), {'released': 0, 'failed': 2})
+        for job, status in ((lost, 'failed'), (limited, 'failed'), (alive, 'running')):
+            job.refresh_from_db()
+            self.assertEqual(job.status, status)
+        self.assertEqual(lost.current_step, 'Error: worker lost')
+        # The freed slots go to the waiting job
+        self.assertEqual(apply_async.call_args.kwargs['args'], [str(queued.pk)])
+
+
+@override_settings(SCAN_USER_CONCURRENCY=4, SCAN_LANE_CONCURRENCY={'quick': 8, 'long': 8})
+class QueueLatencyLoadTests(ScanTestCase):
+    """Queue latency of quick scans, through the submit endpoint and the real worker path, behind a flood of full scans."""
+
+    def test_quick_scans_are_dispatched_promptly_behind_a_flood(self):
+        ScanJob.objects.bulk_create(
+            ScanJob(user=self.user, tool=self.tool, input_type='cidr', target=f'10.1.{i}.0/24', expected_duration=3600)
+            for i in range(200)
+        )
+        users = [make_user(f'user{i}') for i in range(10)]
+        clients = [self.client_for(user) for user in users]
+
+        submitted = []
+        with mock.patch.object(run_scan_task, 'apply_async'):
+            dispatch_pending()  # The flood takes its user's slots
+            for i in range(100):
+                response = self.submit(client=clients[i % len(clients)], target=f'10.2.0.{i + 1}',
+                                       options={'fake_ports_per_host': 1, 'fake_vulns_per_port': 0})
+                submitted.append(response.data['data']['job_id'])
+                # One worker slot finishes a quick scan per submission, which dispatches what is waiting
+                running = ScanJob.objects.filter(pk__in=submitted, status='queued', dispatched_at__isnull=False).order_by('dispatched_at').first()
+                if running is not None:
+                    self.run_job(running)
+
+        latencies = [
+            (job.dispatched_at - job.created_at).total_seconds()
+            for job in ScanJob.objects.filter(pk__in=submitted)
+        ]
+        self.assertEqual(len(latencies), 100)
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        self.assertLess(p95, 1.0, f'p95 queue latency {p95:.3f}s')
+        # The flood still only holds its user's slots
+        self.assertEqual(ScanJob.objects.filter(user=self.user, dispatched_at__isnull=False).count(), 4)
@@ -1,9 +1,15 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import ScanViewSet,ScanResultViewSet, ScanHistoryViewSet
+from .views import ScanViewSet,ScanResultViewSet, ScanHistoryViewSet, FindingViewSet, ScanBatchViewSet, wait_for_scan, scan_events
 
 router = DefaultRouter()
 router.register(r'start', ScanViewSet, basename='scan')
 router.register(r'results', ScanResultViewSet, basename='result')
 router.register(r'histories', ScanHistoryViewSet, basename='history')
+router.register(r'findings', FindingViewSet, basename='finding')
+router.register(r'batches', ScanBatchViewSet, basename='batch')
 
-urlpatterns = router.urls
+urlpatterns = router.urls + [
+    path('start/<uuid:pk>/wait/', wait_for_scan, name='scan-wait'),
+    path('start/<uuid:pk>/events/', scan_events, name='scan-events'),
+]
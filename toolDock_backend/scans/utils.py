@@ -1,12 +1,89 @@
-import importlib
+from dataclasses import dataclass
+from typing import Dict, Optional
+
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+
+@dataclass(frozen=True)
+class RunnerCapabilities:
+    supports_streaming: bool = False
+    # Has stream_incremental(): rescans that reuse a previous scan's results (options["incremental"])
+    supports_incremental: bool = False
+    # Upper bound on parallel sub-scans (shards/batches) for one job; None means no runner-specific limit
+    max_parallelism: Optional[int] = None
+    # Typical duration in seconds; None means fall back to Tool.estimated_duration
+    expected_duration: Optional[int] = None
+    output_format: Optional[str] = None
+
+
+class RunnerRegistry:
+    """
+    Resolves settings.TOOL_RUNNERS once and caches runner instances and their capabilities.
+
+    Loaded from ScansConfig.ready(), so a misconfigured entry fails at startup instead of
+    in the middle of a scan, and nothing is imported at request time. Tool names are
+    matched case-insensitively.
+    """
+
+    def __init__(self):
+        self._runners: Dict[str, object] = {}
+        self._capabilities: Dict[str, RunnerCapabilities] = {}
+        self._loaded = False
+
+    def load(self, runners: Dict[str, str]) -> None:
+        resolved, capabilities = {}, {}
+        for tool_name, path in runners.items():
+            try:
+                cls = import_string(path)
+            except ImportError as e:
+                raise ImproperlyConfigured(f"TOOL_RUNNERS['{tool_name}'] = '{path}' cannot be imported: {e}")
+            if not callable(getattr(cls, 'run', None)):
+                raise ImproperlyConfigured(f"TOOL_RUNNERS['{tool_name}'] = '{path}' has no run() method")
+
+            streaming = bool(getattr(cls, 'supports_streaming', False))
+            if streaming and not callable(getattr(cls, 'stream', None)):
+                raise ImproperlyConfigured(f"TOOL_RUNNERS['{tool_name}'] = '{path}' supports streaming but has no stream() method")
+
+            # Runners keep no per-scan state, so one instance per process is shared by all tasks
+            resolved[tool_name.lower()] = cls()
+            capabilities[tool_name.lower()] = RunnerCapabilities(
+                supports_streaming=streaming,
+                supports_incremental=streaming and callable(getattr(cls, 'stream_incremental', None)),
+                max_parallelism=getattr(cls, 'max_parallelism', None),
+                expected_duration=getattr(cls, 'expected_duration', None),
+                output_format=getattr(cls, 'output_format', None),
+            )
+
+        self._runners, self._capabilities = resolved, capabilities
+        self._loaded = True
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.load(settings.TOOL_RUNNERS)
+
+    def is_registered(self, tool_name: str) -> bool:
+        self._ensure_loaded()
+        return tool_name.lower() in self._runners
+
+    def get_runner(self, tool_name: str):
+        self._ensure_loaded()
+        try:
+            return self._runners[tool_name.lower()]
+        except KeyError:
+            raise ValueError(f"Tool '{tool_name}' not registered in settings.TOOL_RUNNERS")
+
+    def capabilities(self, tool_name: str) -> RunnerCapabilities:
+        self._ensure_loaded()
+        try:
+            return self._capabilities[tool_name.lower()]
+        except KeyError:
+            raise ValueError(f"Tool '{tool_name}' not registered in settings.TOOL_RUNNERS")
+
+
+runner_registry = RunnerRegistry()
+
 
 def get_tool_runner(tool_name):
-    path = settings.TOOL_RUNNERS.get(tool_name)
-    if not path:
-        raise ValueError(f"Tool '{tool_name}' not registered in settings.TOOL_RUNNERS")
-
-    module_name, class_name = path.rsplit(".", 1)
-    module = importlib.import_module(module_name)
-    cls = getattr(module, class_name)
-    return cls()
+    return runner_registry.get_runner(tool_name)
@@ -1,55 +1,225 @@
+import asyncio
+import hmac
 import json
+import time
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Count
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin,ListModelMixin
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .artifacts import artifact_path, iter_artifact_range, parse_range_header
+from .cache import attach_to, find_reusable_job, find_reusable_jobs, scan_cache_key, settle_attached
+from .diffing import diff_scans, previous_scan
+from .estimates import DurationModel, estimate_duration
+from .metrics import render as render_metrics
+from .models import Finding, ScanBatch, ScanJob
+from .pagination import BatchJobPagination, FindingPagination, ScanHistoryPagination
+from .progress import merge_live_progress, subscribe_progress
+from .serializers import BatchJobSerializer, FindingSearchSerializer, FindingSerializer, ScanBatchCreateSerializer, ScanBatchSerializer, ScanSerializer,ScanResultSerializer, ScanRetrieveSerializer,ScanHistorySerializer, ScanStatusRequestSerializer, ScanStatusSerializer
+from .scheduler import annotate_queue_positions, dispatch_pending
+from .tasks import cancel_job, normalize_options
+
+class LiveProgressMixin:
+    """Overlay live progress from the progress backend on running jobs before they are serialized."""
+
+    def get_object(self):
+        instance = super().get_object() # type: ignore
+        merge_live_progress([instance])
+        annotate_queue_positions([instance])
+        return instance
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset) # type: ignore
+        if page is not None:
+            merge_live_progress(page)
+            annotate_queue_positions(page)
+        return page
 
-from .models import ScanJob
-from .serializers import ScanSerializer,ScanResultSerializer, ScanRetrieveSerializer,ScanHistorySerializer
-from .tasks import run_scan_task
 
-class ScanViewSet(CreateModelMixin, GenericViewSet,RetrieveModelMixin):
-    queryset = ScanJob.objects.prefetch_related('findings').all()
+class ScanViewSet(LiveProgressMixin, CreateModelMixin, GenericViewSet,RetrieveModelMixin):
+    queryset = ScanJob.objects.all()
     serializer_class = ScanSerializer
+    permission_classes = [IsAuthenticated]
     # lookup_field = "job_id"
 
+    def get_queryset(self):
+        # Other users' scans are not found, whatever the action
+        return super().get_queryset().filter(user=self.request.user)
+
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return ScanRetrieveSerializer
         return ScanSerializer
 
 
-    
-    def _parsed_options(self):
-        raw_options = self.request.data.get("options") # type: ignore
-        if raw_options in (None, "", "null"):
-            return {}
-        try:
-            return json.loads(raw_options)
-        except json.JSONDecodeError:
-            return {}
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        options = normalize_options(serializer.validated_data.get("options"))
+        tool, target = serializer.validated_data["tool"], serializer.validated_data["target"]
+        # Options may arrive as a JSON object or a JSON-encoded string; the job keeps the parsed dict
+        job = serializer.save(
+            user=request.user, options=options, cache_key=scan_cache_key(tool.name, target, options),
+            expected_duration=estimate_duration(tool, target, options),
+        )
+
+        # Identical scan in flight or finished recently: share its execution instead of starting another
+        source = None if options.get("force_refresh") else find_reusable_job(job)
+        if source is not None:
+            attach_to(job, source)
+            job.refresh_from_db(fields=["status", "progress"])
+        else:
+            # Never run the scan in the request thread; the scheduler sends it to Celery once a slot
+            # is free, quick scans hand the client a long-poll URL instead
+            dispatch_pending()
+            job.refresh_from_db(fields=["status", "progress"])
+            annotate_queue_positions([job])
+        response_data = ScanSerializer(job).data
+        if source is not None:
+            response_data["reused_from"] = str(source.job_id)
+        elif job.status == "queued":
+            response_data["queue_position"] = job.queue_position
+
+        if options.get("scan_type") == "quick":
+            response_data["wait_url"] = request.build_absolute_uri(reverse("scan-wait", args=[job.job_id]))
+
+        return Response({"ok": True, "data": response_data}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get', 'post'], url_path='status')
+    def bulk_status(self, request, *args, **kwargs):
+        """
+        Status, progress and current step of many of the user's scans in one call, for dashboards
+        that would otherwise poll each job: ``POST {"job_ids": [...]}`` or ``GET ?ids=<id>,<id>``.
+
+        One query restricted to the status columns (raw output and the rest of the row are never
+        loaded), live progress of running jobs from the progress backend in one round trip.
+        Unknown ids and other users' jobs are listed under "missing".
+        """
+        if request.method == "GET":
+            job_ids = [job_id for job_id in request.query_params.get("ids", "").split(",") if job_id]
+        else:
+            job_ids = request.data.get("job_ids")
+        serializer = ScanStatusRequestSerializer(data={"job_ids": job_ids})
+        serializer.is_valid(raise_exception=True)
+        job_ids = serializer.validated_data["job_ids"]
+
+        jobs = list(
+            self.get_queryset().filter(pk__in=job_ids)
+            .only("job_id", "status", "progress", "current_step", "started_at", "expected_duration")
+        )
+        merge_live_progress(jobs)
+        annotate_queue_positions(jobs)
+
+        found = {job.pk: job for job in jobs}
+        return Response({"ok": True, "data": {
+            "jobs": ScanStatusSerializer([found[job_id] for job_id in job_ids if job_id in found], many=True).data,
+            "missing": [str(job_id) for job_id in job_ids if job_id not in found],
+        }})
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, *args, **kwargs):
+        """Stop a queued or running scan; findings and raw output gathered so far are kept."""
+        job = self.get_object()
+        if not cancel_job(job):
+            return Response({"error": f"Scan already {job.status}"}, status=status.HTTP_409_CONFLICT)
+        return Response({"ok": True, "data": ScanRetrieveSerializer(job).data}, status=status.HTTP_202_ACCEPTED)
+
+class ScanBatchViewSet(CreateModelMixin, RetrieveModelMixin, GenericViewSet):
+    """
+    Submit one tool against many targets in a single request and track them as a unit.
+
+    The whole target list is validated in one pass, the jobs are inserted with bulk_create and
+    handed to the scheduler in one dispatch round (scans reusing a cached execution are attached
+    at insert time). Targets that are the same scan (same cache key) are submitted once.
+    """
+    queryset = ScanBatch.objects.all()
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+    def get_serializer_class(self):
+        return ScanBatchCreateSerializer if self.action == "create" else ScanBatchSerializer
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        job = serializer.save()
+        data = serializer.validated_data
+        tool, targets = data["tool"], data["targets"]
+        options = normalize_options(data.get("options"))
 
+        targets_by_key = {}
+        for target in targets:
+            targets_by_key.setdefault(scan_cache_key(tool.name, target, options), target)
+        sources = {} if options.get("force_refresh") else find_reusable_jobs(request.user, targets_by_key)
+        durations = DurationModel.for_tools([tool.pk])
 
-        scan_type = self._parsed_options().get("scan_type")
+        jobs = []
+        with transaction.atomic():
+            batch = ScanBatch.objects.create(
+                user=request.user, tool=tool, input_type=data["input_type"], options=options, total_jobs=len(targets_by_key),
+            )
+            for cache_key, target in targets_by_key.items():
+                source = sources.get(cache_key)
+                jobs.append(ScanJob(
+                    user=request.user, tool=tool, input_type=data["input_type"], target=target, consent=data["consent"],
+                    options=options, cache_key=cache_key, batch=batch, source_job=source,
+                    expected_duration=durations.estimate(tool, target, options),
+                    current_step=f"Waiting for identical scan {source.job_id}" if source else "",
+                ))
+            ScanJob.objects.bulk_create(jobs, batch_size=1000)
 
+        settle_attached(jobs)
+        dispatch_pending()
 
-        if scan_type == "quick":
-            result_serializer = ScanResultSerializer(job)
-            run_scan_task.apply(args=[str(job.job_id)]).get()
-            return Response({"ok": True, "data": result_serializer.data}, status=status.HTTP_200_OK)
-        
-        run_scan_task.delay(str(job.job_id))
-        response_data = ScanSerializer(job).data
-        return Response({"ok": True, "data": response_data}, status=status.HTTP_202_ACCEPTED)
+        return Response({"ok": True, "data": {
+            "batch_id": str(batch.batch_id),
+            "total_jobs": batch.total_jobs,
+            "duplicates": len(targets) - batch.total_jobs,
+            "reused": sum(1 for job in jobs if job.source_job_id),
+            "status_url": request.build_absolute_uri(reverse("batch-detail", args=[batch.batch_id])),
+        }}, status=status.HTTP_202_ACCEPTED)
 
-class ScanResultViewSet(GenericViewSet,RetrieveModelMixin):
+    def retrieve(self, request, *args, **kwargs):
+        batch = self.get_object()
+        # Jobs per status in one grouped query on the batch index
+        batch.status_counts = dict(batch.jobs.order_by().values_list("status").annotate(count=Count("pk")))
+        return Response({"ok": True, "data": ScanBatchSerializer(batch).data})
+
+    @action(detail=True, methods=['get'])
+    def jobs(self, request, *args, **kwargs):
+        """The batch's jobs (id, target, status, progress), keyset-paginated on the job id."""
+        batch = self.get_object()
+        queryset = batch.jobs.only("job_id", "target", "status", "progress")
+        job_status = request.query_params.get("status")
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        paginator = BatchJobPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(BatchJobSerializer(page, many=True).data)
+
+
+class ScanResultViewSet(LiveProgressMixin, GenericViewSet,RetrieveModelMixin):
     queryset = ScanJob.objects.all()
     serializer_class = ScanResultSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        # Results, diffs and raw output of other users' scans are not found
+        return super().get_queryset().filter(user=self.request.user)
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -59,7 +229,9 @@ class ScanResultViewSet(GenericViewSet,RetrieveModelMixin):
                 "error": "Scan still in progress",
                 "job_status": {
                     "status": instance.status,
-                    "progress": instance.progress
+                    "progress": instance.progress,
+                    # Findings are persisted per host while streaming, so partial results are visible
+                    "findings_found": instance.total_findings,
                 }
             }, status=status.HTTP_202_ACCEPTED)
 
@@ -67,16 +239,253 @@ class ScanResultViewSet(GenericViewSet,RetrieveModelMixin):
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def diff(self, request, *args, **kwargs):
+        """
+        Findings new, resolved and unchanged since ``?base=<job_id>`` (default: the previous completed
+        scan of the same target). Counts are exact; each list holds at most ``?limit=`` findings.
+        """
+        head = self.get_object()
+        if head.status in ("queued", "running"):
+            return Response({"error": "Scan still in progress"}, status=status.HTTP_409_CONFLICT)
 
-class ScanHistoryViewSet(GenericViewSet,RetrieveModelMixin,ListModelMixin):
-    queryset = ScanJob.objects.all()
+        base_id = request.query_params.get("base")
+        if base_id:
+            try:
+                base = self.get_queryset().get(pk=base_id)
+            except (ScanJob.DoesNotExist, DjangoValidationError):
+                return Response({"error": "Base scan job not found"}, status=status.HTTP_404_NOT_FOUND)
+        else:
+            base = previous_scan(head)
+            if base is None:
+                return Response({"error": "No earlier scan of this target to compare with"}, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            limit = min(int(request.query_params.get("limit", settings.SCAN_DIFF_LIMIT)), settings.SCAN_DIFF_MAX_LIMIT)
+        except ValueError:
+            limit = settings.SCAN_DIFF_LIMIT
+
+        sets = diff_scans(base, head)
+        data = {
+            "base": str(base.job_id),
+            "head": str(head.job_id),
+            "counts": {name: queryset.count() for name, queryset in sets.items()},
+        }
+        for name, queryset in sets.items():
+            data[name] = FindingSerializer(queryset.order_by("id")[:limit], many=True).data
+        return Response({"ok": True, "data": data})
+
+    @action(detail=True, methods=['get'], url_path='raw')
+    def raw(self, request, *args, **kwargs):
+        """Stream the full raw tool output from artifact storage, honouring single byte ranges."""
+        instance = self.get_object()
+        if not artifact_path(instance.job_id).exists():
+            return Response({"error": "Raw output not available"}, status=status.HTTP_404_NOT_FOUND)
+
+        size = instance.raw_output_size
+        try:
+            byte_range = parse_range_header(request.headers.get('Range', ''), size)
+        except ValueError:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        start, end = byte_range or (0, size - 1)
+        response = StreamingHttpResponse(
+            iter_artifact_range(instance.job_id, start, end - start + 1),
+            status=status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK,
+            content_type='application/xml',
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = f'"{instance.raw_output_sha256}"'
+        if byte_range:
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return response
+
+
+class ScanHistoryViewSet(LiveProgressMixin, GenericViewSet,RetrieveModelMixin,ListModelMixin):
+    queryset = ScanJob.objects.select_related('tool').all()
     serializer_class = ScanHistorySerializer
+    pagination_class = ScanHistoryPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        # Served by the (user, created_at) / (user, status, created_at) indexes
+        queryset = super().get_queryset().filter(user=self.request.user)
+
+        job_status = self.request.query_params.get('status') # type: ignore
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+
+        tool = self.request.query_params.get('tool') # type: ignore
+        if tool:
+            queryset = queryset.filter(tool_id=tool) if tool.isdigit() else queryset.filter(tool__name=tool)
+
+        return queryset
+
+
+class FindingViewSet(GenericViewSet, ListModelMixin):
+    """
+    Findings across all of the user's scans, filtered by ``?cve=``, ``?service=`` (plus ``?version=``
+    prefix), ``?severity=`` (comma-separated) and ``?job=``.
+
+    Each filter is served by an index: CVEs through the (cve, finding) index of the FindingCve table,
+    service/version and severity through (job, service, version) and (job, severity) per scan of the user.
+    """
+    queryset = Finding.objects.all()
+    serializer_class = FindingSearchSerializer
+    pagination_class = FindingPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(job__user=self.request.user)
+        params = self.request.query_params # type: ignore
+
+        cve = params.get('cve')
+        if cve:
+            queryset = queryset.filter(cve_links__cve_id=cve.strip().upper())
+
+        service = params.get('service')
+        if service:
+            queryset = queryset.filter(service=service)
+            version = params.get('version')
+            if version:
+                queryset = queryset.filter(version__startswith=version)
+
+        severity = params.get('severity')
+        if severity:
+            queryset = queryset.filter(severity__in=[s.strip().lower() for s in severity.split(',') if s.strip()])
+
+        job = params.get('job')
+        if job:
+            queryset = queryset.filter(job_id=job)
 
+        return queryset
 
+    def list(self, request, *args, **kwargs):
+        try:
+            return super().list(request, *args, **kwargs)
+        except DjangoValidationError:
+            return Response({"error": "Invalid job id"}, status=status.HTTP_400_BAD_REQUEST)
+
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+async def _authenticate(request):
+    """JWT authentication for plain async views, which DRF's view machinery doesn't cover."""
+    try:
+        auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return None, JsonResponse({"detail": str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    if auth is None:
+        return None, JsonResponse({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+    return auth[0], None
 
 
+async def wait_for_scan(request, pk):
+    """
+    Long-poll until a scan finishes or ``?timeout=`` seconds pass (capped by SCAN_WAIT_MAX_TIMEOUT).
+
+    Async view: under ASGI the wait costs a coroutine, not a worker thread, so quick scans
+    stay low latency for the client without tying up the web tier.
+    Returns 200 with the scan result when finished, 202 with the current status otherwise.
+    """
+    user, error = await _authenticate(request)
+    if error:
+        return error
+
+    try:
+        timeout = min(float(request.GET.get("timeout", settings.SCAN_WAIT_MAX_TIMEOUT)), settings.SCAN_WAIT_MAX_TIMEOUT)
+    except ValueError:
+        timeout = settings.SCAN_WAIT_MAX_TIMEOUT
+
+    jobs = ScanJob.objects.filter(user=user).only("job_id", "status", "progress", "current_step")
+    deadline = time.monotonic() + timeout
+    interval = settings.SCAN_WAIT_POLL_INTERVAL
+    while True:
+        try:
+            job = await jobs.aget(pk=pk)
+        except ScanJob.DoesNotExist:
+            return JsonResponse({"error": "Scan job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if job.status in FINISHED_STATUSES:
+            data = await sync_to_async(lambda: ScanResultSerializer(ScanJob.objects.get(pk=pk)).data)()
+            return JsonResponse({"ok": True, "data": data}, status=status.HTTP_200_OK)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            await sync_to_async(merge_live_progress)([job])
+            data = {
+                "job_id": str(job.job_id),
+                "status": job.status,
+                "progress": job.progress,
+                "current_step": job.current_step,
+            }
+            if job.status == "queued":
+                await sync_to_async(annotate_queue_positions)([job])
+                data["queue_position"] = job.queue_position
+            return JsonResponse({"ok": True, "data": data}, status=status.HTTP_202_ACCEPTED)
+
+        await asyncio.sleep(min(interval, remaining))
+        interval = min(interval * 2, 2.0)  # Back off so long waits stay cheap on the DB
+
+
+async def scan_events(request, pk):
+    """
+    Server-Sent Events stream of a scan's progress, fed by Redis pub/sub.
+
+    Sends the current state first, then every update the worker publishes, and closes
+    once the scan finishes. Dashboards subscribe once instead of polling the DB.
+    """
+    user, error = await _authenticate(request)
+    if error:
+        return error
+
+    jobs = ScanJob.objects.filter(user=user).only("job_id", "status", "progress", "current_step")
+    if not await jobs.filter(pk=pk).aexists():
+        return JsonResponse({"error": "Scan job not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    def event(payload):
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def stream():
+        updates = subscribe_progress(pk, heartbeat=settings.SCAN_EVENTS_HEARTBEAT)
+        try:
+            await anext(updates)  # Subscribed; read the snapshot only now so nothing slips in between
+            job = await jobs.aget(pk=pk)
+            await sync_to_async(merge_live_progress)([job])
+            yield event({"job_id": str(job.job_id), "status": job.status, "progress": job.progress, "current_step": job.current_step})
+            if job.status in FINISHED_STATUSES:
+                return
 
+            async for update in updates:
+                if update is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield event(update)
+                if update.get("status") in FINISHED_STATUSES:
+                    return
+        finally:
+            await updates.aclose()
 
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
+def metrics(request):
+    """Prometheus scrape endpoint, for scrapers holding METRICS_TOKEN; not served at all while none is configured."""
+    if not settings.METRICS_TOKEN:
+        return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    if not hmac.compare_digest(supplied.encode(), settings.METRICS_TOKEN.encode()):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    try:
+        body = render_metrics()
+    except redis.RedisError:
+        return HttpResponse("Metrics store unavailable\n", status=status.HTTP_503_SERVICE_UNAVAILABLE, content_type="text/plain")
+    return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")
 
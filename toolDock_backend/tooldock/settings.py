@@ -33,6 +33,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',  # ASGI runserver, so async views (scan long-polling) don't hold a worker thread
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -49,6 +50,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its latency covers the whole stack (scans.middleware)
+    'scans.middleware.request_metrics_middleware',
+    'core.middleware.query_inspector_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,6 +80,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'tooldock.wsgi.application'
+ASGI_APPLICATION = 'tooldock.asgi.application'
 
 
 # Database
@@ -144,6 +149,22 @@ CELERY_RESULT_BACKEND = "redis://redis:6379/0"
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
+# Safety net for the scan scheduler: dispatch normally happens on submit and on completion
+CELERY_BEAT_SCHEDULE = {
+    "dispatch-pending-scans": {"task": "scans.tasks.dispatch_pending_scans_task", "schedule": 30.0},
+    "reap-stale-scans": {"task": "scans.tasks.reap_stale_scans_task", "schedule": 60.0},
+}
+
+# Scan progress is published on Redis pub/sub and streamed to clients over SSE (scans/start/<id>/events/)
+SCAN_PROGRESS_REDIS_URL = os.getenv('SCAN_PROGRESS_REDIS_URL', CELERY_BROKER_URL)
+# Socket and connect timeout, in seconds, of the shared Redis client (scans.progress.get_redis), so a
+# Redis host that stalls without refusing connections fails its callers fast instead of hanging them
+SCAN_PROGRESS_REDIS_TIMEOUT = float(os.getenv('SCAN_PROGRESS_REDIS_TIMEOUT', 0.25))
+SCAN_EVENTS_HEARTBEAT = 15
+# Live progress of running scans; the ScanJob row is only written on state transitions.
+# Use scans.progress.DatabaseProgressBackend to write progress to the row instead.
+SCAN_PROGRESS_BACKEND = 'scans.progress.RedisProgressBackend'
+SCAN_PROGRESS_TTL = 60 * 60 * 24
 
 
 REST_FRAMEWORK = {
@@ -169,6 +190,127 @@ TOOL_RUNNERS = {
     "nmap": "tools.nmap_adapter.NmapRunner",
     # "whois": "tools.whois_adapter.WhoisRunner",
 }
+
+# Synthetic nmap runner (tools.fake_adapter) for benchmarks and load tests; never enable in production
+if os.getenv('ENABLE_FAKE_TOOLS', 'False') == 'True':
+    TOOL_RUNNERS["fake_nmap"] = "tools.fake_adapter.FakeNmapRunner"
+# The only directory options["fake_fixture"] may replay files from
+FAKE_TOOL_FIXTURES_DIR = os.getenv('FAKE_TOOL_FIXTURES_DIR', BASE_DIR / 'findings' / 'fixtures')
+
+# Tool subprocesses one worker process may supervise at once (tools.engine). Scan workers run
+# the threads pool: a scan thread only waits on the engine, so slots are cheap
+TOOL_ENGINE_MAX_PROCESSES = int(os.getenv('TOOL_ENGINE_MAX_PROCESSES', 128))
+
+# Nmap full scans of more than NMAP_DISCOVERY_MIN_HOSTS addresses first sweep for live hosts (-sn), then
+# scan only those, in parallel nmap processes of NMAP_DISCOVERY_BATCH_HOSTS hosts; options["discovery"] overrides
+NMAP_DISCOVERY_MIN_HOSTS = 64
+NMAP_DISCOVERY_BATCH_HOSTS = 32
+# Incremental rescans (options["incremental"]) re-probe the version of an unchanged open port once its
+# last probe is older than this many seconds; options["service_ttl"] overrides
+NMAP_SERVICE_TTL = int(os.getenv('NMAP_SERVICE_TTL', 7 * 24 * 3600))
+
+# Scan limits in seconds, per tool: wall clock ("timeout") and without any tool output ("idle_timeout");
+# None disables a limit. options["timeout"] / options["idle_timeout"] can only tighten them
+SCAN_DEFAULT_TIMEOUTS = {"timeout": 6 * 3600, "idle_timeout": None}
+SCAN_TOOL_TIMEOUTS = {
+    # nmap prints --stats-every 5s, so minutes of silence mean it is stuck
+    "nmap": {"timeout": 6 * 3600, "idle_timeout": 300},
+}
+
+# Raw tool output is stored gzip-compressed per job under this directory (mounted from ./findings in compose)
+SCAN_ARTIFACTS_DIR = os.getenv('SCAN_ARTIFACTS_DIR', BASE_DIR / 'findings' / 'raw')
+SCAN_ARTIFACTS_COMPRESSLEVEL = 6
+
+# Long-polling on scans/start/<id>/wait/: upper bound for ?timeout= and the initial DB poll interval (seconds)
+SCAN_WAIT_MAX_TIMEOUT = 30
+SCAN_WAIT_POLL_INTERVAL = 0.25
+
+# results/<id>/diff/: findings listed per set (new/resolved/unchanged) by default and at most (?limit=)
+SCAN_DIFF_LIMIT = 500
+SCAN_DIFF_MAX_LIMIT = 5000
+
+# Targets with more addresses than SCAN_SHARD_HOSTS are split into one Celery sub-scan per
+# SCAN_SHARD_HOSTS addresses, at most SCAN_MAX_SHARDS; options["shards"] overrides the count
+SCAN_SHARD_HOSTS = 256
+SCAN_MAX_SHARDS = 16
+
+# A scan identical (tool, normalized target, options) to one still running or completed within
+# SCAN_CACHE_TTL seconds reuses its results; 0 disables. options["force_refresh"] bypasses it
+SCAN_CACHE_TTL = int(os.getenv('SCAN_CACHE_TTL', 600))
+
+# Scan scheduler (scans.scheduler): jobs wait in the DB until a slot is free, then go to the Celery
+# queue of their lane. Tools with an estimated_duration above SCAN_LONG_SCAN_THRESHOLD seconds
+# run in the long lane, so a flood of full scans never sits in front of quick ones
+SCAN_LONG_SCAN_THRESHOLD = 120
+SCAN_LANE_QUEUES = {'quick': 'scans_quick', 'long': 'scans_long'}
+# Keep these in line with the concurrency of the workers consuming each queue (docker-compose.yml)
+SCAN_LANE_CONCURRENCY = {'quick': 64, 'long': 32}
+SCAN_USER_CONCURRENCY = int(os.getenv('SCAN_USER_CONCURRENCY', 4))
+SCAN_DEFAULT_TOOL_CONCURRENCY = 64
+SCAN_TOOL_CONCURRENCY = {}  # e.g. {"nmap": 4}
+# How many of the oldest pending jobs each dispatch round considers, and at most how many of them per user
+SCAN_SCHEDULER_WINDOW = 1000
+SCAN_SCHEDULER_USER_WINDOW = 100
+# Within a user, dispatch the scan expected to finish soonest first; each second a scan waits takes
+# SCAN_SCHEDULER_AGING seconds off its expected duration for this ranking, so long ones are not starved
+SCAN_SCHEDULER_SHORTEST_FIRST = True
+SCAN_SCHEDULER_AGING = 1.0
+# Stale jobs (reaped from beat): dispatched but not started after SCAN_DISPATCH_STALE_AFTER seconds means the
+# Celery message was lost, so the job is dispatched again; still running SCAN_RUNNING_STALE_GRACE seconds past
+# its time limit (SCAN_TOOL_TIMEOUTS) means its worker died, so the job fails. Either way its slot is freed
+SCAN_DISPATCH_STALE_AFTER = 15 * 60
+SCAN_RUNNING_STALE_GRACE = 15 * 60
+
+# Duration estimates (scans.estimates) learned from completed scans, per tool, scan type, ports and
+# target size: a group is trusted from SCAN_DURATION_MIN_SAMPLES runs, and past
+# SCAN_DURATION_MAX_SAMPLES older runs fade out. Rebuild from history with rebuild_duration_stats
+SCAN_DURATION_MIN_SAMPLES = 3
+SCAN_DURATION_MAX_SAMPLES = 200
+
+# Batch submissions (scans/batches/): targets per request
+SCAN_BATCH_MAX_TARGETS = int(os.getenv('SCAN_BATCH_MAX_TARGETS', 10000))
+
+# Bulk status polling (scans/start/status/): job ids per request
+SCAN_STATUS_MAX_IDS = int(os.getenv('SCAN_STATUS_MAX_IDS', 500))
+
+# Findings are written with bulk_create in batches of this size, one transaction per batch
+FINDINGS_BATCH_SIZE = int(os.getenv('FINDINGS_BATCH_SIZE', 500))
+# Flush a partial batch after this many seconds so streamed findings show up during the scan
+FINDINGS_FLUSH_INTERVAL = float(os.getenv('FINDINGS_FLUSH_INTERVAL', 2))
+
+# Local CVE index used to enrich findings (CVSS vector, CWE, remediation); build it with
+# `python manage.py load_cve_index <NVD JSON dumps>`. Enrichment is skipped while it doesn't exist
+CVE_INDEX_PATH = os.getenv('CVE_INDEX_PATH', BASE_DIR / 'findings' / 'cve' / 'index.sqlite3')
+CVE_INDEX_MMAP_SIZE = 1024 * 1024 * 1024
+
+# Prometheus metrics (scans.metrics): scan stage timings and API latency/query histograms, aggregated
+# in Redis across web and worker processes and served at /metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+# API request observations are aggregated per process and written to Redis this often, off the request path
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+# /metrics requires "Authorization: Bearer <token>"; without a token it answers 404, as it shares the API's port
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Query inspector (core.middleware): per-request SQL count and time, N+1 detection and budgets.
+# Meant for development and CI; core.query_inspector.assert_max_queries applies the same budgets in tests
+QUERY_INSPECTOR_ENABLED = os.getenv('QUERY_INSPECTOR_ENABLED', str(DEBUG)) == 'True'
+# Raise QueryBudgetExceeded instead of logging a warning (set in CI so offending requests fail tests)
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'
+# The same statement shape this many times in one request is reported as a likely N+1
+QUERY_REPEAT_THRESHOLD = int(os.getenv('QUERY_REPEAT_THRESHOLD', 5))
+# Max queries per request, by path prefix: the longest matching prefix applies, and of two keys with
+# the same prefix "METHOD /prefix/" wins over plain "/prefix/"
+QUERY_BUDGETS = {
+    'GET /scans/start/': 4,     # auth, job, queue position (pending scans + active set) while queued
+    'POST /scans/start/': 13,   # auth, tool, duration estimate, insert, cache lookup, scheduler round, refresh, queue position
+    '/scans/start/status/': 4,  # auth, jobs, queue positions (pending scans + active set) if any is queued
+    '/scans/results/': 5,       # auth, job, findings, queue position while queued
+    '/scans/histories/': 4,     # auth, page, queue positions of queued jobs on it
+    '/auth/users/me/': 2,       # auth, profile
+    'POST /auth/users/': 7,     # registration: username (twice) and email uniqueness, user and profile inserts in a savepoint
+    '/auth/users/': 2,          # auth, users joined with their profile
+}
+
 # LOGGING = {
 #     'version': 1,
 #     'disable_existing_loggers': False,
@@ -16,11 +16,13 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from scans.views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('home/', include('playground.urls')),
     path('scans/', include('scans.urls')),
-    path('auth/', include('djoser.urls')),
+    path('metrics', metrics, name='metrics'),
+    path('auth/', include('core.urls')),
     path('auth/', include('djoser.urls.jwt')),
 ]
@@ -0,0 +1,267 @@
+import asyncio
+import codecs
+import concurrent.futures
+import os
+import queue
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from django.conf import settings
+
+_DONE = object()
+
+
+class ProcessFailed(RuntimeError):
+    def __init__(self, args: List[str], returncode: int, stderr: str):
+        super().__init__(f'{os.path.basename(args[0])} failed with code {returncode}: {stderr}')
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class ProcessTimeout(RuntimeError):
+    pass
+
+
+class ProcessCancelled(RuntimeError):
+    pass
+
+
+class ProcessScope:
+    """
+    Groups the processes a thread starts inside ``with engine.scope(...)``.
+
+    They share one wall-clock deadline and an idle-output timeout, and ``cancel()`` (from any
+    thread) kills all of them. Runners that do their work in Python call ``check()`` instead.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, idle_timeout: Optional[float] = None):
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.cancelled = threading.Event()
+        self._handles: List['ProcessHandle'] = []
+        self._lock = threading.Lock()
+
+    def add(self, handle: 'ProcessHandle') -> None:
+        with self._lock:
+            self._handles.append(handle)
+        if self.cancelled.is_set():
+            handle.cancel()  # Cancelled while the process was being started
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        with self._lock:
+            handles = list(self._handles)
+        for handle in handles:
+            handle.cancel()
+
+    def check(self) -> None:
+        if self.cancelled.is_set():
+            raise ProcessCancelled('Scan was cancelled')
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise ProcessTimeout(f'Scan timed out (time limit of {self.timeout:g}s reached)')
+
+
+_local = threading.local()
+
+
+def current_scope() -> Optional[ProcessScope]:
+    return getattr(_local, 'scope', None)
+
+
+class ProcessHandle:
+    """A tool subprocess supervised by the engine; iterate ``lines()`` from any thread."""
+
+    def __init__(self, args: List[str]):
+        self.args = args
+        self.pid: Optional[int] = None
+        self._chunks: queue.Queue = queue.Queue()
+        self._future: Optional[concurrent.futures.Future] = None
+
+    def lines(self) -> Iterator[str]:
+        """
+        Yield stdout line by line as the process produces it.
+
+        Raises ProcessFailed, ProcessTimeout or ProcessCancelled once the output is exhausted
+        if the process did not exit cleanly. Abandoning the iterator kills the process.
+        """
+        pending = ''
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is _DONE:
+                    break
+                lines = (pending + chunk).splitlines(keepends=True)
+                pending = lines.pop() if lines and not lines[-1].endswith('\n') else ''
+                yield from lines
+            if pending:
+                yield pending
+            self.result()
+        finally:
+            self.cancel()
+
+    def result(self, timeout: Optional[float] = None) -> int:
+        try:
+            return self._future.result(timeout) # type: ignore
+        except concurrent.futures.CancelledError:
+            raise ProcessCancelled(f'{os.path.basename(self.args[0])} was cancelled')
+
+    def cancel(self) -> None:
+        """Kill the process (and its children) if it is still running. Safe from any thread."""
+        if self._future is not None and not self._future.done():
+            self._future.cancel()
+
+
+class ProcessEngine:
+    """
+    Runs tool subprocesses on one asyncio event loop in a background thread.
+
+    A single worker process can supervise many scans this way: each one costs a coroutine
+    plus the thread consuming its output, not a prefork child blocked in readline().
+    stdout and stderr are drained concurrently, so a chatty stderr can never fill its pipe
+    and stall the tool. Timeouts and cancellation kill the whole process group.
+    """
+
+    def __init__(self, max_processes: int, stderr_limit: int = 64 * 1024, kill_grace: float = 5.0):
+        self.max_processes = max_processes
+        self.stderr_limit = stderr_limit
+        self.kill_grace = kill_grace
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pid: Optional[int] = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # Started lazily, and again after a fork: the loop thread does not survive into the child
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='tool-engine', daemon=True).start()
+                self._slots = asyncio.Semaphore(self.max_processes)
+                self._loop, self._pid = loop, os.getpid()
+            return self._loop
+
+    @contextmanager
+    def scope(self, timeout: Optional[float] = None, idle_timeout: Optional[float] = None) -> Iterator[ProcessScope]:
+        scope = ProcessScope(timeout, idle_timeout)
+        previous, _local.scope = current_scope(), scope
+        try:
+            yield scope
+        finally:
+            _local.scope = previous
+
+    def start(self, args: List[str], timeout: Optional[float] = None, idle_timeout: Optional[float] = None) -> ProcessHandle:
+        """
+        Start ``args`` under supervision and return immediately.
+
+        :param timeout: Wall-clock limit in seconds; the current scope's deadline applies too.
+        :param idle_timeout: Seconds without any output (stdout or stderr) before the process is killed.
+        """
+        scope = current_scope()
+        deadline = time.monotonic() + timeout if timeout else None
+        if scope is not None:
+            scope.check()
+            if scope.deadline is not None:
+                deadline = min(deadline or scope.deadline, scope.deadline)
+            idle_timeout = idle_timeout or scope.idle_timeout
+
+        handle = ProcessHandle(args)
+        handle._future = asyncio.run_coroutine_threadsafe(self._supervise(handle, deadline, idle_timeout), self._ensure_loop())
+        if scope is not None:
+            scope.add(handle)
+        return handle
+
+    def run(self, args: List[str], timeout: Optional[float] = None, idle_timeout: Optional[float] = None) -> str:
+        return ''.join(self.start(args, timeout, idle_timeout).lines())
+
+    async def _supervise(self, handle: ProcessHandle, deadline: Optional[float], idle_timeout: Optional[float]) -> int:
+        try:
+            async with self._slots:
+                process = await asyncio.create_subprocess_exec(
+                    *handle.args,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True,  # Own process group, so a kill also reaches the tool's children
+                )
+                handle.pid = process.pid
+                stderr = bytearray()
+                last_output = time.monotonic()
+
+                async def pump_stdout():
+                    nonlocal last_output
+                    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+                    while chunk := await process.stdout.read(64 * 1024): # type: ignore
+                        last_output = time.monotonic()
+                        handle._chunks.put(decoder.decode(chunk))
+                    handle._chunks.put(decoder.decode(b'', final=True))
+
+                async def pump_stderr():
+                    nonlocal last_output
+                    while chunk := await process.stderr.read(64 * 1024): # type: ignore
+                        last_output = time.monotonic()
+                        stderr.extend(chunk)
+                        del stderr[:-self.stderr_limit]  # Only the tail is kept for error messages
+
+                work = asyncio.gather(pump_stdout(), pump_stderr(), process.wait())
+                name = os.path.basename(handle.args[0])
+                try:
+                    # Watchdog: wake up at the nearest deadline (wall clock or idle output) and check
+                    while True:
+                        now = time.monotonic()
+                        reasons = []
+                        if deadline is not None and now >= deadline:
+                            reasons.append('time limit reached')
+                        if idle_timeout and now - last_output >= idle_timeout:
+                            reasons.append(f'no output for {idle_timeout:g}s')
+                        if reasons:
+                            # Output produced before the kill still reaches the consumer
+                            await self._kill(process, drain=work)
+                            raise ProcessTimeout(f'{name} timed out ({reasons[0]})')
+
+                        wakeups = [t for t in (deadline, idle_timeout and last_output + idle_timeout) if t]
+                        done, _ = await asyncio.wait({work}, timeout=min(wakeups) - now if wakeups else None)
+                        if done:
+                            work.result()
+                            break
+                except asyncio.CancelledError:
+                    await asyncio.shield(self._kill(process, drain=work))
+                    raise
+
+                if process.returncode != 0:
+                    raise ProcessFailed(handle.args, process.returncode, stderr.decode('utf-8', errors='replace')) # type: ignore
+                return process.returncode
+        finally:
+            handle._chunks.put(_DONE)
+
+    async def _kill(self, process: asyncio.subprocess.Process, drain: Optional[asyncio.Future] = None) -> None:
+        """
+        SIGTERM the process group, then SIGKILL whatever is left after the grace period.
+
+        With ``drain``, also wait (bounded) for the output pumps to reach EOF so partial output is kept.
+        """
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(process.pid, sig)
+            except ProcessLookupError:
+                break
+            try:
+                await asyncio.wait_for(asyncio.shield(process.wait()), self.kill_grace)
+                break
+            except asyncio.TimeoutError:
+                continue
+        if drain is not None:
+            await asyncio.wait({drain}, timeout=self.kill_grace)
+            if not drain.done():
+                drain.cancel()
+
+
+_engine: Optional[ProcessEngine] = None
+
+
+def get_engine() -> ProcessEngine:
+    global _engine
+    if _engine is None:
+        _engine = ProcessEngine(settings.TOOL_ENGINE_MAX_PROCESSES)
+    return _engine
@@ -0,0 +1,137 @@
+import ipaddress
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+from django.conf import settings
+
+from .engine import current_scope
+
+
+def iter_target_addresses(target: str) -> Iterator[str]:
+    """Expand whitespace/comma separated IPs and CIDRs into single addresses; other tokens pass through."""
+    for token in target.replace(',', ' ').split():
+        try:
+            network = ipaddress.ip_network(token, strict=False)
+        except ValueError:
+            yield token
+            continue
+        if network.num_addresses == 1:
+            yield str(network.network_address)
+        else:
+            for address in network.hosts():
+                yield str(address)
+
+
+def iter_synthetic_nmap_xml(addresses: Iterable[str], ports_per_host: int = 3, vulns_per_port: int = 1) -> Iterator[str]:
+    """
+    Yield an Nmap -oX document line by line: one <host> per address, each with
+    ``ports_per_host`` open ports carrying ``vulns_per_port`` vulners entries.
+
+    Output is deterministic, so it can serve as a fixture.
+    """
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<!DOCTYPE nmaprun>\n'
+    yield '<nmaprun scanner="nmap" args="nmap -sV --script vulners" version="7.94" xmloutputversion="1.05">\n'
+    for index, address in enumerate(addresses):
+        yield f'<host starttime="0" endtime="0"><status state="up" reason="syn-ack"/>\n'
+        yield f'<address addr="{address}" addrtype="ipv4"/>\n'
+        yield '<ports>\n'
+        for p in range(ports_per_host):
+            port = 20 + (index + p * 7) % 1000
+            yield f'<port protocol="tcp" portid="{port}"><state state="open" reason="syn-ack"/>'
+            yield f'<service name="http" product="nginx" version="1.{p % 20}.{index % 10}" method="probed" conf="10"/>\n'
+            if vulns_per_port:
+                yield '<script id="vulners" output="">\n'
+                for v in range(vulns_per_port):
+                    cvss = round((index + p + v) % 100 / 10, 1)
+                    yield (
+                        f'<table><elem key="id">CVE-2021-{(index * 31 + p * 7 + v) % 100000:05d}</elem>'
+                        f'<elem key="cvss">{cvss}</elem><elem key="type">cve</elem>'
+                        f'<elem key="references">https://vulners.com/cve/CVE-2021-{v:05d}</elem></table>\n'
+                    )
+                yield '</script>\n'
+            yield '</port>\n'
+        yield '</ports>\n'
+        yield '</host>\n'
+    yield '<runstats><finished time="0" exit="success"/></runstats>\n'
+    yield '</nmaprun>\n'
+
+
+def write_synthetic_nmap_xml(path, hosts: int, ports_per_host: int, vulns_per_port: int) -> Path:
+    """Write a fixture of ``hosts`` hosts (10.0.0.0/8 onwards) to ``path``, unless it is there already."""
+    path = Path(path)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        addresses = (str(ipaddress.IPv4Address('10.0.0.1') + i) for i in range(hosts))
+        tmp_path = path.with_name(path.name + '.part')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(iter_synthetic_nmap_xml(addresses, ports_per_host, vulns_per_port))
+        tmp_path.replace(path)
+    return path
+
+
+def fixture_path(name: str) -> Path:
+    """The replay fixture ``name`` inside FAKE_TOOL_FIXTURES_DIR; paths resolving outside it are refused."""
+    root = Path(settings.FAKE_TOOL_FIXTURES_DIR).resolve()
+    path = (root / name).resolve()
+    if not path.is_relative_to(root):
+        raise ValueError(f"Fixture '{name}' is outside FAKE_TOOL_FIXTURES_DIR")
+    return path
+
+
+class FakeNmapRunner:
+    """
+    Stand-in for NmapRunner that never spawns nmap.
+
+    Emits synthetic Nmap XML for every address of the target, so scans, sharding and
+    benchmarks can run without network access. Shape is controlled through options:
+    ``fake_ports_per_host``, ``fake_vulns_per_port`` and ``fake_host_delay`` (seconds per host).
+    With ``fake_fixture`` (name of an XML file in FAKE_TOOL_FIXTURES_DIR, see write_synthetic_nmap_xml)
+    that file is replayed instead and the target is ignored.
+    Register it in TOOL_RUNNERS, e.g. ``"fake_nmap": "tools.fake_adapter.FakeNmapRunner"``,
+    or set ENABLE_FAKE_TOOLS=True.
+    """
+    supports_streaming = True
+    output_format = 'nmap'
+    max_parallelism = None
+    expected_duration = 1
+
+    def stream(self, target: str, options: dict, progress_callback: Optional[Callable[[int, str], None]] = None) -> Iterator[str]:
+        if options.get('fake_fixture'):
+            yield from self._replay(fixture_path(options['fake_fixture']))
+            return
+
+        addresses = list(iter_target_addresses(target))
+        delay = float(options.get('fake_host_delay', 0))
+        scope = current_scope()
+        done = 0
+
+        def paced(addresses):
+            nonlocal done
+            for address in addresses:
+                if delay:
+                    time.sleep(delay)
+                if scope is not None:
+                    scope.check()  # No subprocess to kill: honour cancel and timeouts between hosts
+                yield address
+                done += 1
+                if progress_callback:
+                    progress_callback(done * 100 // len(addresses), f'Port scanning - {done}/{len(addresses)} hosts')
+
+        yield from iter_synthetic_nmap_xml(
+            paced(addresses),
+            ports_per_host=int(options.get('fake_ports_per_host', 3)),
+            vulns_per_port=int(options.get('fake_vulns_per_port', 1)),
+        )
+
+    def _replay(self, path: Path) -> Iterator[str]:
+        scope = current_scope()
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if scope is not None and line.startswith('<host'):
+                    scope.check()
+                yield line
+
+    def run(self, target: str, options: dict, progress_callback: Optional[Callable[[int, str], None]] = None) -> str:
+        return ''.join(self.stream(target, options, progress_callback))
@@ -0,0 +1,337 @@
+import ipaddress
+import os
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from .engine import ProcessCancelled, ProcessEngine, ProcessFailed, ProcessTimeout
+from .fake_adapter import FakeNmapRunner, iter_target_addresses, write_synthetic_nmap_xml
+from .nmap_adapter import HostReader, NmapRunner, PhaseProgress
+
+
+class FakeNmapRunnerTests(SimpleTestCase):
+    def setUp(self):
+        self.fixtures_dir = Path(tempfile.mkdtemp(prefix='tooldock-fixtures-'))
+        self.settings_override = override_settings(FAKE_TOOL_FIXTURES_DIR=self.fixtures_dir)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def test_one_host_per_target_address(self):
+        output = ''.join(FakeNmapRunner().stream('10.0.0.0/30 10.0.1.9', {'fake_ports_per_host': 2}))
+        self.assertEqual(output.count('<host '), 3)
+        self.assertEqual(output.count('<port '), 6)
+        self.assertEqual(list(iter_target_addresses('10.0.0.0/30,example.com')), ['10.0.0.1', '10.0.0.2', 'example.com'])
+
+    def test_reports_progress_per_host(self):
+        updates = []
+        list(FakeNmapRunner().stream('10.0.0.0/29', {}, progress_callback=lambda progress, step: updates.append(progress)))
+        self.assertEqual(updates[-1], 100)
+        self.assertEqual(len(updates), 6)
+
+    def test_replays_a_fixture_from_the_fixtures_dir(self):
+        fixture = write_synthetic_nmap_xml(self.fixtures_dir / 'five.xml', hosts=5, ports_per_host=1, vulns_per_port=0)
+        output = ''.join(FakeNmapRunner().stream('ignored', {'fake_fixture': 'five.xml'}))
+        self.assertEqual(output, fixture.read_text())
+
+    def test_fixture_paths_outside_the_fixtures_dir_are_refused(self):
+        outside = Path(tempfile.mkdtemp()) / 'secret.xml'
+        outside.write_text('<nmaprun/>')
+        for name in (str(outside), '../' + outside.name, f'../{outside.parent.name}/secret.xml', '/etc/passwd'):
+            with self.subTest(name=name), self.assertRaises(ValueError):
+                list(FakeNmapRunner().stream('ignored', {'fake_fixture': name}))
+
+
+class PhaseProgressTests(SimpleTestCase):
+    """Progress from the task events nmap writes to its XML output (-oX - --stats-every)."""
+
+    def test_weighted_share_of_the_phases_done(self):
+        progress = PhaseProgress('quick')
+        self.assertIsNone(progress.feed('<host starttime="1"><status state="up"/>'))
+        self.assertEqual(progress.feed('<taskbegin task="ARP Ping Scan" time="1"/>'), 'Entering phase: ARP Ping Scan')
+        progress.feed('<taskend task="ARP Ping Scan" time="2"/>')
+        self.assertEqual(progress.progress, 15)
+        step = progress.feed('<taskprogress task="SYN Stealth Scan" time="3" percent="50.00" remaining="12" etc="15"/>')
+        self.assertEqual(step, 'SYN Stealth Scan - 50% complete, about 12s left')
+        self.assertEqual(progress.progress, 57)  # 15 + 85 * 50%
+
+    def test_phases_repeated_per_host_group_count_once_and_progress_never_goes_back(self):
+        progress = PhaseProgress('full')
+        for task in ('Ping Scan', 'SYN Stealth Scan', 'Service scan'):
+            progress.feed(f'<taskend task="{task}" time="1"/>')
+        self.assertEqual(progress.progress, 80)
+        progress.feed('<taskend task="Ping Scan" time="2"/>')  # The next host group
+        progress.feed('<taskprogress task="SYN Stealth Scan" time="3" percent="10.00"/>')
+        self.assertEqual(progress.progress, 80)
+        for task in ('NSE', 'OS detection'):
+            progress.feed(f'<taskend task="{task}" time="4"/>')
+        self.assertEqual(progress.progress, 99)  # 100 only once nmap has exited
+
+
+class FakeProcess:
+    def __init__(self, args, lines, error=None):
+        self.args, self._lines, self.error, self.cancelled = args, lines, error, False
+
+    def lines(self):
+        yield from self._lines
+        if self.error:
+            raise self.error
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeNmapEngine:
+    """
+    Stands in for the process engine under NmapRunner: a -sn sweep reports the ``live`` addresses
+    of its targets up (and one dead address down), any other scan reports port 22 open on each target.
+    """
+
+    def __init__(self, live=(), fail=()):
+        self.live = set(live)
+        self.fail = set(fail)  # Scans of these addresses exit with an error
+        self.started = []
+
+    def start(self, args):
+        targets = [str(address) for token in args if self._network(token) for address in self._network(token)]
+        if '-sn' in args:
+            dead = [address for address in targets if address not in self.live][:1]
+            hosts = [self._host(address, 'up') for address in targets if address in self.live]
+            hosts += [self._host(address, 'down') for address in dead]
+            task = 'Ping Scan'
+        else:
+            # Product and version only with version detection (-sV), as nmap does
+            service = '<service name="ssh" product="OpenSSH" version="9.6"/>' if '-sV' in args else '<service name="ssh"/>'
+            port = f'<port protocol="tcp" portid="22"><state state="open"/>{service}</port>'
+            hosts = [self._host(address, 'up', f'<ports>{port}</ports>') for address in targets]
+            task = 'SYN Stealth Scan'
+        lines = [
+            '<?xml version="1.0" encoding="UTF-8"?>\n', '<nmaprun scanner="nmap">\n',
+            f'<taskbegin task="{task}" time="1"/>\n', f'<taskprogress task="{task}" time="2" percent="50.00"/>\n',
+            *hosts, f'<taskend task="{task}" time="3"/>\n', '</nmaprun>\n',
+        ]
+        error = ProcessFailed(args, 1, 'boom') if self.fail & set(targets) else None
+        process = FakeProcess(args, lines, error)
+        self.started.append(process)
+        return process
+
+    @staticmethod
+    def _network(token):
+        try:
+            network = ipaddress.ip_network(token, strict=False)
+        except ValueError:
+            return None
+        return list(network.hosts()) or [network.network_address]
+
+    @staticmethod
+    def _host(address, state, children=''):
+        return f'<host><status state="{state}"/><address addr="{address}" addrtype="ipv4"/>{children}</host>\n'
+
+
+@override_settings(NMAP_DISCOVERY_MIN_HOSTS=8, NMAP_DISCOVERY_BATCH_HOSTS=2)
+class NmapDiscoveryPipelineTests(SimpleTestCase):
+    """Full scans of larger targets sweep for live hosts first, then scan only those, in parallel batches."""
+
+    def scan(self, engine, target='10.0.0.0/28', options=None):
+        updates = []
+        with mock.patch('tools.nmap_adapter.get_engine', return_value=engine):
+            output = NmapRunner().run(target, options or {}, progress_callback=lambda *update: updates.append(update))
+        return ET.fromstring(output), updates
+
+    @staticmethod
+    def addresses(document):
+        return sorted(host.find('address').get('addr') for host in document.iter('host'))
+
+    def test_only_live_hosts_are_scanned(self):
+        engine = FakeNmapEngine(live=['10.0.0.3', '10.0.0.7', '10.0.0.9'])
+        document, updates = self.scan(engine)
+
+        sweep, *batches = engine.started
+        self.assertIn('-sn', sweep.args)
+        self.assertEqual(len(batches), 2)
+        for batch in batches:
+            self.assertIn('-Pn', batch.args)
+            self.assertIn('-sV', batch.args)
+        self.assertEqual(sorted(arg for batch in batches for arg in batch.args if arg.startswith('10.')),
+                         ['10.0.0.3', '10.0.0.7', '10.0.0.9'])
+
+        # One document with the hosts of every batch, as the streaming parser expects
+        self.assertEqual((document.get('addresses'), document.get('live')), ('16', '3'))
+        self.assertEqual(self.addresses(document), ['10.0.0.3', '10.0.0.7', '10.0.0.9'])
+        self.assertEqual(len(list(document.iter('port'))), 3)
+        self.assertTrue(all(progress <= 10 for progress, step in updates if step.startswith('Host discovery')))
+        self.assertEqual(updates[-1], (100, 'Scan completed'))
+
+    def test_no_live_hosts(self):
+        engine = FakeNmapEngine(live=[])
+        document, updates = self.scan(engine)
+        self.assertEqual(len(engine.started), 1)
+        self.assertEqual(document.get('live'), '0')
+        self.assertEqual(self.addresses(document), [])
+        self.assertEqual(updates[-1], (100, 'Scan completed'))
+
+    def test_a_failed_batch_fails_the_scan_and_stops_the_others(self):
+        engine = FakeNmapEngine(live=['10.0.0.3', '10.0.0.7', '10.0.0.9'], fail=['10.0.0.9'])
+        with self.assertRaises(ProcessFailed):
+            self.scan(engine)
+        self.assertTrue(all(batch.cancelled for batch in engine.started[1:]))
+
+    def test_when_the_pipeline_is_used(self):
+        runner = NmapRunner()
+        self.assertTrue(runner.uses_discovery('10.0.0.0/28', {}))
+        self.assertFalse(runner.uses_discovery('10.0.0.0/29', {}))  # Not more than NMAP_DISCOVERY_MIN_HOSTS
+        self.assertFalse(runner.uses_discovery('10.0.0.0/28', {'scan_type': 'quick'}))
+        self.assertFalse(runner.uses_discovery('10.0.0.0/28', {'discovery': 'false'}))
+        self.assertTrue(runner.uses_discovery('10.0.0.1', {'discovery': True}))
+
+        engine = FakeNmapEngine(live=['10.0.0.1'])
+        document, _ = self.scan(engine, '10.0.0.0/29')
+        self.assertEqual(len(engine.started), 1)
+        self.assertNotIn('-sn', engine.started[0].args)
+        self.assertEqual(len(self.addresses(document)), 6)  # Every address is scanned directly
+
+
+@override_settings(NMAP_DISCOVERY_BATCH_HOSTS=1)
+class NmapIncrementalRescanTests(SimpleTestCase):
+    """Rescans sweep the ports, then probe only the ports not probed within the service TTL."""
+
+    def port(self, product):
+        return f'<port protocol="tcp" portid="22"><state state="open"/><service name="ssh" product="{product}"/></port>'
+
+    def rescan(self, engine, baseline, options=None):
+        updates = []
+        with mock.patch('tools.nmap_adapter.get_engine', return_value=engine):
+            output = ''.join(NmapRunner().stream_incremental(
+                '10.0.0.1 10.0.0.2 10.0.0.3', {'service_ttl': 3600, **(options or {})}, baseline,
+                progress_callback=lambda *update: updates.append(update),
+            ))
+        document = ET.fromstring(output)
+        return document, {host.find('address').get('addr'): host.find('ports/port') for host in document.iter('host')}, updates
+
+    def test_only_new_and_stale_ports_are_probed(self):
+        now = time.time()
+        baseline = {
+            '10.0.0.1': {'tcp/22': (self.port('CarriedSSH'), now - 60)},
+            '10.0.0.2': {'tcp/22': (self.port('StaleSSH'), now - 7200)},
+        }
+        engine = FakeNmapEngine()
+        document, ports, updates = self.rescan(engine, baseline)
+
+        sweep, *probes = engine.started
+        self.assertNotIn('-sV', sweep.args)
+        self.assertEqual([probe.args[-1] for probe in probes], ['10.0.0.2', '10.0.0.3'])
+        for probe in probes:
+            self.assertEqual(probe.args[probe.args.index('-p') + 1], 'T:22')
+
+        self.assertEqual((document.get('carried'), document.get('probed')), ('1', '2'))
+        self.assertEqual(ports['10.0.0.1'].find('service').get('product'), 'CarriedSSH')
+        self.assertAlmostEqual(float(ports['10.0.0.1'].get('checked')), now - 60, places=2)
+        self.assertEqual(ports['10.0.0.2'].find('service').get('product'), 'OpenSSH')
+        self.assertIsNone(ports['10.0.0.2'].get('checked'))
+        self.assertEqual(ports['10.0.0.3'].find('service').get('product'), 'OpenSSH')
+        self.assertEqual(updates[-1], (100, 'Scan completed'))
+
+    def test_nothing_changed(self):
+        now = time.time()
+        baseline = {address: {'tcp/22': (self.port('CarriedSSH'), now)} for address in ('10.0.0.1', '10.0.0.2', '10.0.0.3')}
+        engine = FakeNmapEngine()
+        document, ports, _ = self.rescan(engine, baseline)
+        self.assertEqual(len(engine.started), 1)
+        self.assertEqual({port.find('service').get('product') for port in ports.values()}, {'CarriedSSH'})
+
+    def test_a_zero_ttl_probes_every_port(self):
+        baseline = {'10.0.0.1': {'tcp/22': (self.port('CarriedSSH'), time.time())}}
+        engine = FakeNmapEngine()
+        document, _, _ = self.rescan(engine, baseline, {'service_ttl': 0})
+        self.assertEqual((document.get('carried'), document.get('probed')), ('0', '3'))
+
+    def test_quick_scans_run_as_usual(self):
+        engine = FakeNmapEngine()
+        self.rescan(engine, {}, {'scan_type': 'quick'})
+        self.assertEqual(len(engine.started), 1)
+        self.assertIn('--top-ports', engine.started[0].args)
+
+
+class HostReaderTests(SimpleTestCase):
+    document = (
+        '<?xml version="1.0"?><nmaprun><taskbegin task="Ping Scan"/>'
+        '<host><address addr="10.0.0.1" addrtype="ipv4"/></host><host><address addr="10.0.0.2" addrtype="ipv4"/></host>'
+        '</nmaprun>'
+    )
+
+    def test_hosts_come_out_as_they_are_completed(self):
+        reader = HostReader()
+        split = self.document.index('</host>') + 3
+        self.assertEqual(reader.feed(self.document[:split]), [])
+        hosts = reader.feed(self.document[split:].encode())  # Stored output is read back as bytes
+        self.assertEqual([host.find('address').get('addr') for host in hosts], ['10.0.0.1', '10.0.0.2'])
+        self.assertEqual(len(reader.root), 0)  # Finished elements are detached
+        reader.close()
+
+    def test_read_keeps_the_hosts_before_a_truncation(self):
+        hosts = HostReader.read([self.document[:self.document.rindex('</host>')]])
+        self.assertEqual(next(hosts).find('address').get('addr'), '10.0.0.1')
+        with self.assertRaises(ET.ParseError):
+            next(hosts)
+
+
+class ProcessEngineTests(SimpleTestCase):
+    def setUp(self):
+        self.engine = ProcessEngine(max_processes=4, kill_grace=1.0)
+
+    def python(self, code):
+        return [sys.executable, '-c', code]
+
+    def test_output_is_streamed_line_by_line(self):
+        self.assertEqual(self.engine.run(self.python('print("a"); print("b")')), 'a\nb\n')
+
+    def test_wall_clock_timeout_kills_the_process(self):
+        started = time.monotonic()
+        with self.assertRaises(ProcessTimeout), self.engine.scope(timeout=0.5):
+            self.engine.run(self.python('import time; time.sleep(30)'))
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_idle_timeout_keeps_what_was_printed(self):
+        lines = []
+        with self.assertRaises(ProcessTimeout), self.engine.scope(idle_timeout=0.5):
+            for line in self.engine.start(self.python('import time; print("partial", flush=True); time.sleep(30)')).lines():
+                lines.append(line)
+        self.assertEqual(lines, ['partial\n'])
+
+    def test_cancel_kills_the_whole_process_tree(self):
+        pid_file = Path(tempfile.mkdtemp()) / 'child.pid'
+        # The tool starts a child of its own, as nmap does with its scripts
+        code = (
+            'import subprocess, sys, time\n'
+            f'child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])\n'
+            f'open({str(pid_file)!r}, "w").write(str(child.pid))\n'
+            'print("started", flush=True); time.sleep(30)'
+        )
+        with self.engine.scope() as scope:
+            handle = self.engine.start(self.python(code))
+            lines = handle.lines()
+            self.assertEqual(next(lines), 'started\n')
+            threading.Timer(0.1, scope.cancel).start()
+            with self.assertRaises(ProcessCancelled):
+                list(lines)
+
+        child_pid = int(pid_file.read_text())
+        deadline = time.monotonic() + 5
+        while self._alive(child_pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(self._alive(child_pid))
+
+    @staticmethod
+    def _alive(pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        # A killed child of an exited parent may linger as a zombie until reparented and reaped
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split(')')[-1].split()[0] != 'Z'